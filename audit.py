@@ -0,0 +1,186 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import insert
+from models import db, ActivityLog
+
+# =============================================
+# GHI ACTIVITY LOG BẤT ĐỒNG BỘ, THEO LÔ
+# =============================================
+# log_activity chỉ đưa bản ghi vào hàng đợi trong bộ nhớ; một thread nền gom
+# các bản ghi và ghi bằng một câu INSERT nhiều dòng mỗi flush_interval_ms
+# hoặc khi đủ batch_size dòng, trên connection riêng (không đụng transaction của request).
+# - Backpressure: hàng đợi đầy thì request chờ tối đa enqueue_timeout_ms,
+#   quá thời gian đó bản ghi được ghi đồng bộ để không mất log
+# - Khi process tắt (atexit) hàng đợi được ghi hết trước khi thoát
+# - Lô bị lỗi được ghi lại từng dòng; dòng vẫn lỗi được in ra log ([AUDIT DEAD LETTER])
+# - Chế độ đồng bộ (AUDIT_LOG_ASYNC=false) ghi ngay từng bản ghi, dùng cho test/CLI
+
+class AuditWriter:
+
+    def __init__(self):
+        self.async_enabled = False
+        self.batch_size = 500
+        self.flush_interval = 0.2
+        self.enqueue_timeout = 0.05
+        self._engine = None
+        self._queue = queue.Queue(maxsize=10000)
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+
+    def configure(self, app):
+        self.async_enabled = app.config.get('AUDIT_LOG_ASYNC', True)
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL_MS', 200) / 1000
+        self.enqueue_timeout = app.config.get('AUDIT_ENQUEUE_TIMEOUT_MS', 50) / 1000
+        self._queue = queue.Queue(maxsize=app.config.get('AUDIT_QUEUE_SIZE', 10000))
+        with app.app_context():
+            self._engine = db.engine
+
+    def submit(self, row):
+        """Đưa một bản ghi vào hàng đợi (hoặc ghi ngay ở chế độ đồng bộ)"""
+        if not self.async_enabled or self._engine is None:
+            self._write_sync([row])
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put(row, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # Thread nền không theo kịp: ghi trực tiếp thay vì làm mất log
+            self._write([row])
+
+    def _write_sync(self, rows):
+        if self._engine is not None:
+            self._write(rows)
+            return
+        # Chưa cấu hình (vd: script ngoài create_app): dùng session hiện tại
+        def insert_rows(batch):
+            try:
+                db.session.execute(insert(ActivityLog), batch)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        self._write_with_fallback(rows, insert_rows)
+
+    def _write(self, rows):
+        """Ghi một lô bằng INSERT nhiều dòng trên connection riêng"""
+        def insert_rows(batch):
+            with self._engine.begin() as conn:
+                conn.execute(insert(ActivityLog), batch)
+        self._write_with_fallback(rows, insert_rows)
+
+    def _write_with_fallback(self, rows, insert_rows):
+        """
+        Một dòng lỗi (vd: vi phạm khóa ngoại) làm hỏng cả câu INSERT nhiều dòng:
+        khi đó ghi lại từng dòng, chỉ những dòng vẫn lỗi mới bị bỏ và được in ra log (dead letter).
+        """
+        try:
+            insert_rows(rows)
+            self.written += len(rows)
+            return
+        except Exception as e:
+            if len(rows) == 1:
+                self._dead_letter(rows[0], e)
+                return
+            print(f"ERROR LOGGING ACTIVITY (batch of {len(rows)}, retrying row by row): {e}")
+
+        for row in rows:
+            try:
+                insert_rows([row])
+                self.written += 1
+            except Exception as e:
+                self._dead_letter(row, e)
+
+    def _dead_letter(self, row, error):
+        self.failed += 1
+        print(f"ERROR LOGGING ACTIVITY: {error}")
+        print(f"[AUDIT DEAD LETTER] {row}")
+
+    def _ensure_started(self):
+        # Thread không đi theo fork (gunicorn --preload): mỗi process tự khởi động thread của mình
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _drain(self, limit):
+        rows = []
+        while len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            rows = []
+            # Gom đến khi đủ batch_size hoặc hết flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                rows.extend(self._drain(self.batch_size - len(rows)))
+            if rows:
+                self._write(rows)
+        self.flush()
+
+    def flush(self):
+        """Ghi toàn bộ bản ghi còn trong hàng đợi"""
+        while True:
+            rows = self._drain(self.batch_size)
+            if not rows:
+                return
+            self._write(rows)
+
+    def stop(self, timeout=5):
+        """Dừng thread nền và ghi nốt hàng đợi (gọi khi tắt process)"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+audit_writer = AuditWriter()
+atexit.register(audit_writer.stop)
+
+def init_audit_writer(app):
+    audit_writer.configure(app)
+
+def record_activity(user_id, action, entity_type=None, entity_id=None, description='',
+                    ip_address=None, user_agent=None):
+    """Tạo bản ghi ActivityLog và đưa vào audit_writer"""
+    try:
+        user_id = int(user_id) if user_id is not None else None
+    except (TypeError, ValueError):
+        pass
+    audit_writer.submit({
+        'user_id': user_id,
+        'action': action,
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'description': description,
+        'ip_address': ip_address,
+        'user_agent': user_agent,
+        'created_at': datetime.utcnow()
+    })
@@ -0,0 +1,134 @@
+from sqlalchemy import event
+from models import db
+from cache import MISSING, CacheStats, LRUCacheBackend, create_backend
+
+# =============================================
+# CACHE SLOT CÒN TRỐNG THEO (BÁC SĨ, NGÀY)
+# =============================================
+# Mỗi entry lưu kèm "stamp" = (độ dài slot, phiên bản (bác sĩ, ngày), phiên bản bác sĩ, phiên bản toàn cục).
+# - Đặt/hủy/đổi lịch: tăng phiên bản (doctor_id, ngày) bị ảnh hưởng
+# - Đổi lịch làm việc / ngày nghỉ: tăng phiên bản của bác sĩ
+# - Đổi ngày nghỉ: tăng thêm phiên bản ngày nghỉ, leave_index của mọi worker đọc lại từ DB
+# - Đổi appointment_buffer_minutes: độ dài slot trong stamp thay đổi, entry cũ tự hết hiệu lực
+# Phiên bản chỉ được tăng sau khi transaction commit, và stamp được đọc trước khi truy vấn DB:
+# request đọc dữ liệu cũ rồi ghi vào cache sau lúc tăng phiên bản sẽ ghi kèm stamp cũ,
+# nên entry đó không bao giờ được dùng (xóa entry thay vì tăng phiên bản không chặn được trường hợp này).
+
+SESSION_KEY = 'availability_dirty'
+GLOBAL_VERSION = ('gen', 'all')
+
+class AvailabilityCache:
+
+    def __init__(self, backend=None, ttl_seconds=300):
+        self.backend = backend or LRUCacheBackend()
+        self.ttl_seconds = ttl_seconds
+        self.stats = CacheStats()
+
+    def configure(self, backend, ttl_seconds):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.stats.reset()
+
+    def _stamp(self, doctor_id, day, buffer_minutes):
+        day_version, doctor_version, global_version = self.backend.get_counters(
+            [('gen', 'day', doctor_id, day), ('gen', 'doctor', doctor_id), GLOBAL_VERSION])
+        return (buffer_minutes, day_version, doctor_version, global_version)
+
+    def get_or_load(self, doctor_id, target_date, buffer_minutes, loader):
+        """Trả về slot còn trống từ cache, hoặc gọi loader() rồi lưu lại khi chưa có"""
+        day = target_date.isoformat()
+        key = ('availability', doctor_id, day)
+        # Stamp đọc trước loader(): nếu có commit làm tăng phiên bản trong lúc loader() chạy,
+        # entry ghi sau đó mang stamp cũ và bị bỏ qua ở lần đọc kế tiếp
+        stamp = self._stamp(doctor_id, day, buffer_minutes)
+
+        entry = self.backend.get(key)
+        if entry is not MISSING and entry[0] == stamp:
+            self.stats.record(hit=True)
+            return entry[1]
+
+        self.stats.record(hit=False)
+        value = loader()
+        self.backend.set(key, (stamp, value), ttl=self.ttl_seconds)
+        return value
+
+    def invalidate_day(self, doctor_id, target_date):
+        self.backend.incr(('gen', 'day', doctor_id, target_date.isoformat()))
+        self.stats.record_invalidation()
+
+    def invalidate_doctor(self, doctor_id):
+        self.backend.incr(('gen', 'doctor', doctor_id))
+        self.stats.record_invalidation()
+
+    def leave_versions(self, doctor_ids):
+        """Phiên bản ngày nghỉ của từng bác sĩ (dùng chung giữa các worker qua backend)"""
+        return self.backend.get_counters([('gen', 'leave', doctor_id) for doctor_id in doctor_ids])
+
+    def invalidate_leave(self, doctor_id):
+        self.backend.incr(('gen', 'leave', doctor_id))
+        self.invalidate_doctor(doctor_id)
+
+    def invalidate_all(self):
+        self.backend.incr(GLOBAL_VERSION)
+        self.stats.record_invalidation()
+
+availability_cache = AvailabilityCache()
+
+def init_availability_cache(app):
+    """Chọn backend theo cấu hình (AVAILABILITY_CACHE_URL trống = LRU trong process)"""
+    backend = create_backend(
+        app.config.get('AVAILABILITY_CACHE_URL'),
+        maxsize=app.config.get('AVAILABILITY_CACHE_SIZE', 4096),
+        prefix='availability'
+    )
+    availability_cache.configure(backend, app.config.get('AVAILABILITY_CACHE_TTL_SECONDS', 300))
+
+# =============================================
+# ĐÁNH DẤU THAY ĐỔI TRONG TRANSACTION
+# =============================================
+
+def _pending():
+    return db.session.info.setdefault(SESSION_KEY, set())
+
+def mark_day_changed(doctor_id, target_date):
+    """Slot của bác sĩ trong ngày thay đổi (đặt/hủy/đổi lịch)"""
+    _pending().add(('day', doctor_id, target_date))
+
+def mark_doctor_changed(doctor_id):
+    """Lịch làm việc hoặc ngày nghỉ của bác sĩ thay đổi"""
+    _pending().add(('doctor', doctor_id))
+
+def mark_leave_changed(doctor_id):
+    """Ngày nghỉ của bác sĩ thay đổi"""
+    _pending().add(('leave', doctor_id))
+
+def mark_all_changed():
+    """Cấu hình ảnh hưởng mọi bác sĩ thay đổi"""
+    _pending().add(('all',))
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_invalidations(session):
+    changes = session.info.pop(SESSION_KEY, None)
+    if not changes:
+        return
+    try:
+        for change in changes:
+            if change[0] == 'day':
+                availability_cache.invalidate_day(change[1], change[2])
+            elif change[0] == 'doctor':
+                availability_cache.invalidate_doctor(change[1])
+            elif change[0] == 'leave':
+                availability_cache.invalidate_leave(change[1])
+            else:
+                availability_cache.invalidate_all()
+    except Exception as e:
+        # Lỗi cache không được làm hỏng request đã commit; entry cũ sẽ hết hạn theo TTL
+        print(f"[AVAILABILITY CACHE] Invalidation error: {e}")
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_invalidations(session, previous_transaction):
+    # Rollback một SAVEPOINT (vd: flush_with_unique_code thử lại mã) hay transaction con của flush
+    # không hủy transaction ngoài: chỉ bỏ thay đổi khi chính transaction ngoài cùng rollback
+    if previous_transaction.parent is not None:
+        return
+    session.info.pop(SESSION_KEY, None)
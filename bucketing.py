@@ -0,0 +1,45 @@
+from decimal import Decimal
+from sqlalchemy import case, cast, func, select, Numeric
+
+# =============================================
+# GOM NHÓM (HISTOGRAM) TRONG SQL
+# =============================================
+# Thay cho việc kéo từng dòng về Python rồi đếm trong vòng lặp: Postgres tự gán bucket
+# cho mỗi dòng và chỉ trả về (bucket, số lượng) - vài dòng thay vì O(số bản ghi).
+# - range_buckets : CASE WHEN theo danh sách ngưỡng, mỗi bucket một nhãn
+# - width_buckets : width_bucket() chia [low, high) thành count khoảng bằng nhau
+# - bucket_counts : SELECT ..., bucket, COUNT(*) ... GROUP BY ..., bucket
+
+def range_buckets(expr, edges, labels, descending=False):
+    """
+    CASE gán nhãn theo ngưỡng (len(labels) == len(edges) + 1).
+    Tăng dần: expr < edges[0] -> labels[0], expr < edges[1] -> labels[1], ..., còn lại labels[-1].
+    descending=True so sánh bằng '>' (ví dụ ngày sinh càng gần hôm nay thì tuổi càng nhỏ).
+    """
+    if len(labels) != len(edges) + 1:
+        raise ValueError("range_buckets needs exactly one more label than edges")
+    whens = [((expr > edge) if descending else (expr < edge), label) for edge, label in zip(edges, labels)]
+    return case(*whens, else_=labels[-1])
+
+def width_buckets(expr, low, high, count):
+    """
+    Số thứ tự bucket như width_bucket() của Postgres: 1..count cho giá trị trong [low, high),
+    0 nếu nhỏ hơn low, count + 1 nếu từ high trở lên.
+    """
+    if count < 1 or high <= low:
+        raise ValueError("width_buckets needs count >= 1 and high > low")
+    return func.width_bucket(cast(expr, Numeric), cast(low, Numeric), cast(high, Numeric), count)
+
+def bucket_bounds(low, high, count):
+    """[(cận dưới, cận trên)] của bucket 1..count tạo bởi width_buckets"""
+    low, high = Decimal(str(low)), Decimal(str(high))
+    width = (high - low) / count
+    return [(low + width * i, low + width * (i + 1)) for i in range(count)]
+
+def bucket_counts(bucket_expr, *aggregates, group_by=()):
+    """
+    SELECT group_by..., bucket, count, aggregates... GROUP BY group_by..., bucket.
+    Trả về select() để nơi gọi thêm select_from/join/where.
+    """
+    bucket = bucket_expr.label('bucket')
+    return select(*group_by, bucket, func.count().label('count'), *aggregates).group_by(*group_by, bucket)
@@ -0,0 +1,143 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# =============================================
+# CACHE DÙNG CHUNG: LRU TRONG PROCESS HOẶC BACKEND CHIA SẺ (REDIS)
+# =============================================
+# Mọi backend có cùng giao diện get/set/delete/incr/get_many/clear,
+# nên tầng cache phía trên không cần biết dữ liệu nằm ở đâu.
+
+MISSING = object()
+
+class LRUCacheBackend:
+    """
+    Backend trong process: LRU có TTL, an toàn đa luồng.
+    Bộ đếm (incr) được giữ riêng và không bị LRU loại bỏ,
+    để số phiên bản không bao giờ quay về giá trị cũ.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counters(self, keys):
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class RedisCacheBackend:
+    """
+    Backend chia sẻ giữa các worker/process qua Redis (cần cài gói redis).
+    Key tuple được ghép thành chuỗi 'prefix:a:b:c', giá trị được pickle.
+    """
+
+    def __init__(self, url, prefix='dlkb'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, key):
+        parts = key if isinstance(key, tuple) else (key,)
+        return ':'.join([self.prefix] + [str(p) for p in parts])
+
+    def get(self, key):
+        raw = self._client.get(self._key(key))
+        return MISSING if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self._key(key), pickle.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self._client.delete(self._key(key))
+
+    def incr(self, key):
+        return self._client.incr(self._key(('counter',) + (key if isinstance(key, tuple) else (key,))))
+
+    def get_counters(self, keys):
+        raw = self._client.mget([self._key(('counter',) + k) for k in keys])
+        return [int(v) if v is not None else 0 for v in raw]
+
+    def clear(self):
+        for key in self._client.scan_iter(f'{self.prefix}:*'):
+            self._client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self._client.scan_iter(f'{self.prefix}:*'))
+
+def create_backend(url=None, maxsize=1024, prefix='dlkb'):
+    """Tạo backend theo URL cấu hình: 'redis://...' dùng Redis, để trống dùng LRU trong process"""
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RedisCacheBackend(url, prefix=prefix)
+    return LRUCacheBackend(maxsize=maxsize)
+
+class CacheStats:
+    """Bộ đếm hit/miss/invalidation của một cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_invalidation(self, count=1):
+        with self._lock:
+            self.invalidations += count
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / total, 4) if total else None
+        }
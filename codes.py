@@ -0,0 +1,194 @@
+import os
+import socket
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+# =============================================
+# SINH MÃ THEO THỜI GIAN (CROCKFORD BASE32 + CHECKSUM)
+# =============================================
+# Mã = PREFIX + 12 ký tự thân + 1 ký tự kiểm tra, ví dụ AP01J9Z3K7QX2M4.
+# Thân mã là số 60 bit: 40 bit mili-giây tính từ CODE_EPOCH | 10 bit node | 10 bit sequence.
+# - Không trùng trong một process (sequence tăng dần, hết sequence thì mượn mili-giây kế tiếp)
+#   và giữa các process nhờ node khác nhau: mỗi process (kể cả từng worker gunicorn sau fork)
+#   lấy node từ sequence code_node_id_seq của Postgres (0..1023, quay vòng), cộng với
+#   CODE_NODE_ID làm gốc. Không lấy được từ DB thì băm hostname + pid (có thể trùng).
+#   Nơi insert vẫn thử lại với mã mới khi gặp trùng (utils.flush_with_unique_code).
+# - Tăng dần theo thời gian nên insert vào B-tree của cột unique luôn nằm ở cuối index
+# - Ký tự kiểm tra (Luhn mod 32) phát hiện nhập sai một ký tự hoặc đảo hai ký tự liền nhau
+# - Chỉ truy vấn DB một lần mỗi process (lấy node)
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+BASE = len(ALPHABET)
+BODY_LENGTH = 12
+
+TIME_BITS = 40
+NODE_BITS = 10
+SEQUENCE_BITS = 10
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+CODE_EPOCH = datetime(2024, 1, 1)
+CODE_EPOCH_MS = 1704067200000
+
+# Ký tự dễ nhầm khi người dùng nhập tay
+_NORMALIZE = str.maketrans({'I': '1', 'L': '1', 'O': '0'})
+
+def _encode(value):
+    chars = []
+    for _ in range(BODY_LENGTH):
+        value, remainder = divmod(value, BASE)
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+def _decode(body):
+    value = 0
+    for char in body:
+        value = value * BASE + ALPHABET.index(char)
+    return value
+
+def checksum_char(body):
+    """Ký tự kiểm tra Luhn mod 32 của thân mã"""
+    total = 0
+    factor = 2
+    for char in reversed(body):
+        addend = factor * ALPHABET.index(char)
+        total += addend // BASE + addend % BASE
+        factor = 1 if factor == 2 else 2
+    return ALPHABET[(BASE - total % BASE) % BASE]
+
+def _default_node_id(lease=None):
+    base = int(os.environ.get('CODE_NODE_ID') or 0)
+    if lease is not None:
+        try:
+            leased = lease()
+        except Exception as e:
+            print(f"[CODES] Could not lease a node id: {e}")
+            leased = None
+        if leased is not None:
+            return (base + leased) & MAX_NODE
+    seed = f'{socket.gethostname()}:{os.getpid()}'.encode('utf-8')
+    return (base + zlib.crc32(seed)) & MAX_NODE
+
+class CodeGenerator:
+
+    def __init__(self, node_id=None):
+        self._fixed_node_id = node_id
+        self.node_lease = None  # hàm trả về node được cấp cho process, xem init_code_generator
+        self._lock = threading.Lock()
+        self._pid = None
+        self._node_id = None
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _reset_after_fork(self):
+        # Process con sau fork có pid khác: tính lại node và bắt đầu sequence mới
+        self._pid = os.getpid()
+        self._node_id = (self._fixed_node_id if self._fixed_node_id is not None
+                         else _default_node_id(self.node_lease))
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _next_values(self, count):
+        values = []
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset_after_fork()
+
+            now_ms = int(time.time() * 1000) - CODE_EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+
+            prefix = None
+            while len(values) < count:
+                if self._sequence > MAX_SEQUENCE:
+                    # Hết sequence trong mili-giây này (hoặc đồng hồ lùi): dùng mili-giây kế tiếp
+                    self._last_ms += 1
+                    self._sequence = 0
+                    prefix = None
+                if prefix is None:
+                    prefix = ((self._last_ms << NODE_BITS) | self._node_id) << SEQUENCE_BITS
+                values.append(prefix | self._sequence)
+                self._sequence += 1
+        return values
+
+    def next_code(self, prefix=''):
+        """Sinh một mã mới"""
+        body = _encode(self._next_values(1)[0])
+        return f'{prefix}{body}{checksum_char(body)}'
+
+    def next_codes(self, prefix, count):
+        """Sinh count mã liên tiếp (tăng dần) trong một lần khóa, dùng cho import hàng loạt"""
+        if count <= 0:
+            return []
+        codes = []
+        for value in self._next_values(count):
+            body = _encode(value)
+            codes.append(f'{prefix}{body}{checksum_char(body)}')
+        return codes
+
+code_generator = CodeGenerator()
+
+def init_code_generator(app):
+    """Cấp node cho mỗi process từ sequence code_node_id_seq (chỉ trên Postgres)"""
+    from sqlalchemy import text
+    from models import db
+
+    def lease():
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name != 'postgresql':
+            return None
+        with engine.begin() as conn:
+            return conn.execute(text("SELECT nextval('code_node_id_seq')")).scalar()
+
+    code_generator.node_lease = lease
+
+def next_code(prefix=''):
+    return code_generator.next_code(prefix)
+
+def next_codes(prefix, count):
+    return code_generator.next_codes(prefix, count)
+
+def normalize_code(code, prefix=''):
+    """Chuẩn hóa mã người dùng nhập (chữ hoa, bỏ gạch nối/khoảng trắng, I/L -> 1, O -> 0)"""
+    code = code.strip().upper().replace('-', '').replace(' ', '')
+    if prefix and code.startswith(prefix):
+        return prefix + code[len(prefix):].translate(_NORMALIZE)
+    return code.translate(_NORMALIZE)
+
+def is_valid_code(code, prefix=''):
+    """Kiểm tra định dạng và ký tự kiểm tra của mã"""
+    if not code or not code.startswith(prefix):
+        return False
+    payload = code[len(prefix):]
+    if len(payload) != BODY_LENGTH + 1 or any(char not in ALPHABET for char in payload):
+        return False
+    return checksum_char(payload[:-1]) == payload[-1]
+
+def code_timestamp(code, prefix=''):
+    """Thời điểm (UTC) mã được sinh ra, None nếu mã không hợp lệ"""
+    if not is_valid_code(code, prefix):
+        return None
+    value = _decode(code[len(prefix):len(prefix) + BODY_LENGTH])
+    return CODE_EPOCH + timedelta(milliseconds=value >> (NODE_BITS + SEQUENCE_BITS))
+
+
+if __name__ == '__main__':
+    # Benchmark & kiểm tra nhanh: python codes.py
+    import timeit
+
+    generator = CodeGenerator(node_id=1)
+    batch = generator.next_codes('AP', 100000)
+    assert len(set(batch)) == len(batch), "duplicate codes"
+    assert batch == sorted(batch), "codes are not time-ordered"
+    assert all(is_valid_code(code, 'AP') for code in batch[:1000])
+
+    runs = 100000
+    single = timeit.timeit(lambda: generator.next_code('AP'), number=runs)
+    bulk = timeit.timeit(lambda: generator.next_codes('AP', 1000), number=runs // 1000)
+    print(f"sample      : {batch[0]} ({code_timestamp(batch[0], 'AP')})")
+    print(f"next_code   : {runs / single:12,.0f} codes/s")
+    print(f"next_codes  : {runs / bulk:12,.0f} codes/s (batch 1000)")
@@ -15,3 +15,68 @@ class Config:
     JWT_TOKEN_LOCATION = ["headers"]
 
     VIETNAM_TIMEZONE = 'Asia/Ho_Chi_Minh'
+
+    # Giữ chỗ khi chờ thanh toán: tiến trình nền hủy các lịch hẹn pending hết hạn
+    HOLD_SWEEPER_ENABLED = os.environ.get('HOLD_SWEEPER_ENABLED', 'true').lower() == 'true'
+    HOLD_SWEEPER_INTERVAL_SECONDS = int(os.environ.get('HOLD_SWEEPER_INTERVAL_SECONDS', '60'))
+
+    # Tính lại bảng thống kê theo ngày (rollups); /api/stats trễ tối đa một chu kỳ
+    ROLLUP_REFRESH_ENABLED = os.environ.get('ROLLUP_REFRESH_ENABLED', 'true').lower() == 'true'
+    ROLLUP_REFRESH_INTERVAL_SECONDS = int(os.environ.get('ROLLUP_REFRESH_INTERVAL_SECONDS', '60'))
+
+    # Thời gian lưu response theo header Idempotency-Key
+    IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+    # Key đang xử lý quá thời gian này (process chết giữa chừng) được phép giành lại
+    IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '60'))
+
+    # Backend tìm kiếm: auto (nhận diện pg_trgm/unaccent), trigram hoặc like
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+
+    # Chỉ mục bệnh nhân/bác sĩ trong bộ nhớ cho /api/search/patients (tốn RAM mỗi worker)
+    PEOPLE_INDEX_ENABLED = os.environ.get('PEOPLE_INDEX_ENABLED', 'false').lower() == 'true'
+    # Chu kỳ đọc lại thay đổi từ worker khác vào index (giây)
+    PEOPLE_INDEX_SYNC_SECONDS = int(os.environ.get('PEOPLE_INDEX_SYNC_SECONDS', '5'))
+
+    # Truy vấn song song (global search, dashboard): số thread và thời gian chờ tối đa mỗi phần
+    FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', '8'))
+    GLOBAL_SEARCH_TIMEOUT_MS = int(os.environ.get('GLOBAL_SEARCH_TIMEOUT_MS', '2000'))
+    # Dashboard overview: số request được chạy song song cùng lúc (mỗi request giữ 5 connection)
+    DASHBOARD_MAX_PARALLEL = int(os.environ.get('DASHBOARD_MAX_PARALLEL', '2'))
+    DASHBOARD_TIMEOUT_MS = int(os.environ.get('DASHBOARD_TIMEOUT_MS', '3000'))
+
+    # Băm mật khẩu: cost factor của bcrypt và process pool riêng (0 worker = băm trực tiếp)
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', '12'))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '64'))
+    PASSWORD_HASH_TIMEOUT_SECONDS = int(os.environ.get('PASSWORD_HASH_TIMEOUT_SECONDS', '10'))
+
+    # Activity log ghi theo lô ở thread nền (false = ghi đồng bộ từng dòng, dùng cho test)
+    AUDIT_LOG_ASYNC = os.environ.get('AUDIT_LOG_ASYNC', 'true').lower() == 'true'
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', '500'))
+    AUDIT_FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', '200'))
+    AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', '10000'))
+    AUDIT_ENQUEUE_TIMEOUT_MS = int(os.environ.get('AUDIT_ENQUEUE_TIMEOUT_MS', '50'))
+
+    # Thời gian cache trạng thái tài khoản (is_active, role) khi kiểm tra token (giây), 0 = không kiểm tra.
+    # Để trống AUTH_STATUS_CACHE_URL dùng LRU trong process, hoặc đặt redis://... để việc khóa
+    # tài khoản / đổi role có hiệu lực ngay ở mọi worker
+    AUTH_STATUS_CACHE_SECONDS = int(os.environ.get('AUTH_STATUS_CACHE_SECONDS', '60'))
+    AUTH_STATUS_CACHE_URL = os.environ.get('AUTH_STATUS_CACHE_URL', '')
+    AUTH_STATUS_CACHE_SIZE = int(os.environ.get('AUTH_STATUS_CACHE_SIZE', '10000'))
+
+    # Registry cài đặt hệ thống: chu kỳ kiểm tra phiên bản mới trong DB (giây)
+    SETTINGS_REFRESH_SECONDS = int(os.environ.get('SETTINGS_REFRESH_SECONDS', '30'))
+
+    # Cache slot còn trống: để trống AVAILABILITY_CACHE_URL dùng LRU trong process,
+    # hoặc đặt redis://... để chia sẻ giữa các worker
+    AVAILABILITY_CACHE_URL = os.environ.get('AVAILABILITY_CACHE_URL', '')
+    AVAILABILITY_CACHE_SIZE = int(os.environ.get('AVAILABILITY_CACHE_SIZE', '4096'))
+    AVAILABILITY_CACHE_TTL_SECONDS = int(os.environ.get('AVAILABILITY_CACHE_TTL_SECONDS', '300'))
+
+    # Cache kết quả /api/stats theo kỳ số liệu: kỳ đã đóng, chỉ hôm nay, kỳ đang mở (tháng/năm hiện tại).
+    # Với nhiều worker nên dùng redis://... để việc xóa cache có hiệu lực với mọi worker
+    STATS_CACHE_URL = os.environ.get('STATS_CACHE_URL', '')
+    STATS_CACHE_SIZE = int(os.environ.get('STATS_CACHE_SIZE', '512'))
+    STATS_CACHE_CLOSED_TTL_SECONDS = int(os.environ.get('STATS_CACHE_CLOSED_TTL_SECONDS', '86400'))
+    STATS_CACHE_TODAY_TTL_SECONDS = int(os.environ.get('STATS_CACHE_TODAY_TTL_SECONDS', '30'))
+    STATS_CACHE_CURRENT_TTL_SECONDS = int(os.environ.get('STATS_CACHE_CURRENT_TTL_SECONDS', '300'))
@@ -0,0 +1 @@
+# Đặt ở thư mục gốc để pytest thêm thư mục này vào sys.path (tests/ import run, models...)
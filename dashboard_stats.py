@@ -0,0 +1,222 @@
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import event, func
+from models import db, Appointment, Payment, Patient, Doctor, Review
+from fanout import run_parallel
+
+# =============================================
+# TỔNG QUAN DASHBOARD (ĐẾM CÓ ĐIỀU KIỆN, CHẠY SONG SONG)
+# =============================================
+# Mỗi bảng chỉ được quét một lần: các chỉ số của cùng một bảng gom vào một câu
+# SELECT với COUNT(*) FILTER (WHERE ...) / SUM(...) FILTER (WHERE ...), 5 câu chạy song song
+# (thay cho 11 câu COUNT/SUM tuần tự trước đây).
+# Mỗi lần chạy song song giữ 5 connection của pool: tối đa DASHBOARD_MAX_PARALLEL request
+# được chạy song song cùng lúc, các request khác chạy tuần tự trên connection của chính nó.
+# Truy vấn lỗi hoặc quá DASHBOARD_TIMEOUT_MS: báo DashboardUnavailableError kèm tên các phần lỗi.
+
+class DashboardUnavailableError(Exception):
+    """Một số truy vấn của dashboard lỗi hoặc quá thời gian chờ"""
+
+    def __init__(self, sections):
+        super().__init__(f"Dashboard queries failed: {', '.join(sections)}")
+        self.sections = sections
+
+_parallel_slots = None
+_parallel_slots_lock = threading.Lock()
+
+def _get_parallel_slots():
+    global _parallel_slots
+    with _parallel_slots_lock:
+        if _parallel_slots is None:
+            _parallel_slots = threading.BoundedSemaphore(current_app.config.get('DASHBOARD_MAX_PARALLEL', 2))
+        return _parallel_slots
+
+def _period(today):
+    this_month_start = today.replace(day=1)
+    last_month_start = (this_month_start - timedelta(days=1)).replace(day=1)
+    return this_month_start, last_month_start
+
+def _patient_counts(today):
+    this_month_start, _ = _period(today)
+    row = db.session.query(
+        func.count(Patient.id),
+        func.count(Patient.id).filter(Patient.created_at >= this_month_start)
+    ).one()
+    return {'total': row[0], 'new_this_month': row[1]}
+
+def _doctor_counts(today):
+    total = db.session.query(func.count(Doctor.id)).filter(Doctor.is_available == True).scalar()
+    return {'total': total}
+
+def _appointment_counts(today):
+    row = db.session.query(
+        func.count(Appointment.id),
+        func.count(Appointment.id).filter(Appointment.appointment_date == today),
+        func.count(Appointment.id).filter(
+            Appointment.appointment_date == today,
+            Appointment.status.in_(['confirmed', 'checked_in'])
+        ),
+        func.count(Appointment.id).filter(Appointment.status == 'pending')
+    ).one()
+    return {'total': row[0], 'today': row[1], 'today_confirmed': row[2], 'pending': row[3]}
+
+def _revenue_sums(today):
+    this_month_start, last_month_start = _period(today)
+    # WHERE chung khớp partial index idx_payments_completed_date
+    row = db.session.query(
+        func.sum(Payment.amount).filter(Payment.payment_date >= this_month_start),
+        func.sum(Payment.amount).filter(Payment.payment_date < this_month_start)
+    ).filter(
+        Payment.payment_status == 'completed',
+        Payment.payment_date >= last_month_start
+    ).one()
+    return {'this_month': row[0] or Decimal(0), 'last_month': row[1] or Decimal(0)}
+
+def _review_counts(today):
+    row = db.session.query(
+        func.avg(Review.rating).filter(Review.is_approved == True),
+        func.count(Review.id).filter(Review.is_approved == False)
+    ).one()
+    return {'average_rating': row[0] or 0, 'pending_count': row[1]}
+
+OVERVIEW_QUERIES = {
+    'patients': _patient_counts,
+    'doctors': _doctor_counts,
+    'appointments': _appointment_counts,
+    'revenue': _revenue_sums,
+    'reviews': _review_counts
+}
+
+def _format_overview(parts):
+    revenue = parts['revenue']
+    revenue_change = 0
+    if revenue['last_month'] > 0:
+        revenue_change = ((revenue['this_month'] - revenue['last_month']) / revenue['last_month']) * 100
+
+    return {
+        'patients': parts['patients'],
+        'doctors': parts['doctors'],
+        'appointments': parts['appointments'],
+        'revenue': {
+            'this_month': str(revenue['this_month']),
+            'last_month': str(revenue['last_month']),
+            'change_percent': round(float(revenue_change), 2)
+        },
+        'reviews': {
+            'average_rating': round(float(parts['reviews']['average_rating']), 2),
+            'pending_count': parts['reviews']['pending_count']
+        }
+    }
+
+def load_dashboard_overview(today=None, parallel=True):
+    """Dữ liệu cho GET /api/stats/dashboard/overview"""
+    today = today or date.today()
+    slots = _get_parallel_slots() if parallel else None
+    if slots is None or not slots.acquire(blocking=False):
+        return _format_overview({name: query(today) for name, query in OVERVIEW_QUERIES.items()})
+
+    timeout_ms = current_app.config.get('DASHBOARD_TIMEOUT_MS', 3000)
+    try:
+        outcome = run_parallel(
+            {name: (lambda query=query: query(today)) for name, query in OVERVIEW_QUERIES.items()},
+            timeout_ms=timeout_ms,
+            statement_timeout_ms=timeout_ms
+        )
+    finally:
+        slots.release()
+    if outcome.partial:
+        raise DashboardUnavailableError(outcome.failed + outcome.timed_out)
+    return _format_overview(outcome.results)
+
+# =============================================
+# BENCHMARK (flask benchmark-dashboard)
+# =============================================
+
+def _legacy_dashboard_overview(today):
+    """Cách tính cũ: 11 truy vấn tuần tự, giữ lại chỉ để so sánh trong benchmark"""
+    this_month_start, last_month_start = _period(today)
+    parts = {
+        'patients': {
+            'total': Patient.query.count(),
+            'new_this_month': Patient.query.filter(Patient.created_at >= this_month_start).count()
+        },
+        'doctors': {'total': Doctor.query.filter_by(is_available=True).count()},
+        'appointments': {
+            'total': Appointment.query.count(),
+            'today': Appointment.query.filter_by(appointment_date=today).count(),
+            'today_confirmed': Appointment.query.filter(
+                Appointment.appointment_date == today,
+                Appointment.status.in_(['confirmed', 'checked_in'])
+            ).count(),
+            'pending': Appointment.query.filter_by(status='pending').count()
+        },
+        'revenue': {
+            'this_month': db.session.query(func.sum(Payment.amount)).filter(
+                Payment.payment_status == 'completed',
+                Payment.payment_date >= this_month_start
+            ).scalar() or Decimal(0),
+            'last_month': db.session.query(func.sum(Payment.amount)).filter(
+                Payment.payment_status == 'completed',
+                Payment.payment_date >= last_month_start,
+                Payment.payment_date < this_month_start
+            ).scalar() or Decimal(0)
+        },
+        'reviews': {
+            'average_rating': db.session.query(func.avg(Review.rating)).filter(
+                Review.is_approved == True
+            ).scalar() or 0,
+            'pending_count': Review.query.filter_by(is_approved=False).count()
+        }
+    }
+    return _format_overview(parts)
+
+def benchmark_dashboard(runs=20):
+    """
+    So sánh số câu SQL và độ trễ (ms) của cách cũ với cách mới (tuần tự và song song).
+    Cần app context; chỉ đọc dữ liệu.
+    """
+    today = date.today()
+    variants = {
+        'legacy (11 queries, sequential)': lambda: _legacy_dashboard_overview(today),
+        'filtered aggregates, sequential': lambda: load_dashboard_overview(today, parallel=False),
+        'filtered aggregates, parallel': lambda: load_dashboard_overview(today)
+    }
+
+    counter = {'statements': 0}
+    lock = threading.Lock()
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        # Bỏ qua SET LOCAL statement_timeout của fan-out
+        if not statement.lstrip().upper().startswith('SET '):
+            with lock:
+                counter['statements'] += 1
+
+    results = {}
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        expected = None
+        for name, run in variants.items():
+            run()  # làm nóng connection pool
+            counter['statements'] = 0
+            latencies = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                data = run()
+                latencies.append((time.perf_counter() - started) * 1000)
+                db.session.rollback()
+            if expected is None:
+                expected = data
+            latencies.sort()
+            results[name] = {
+                'queries': counter['statements'] // runs,
+                'p50_ms': round(latencies[len(latencies) // 2], 2),
+                'max_ms': round(latencies[-1], 2),
+                'same_result': data == expected
+            }
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+    return results
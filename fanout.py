@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app
+from sqlalchemy import text
+from models import db
+
+# =============================================
+# CHẠY SONG SONG NHIỀU TRUY VẤN ĐỌC (FAN-OUT)
+# =============================================
+# Mỗi tác vụ chạy trong một thread của pool dùng chung, với app context riêng nên
+# db.session (scoped theo app context) là session riêng và lấy connection riêng từ pool.
+# Tác vụ chỉ nên đọc dữ liệu và trả về dữ liệu thuần (dict/list), không trả về object ORM
+# vì session bị đóng khi thread rời app context.
+# Quá thời gian chờ: trả về kết quả của các tác vụ đã xong; trên Postgres, statement_timeout
+# hủy truy vấn chậm phía server để connection sớm được trả về pool.
+
+class FanOutResult:
+
+    def __init__(self):
+        self.results = {}       # tên -> giá trị trả về
+        self.timings_ms = {}    # tên -> thời gian chạy (ms), None nếu chưa xong
+        self.timed_out = []
+        self.failed = []
+
+    @property
+    def partial(self):
+        return bool(self.timed_out or self.failed)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def _get_executor(app):
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Thread không sống sót qua fork: process con tạo pool mới
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get('FANOUT_WORKERS', 8), thread_name_prefix='fanout'
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+def _run_task(app, fn, statement_timeout_ms):
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            if statement_timeout_ms and db.engine.dialect.name == 'postgresql':
+                db.session.execute(text(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}"))
+            return fn(), (time.perf_counter() - started) * 1000
+        finally:
+            # Chỉ đọc: rollback để trả connection về pool ngay
+            db.session.rollback()
+
+def run_parallel(tasks, timeout_ms=None, statement_timeout_ms=None):
+    """
+    Chạy các tác vụ {tên: hàm không tham số} song song, chờ tối đa timeout_ms.
+    Trả về FanOutResult; tác vụ lỗi hoặc quá giờ không có trong results.
+    """
+    app = current_app._get_current_object()
+    executor = _get_executor(app)
+    futures = {
+        executor.submit(_run_task, app, fn, statement_timeout_ms): name
+        for name, fn in tasks.items()
+    }
+    done, _ = wait(futures, timeout=timeout_ms / 1000 if timeout_ms else None)
+
+    outcome = FanOutResult()
+    for future, name in futures.items():
+        if future not in done:
+            future.cancel()
+            outcome.timed_out.append(name)
+            outcome.timings_ms[name] = None
+            continue
+        try:
+            outcome.results[name], elapsed = future.result()
+            outcome.timings_ms[name] = round(elapsed, 1)
+        except Exception as e:
+            print(f"[FANOUT] Task '{name}' failed: {e}")
+            outcome.failed.append(name)
+            outcome.timings_ms[name] = None
+    return outcome
@@ -0,0 +1,144 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import multiprocessing
+
+import bcrypt
+
+# =============================================
+# DỊCH VỤ BĂM MẬT KHẨU (BCRYPT TRONG PROCESS POOL RIÊNG)
+# =============================================
+# bcrypt tốn CPU có chủ đích; khi nhiều người đăng nhập cùng lúc, việc băm chạy
+# ngay trong worker web sẽ chiếm hết CPU của các request khác.
+# Các thao tác băm/kiểm tra được chuyển sang một ProcessPoolExecutor có giới hạn:
+# - PASSWORD_HASH_WORKERS: số process băm (0 = chạy trực tiếp, dùng cho test/dev)
+# - PASSWORD_HASH_MAX_PENDING: số thao tác tối đa đang chờ; vượt quá thì báo HashingBusyError
+# - BCRYPT_LOG_ROUNDS: cost factor; hash cũ có cost khác sẽ được băm lại khi đăng nhập
+# Module này không import Flask/models để process con khởi động nhanh. Process con kiểu spawn
+# vẫn import lại file chạy chính dưới tên __mp_main__: run.py không tạo app trong trường hợp đó.
+# bcrypt >= 5 báo lỗi với mật khẩu dài hơn 72 byte thay vì tự cắt như bản 4.x: mật khẩu được
+# cắt còn 72 byte trước khi băm/kiểm tra để hash cũ vẫn khớp.
+
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+class HashingBusyError(Exception):
+    """Hàng đợi băm mật khẩu đã đầy"""
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds, prefix=b'2b'))
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+def get_hash_rounds(password_hash):
+    """Đọc cost factor từ chuỗi hash dạng $2b$12$..."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def _password_bytes(password):
+    return password.encode('utf-8')[:BCRYPT_MAX_PASSWORD_BYTES]
+
+class PasswordHasher:
+
+    def __init__(self, rounds=12, workers=0, max_pending=64, timeout=10):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, rounds, workers, max_pending, timeout):
+        self.shutdown()
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _get_executor(self):
+        # Pool không đi theo fork: mỗi process web tự tạo pool của mình
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingBusyError("Password hashing queue is full")
+        future = None
+        try:
+            future = self._get_executor().submit(fn, *args)
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Bỏ thao tác còn chờ trong hàng đợi của pool để không chiếm process băm
+            # (thao tác đã bắt đầu chạy thì không dừng được, sẽ tự kết thúc)
+            future.cancel()
+            raise HashingBusyError("Password hashing timed out")
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Băm mật khẩu với cost hiện tại, trả về chuỗi hash"""
+        return self._run(_hash, _password_bytes(password), self.rounds).decode('utf-8')
+
+    def check(self, password_hash, password):
+        """So khớp mật khẩu với hash đã lưu"""
+        if not password_hash or password is None:
+            return False
+        return self._run(_check, _password_bytes(password), password_hash.encode('utf-8'))
+
+    def needs_rehash(self, password_hash):
+        """Hash được tạo với cost khác cấu hình hiện tại"""
+        return get_hash_rounds(password_hash) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._pid = None
+
+password_hasher = PasswordHasher()
+
+def init_password_hasher(app):
+    password_hasher.configure(
+        rounds=app.config.get('BCRYPT_LOG_ROUNDS', 12),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 0),
+        max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING', 64),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT_SECONDS', 10)
+    )
+
+
+if __name__ == '__main__':
+    # Benchmark: số lượt đăng nhập (checkpw) mỗi giây theo cost factor, chạy trực tiếp và qua pool
+    # Chạy: python hashing.py
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    logins = 64
+    concurrency = 16
+    workers = os.cpu_count() or 2
+
+    for rounds in (10, 11, 12):
+        stored = _hash(b'correct horse', rounds).decode('utf-8')
+        for label, pool_workers in (('inline', 0), (f'pool x{workers}', workers)):
+            hasher = PasswordHasher(rounds=rounds, workers=pool_workers, max_pending=logins, timeout=120)
+            hasher.check(stored, 'warm up')
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as requests:
+                assert all(requests.map(lambda _: hasher.check(stored, 'correct horse'), range(logins)))
+            elapsed = time.perf_counter() - started
+            hasher.shutdown()
+            print(f"cost={rounds} {label:>10}: {logins / elapsed:8.1f} logins/s "
+                  f"({elapsed * 1000 / logins:6.1f} ms/login)")
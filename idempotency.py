@@ -0,0 +1,120 @@
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, jsonify, make_response, current_app
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import delete, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import db, IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 100
+
+# Key được giành và commit trước khi chạy handler (handler tự commit), response được lưu ở
+# transaction sau. Nếu process chết / mất kết nối giữa hai bước đó, bản ghi kẹt ở
+# status_code IS NULL: quá IDEMPOTENCY_LEASE_SECONDS kể từ lúc giành, bản ghi được coi là
+# bị bỏ dở và lần gửi lại được giành key chạy lại handler (thay vì nhận 409 đến hết TTL).
+# Nếu handler lần trước đã kịp commit, lần chạy lại đi qua kiểm tra nghiệp vụ như request mới.
+
+def _request_hash():
+    """SHA-256 của body request, dùng để phát hiện cùng key nhưng khác nội dung"""
+    return hashlib.sha256(request.get_data(cache=True)).hexdigest()
+
+def _claim_key(user_id, key, request_hash, now):
+    """
+    Giành quyền xử lý key bằng INSERT ... ON CONFLICT DO NOTHING.
+    Trả về id của bản ghi mới, hoặc None nếu key đã tồn tại.
+    """
+    ttl_hours = current_app.config.get('IDEMPOTENCY_KEY_TTL_HOURS', 24)
+    stmt = pg_insert(IdempotencyKey).values(
+        user_id=user_id,
+        key=key,
+        endpoint=request.path,
+        request_hash=request_hash,
+        created_at=now,
+        expires_at=now + timedelta(hours=ttl_hours)
+    ).on_conflict_do_nothing(
+        index_elements=['user_id', 'key']
+    ).returning(IdempotencyKey.id)
+    return db.session.execute(stmt).scalar()
+
+def idempotent(fn):
+    """
+    Decorator cho các API tạo mới (dùng sau @jwt_required).
+    Nếu request có header Idempotency-Key, response đầu tiên được lưu lại;
+    các lần gửi lại cùng key sẽ nhận đúng response đó mà không chạy lại handler.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return fn(*args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"msg": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters"}), 400
+
+        user_id = int(get_jwt_identity())
+        request_hash = _request_hash()
+        now = datetime.utcnow()
+
+        record_id = _claim_key(user_id, key, request_hash, now)
+        if record_id is None:
+            record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+            lease = timedelta(seconds=current_app.config.get('IDEMPOTENCY_LEASE_SECONDS', 60))
+
+            abandoned = (record is not None and record.status_code is None
+                         and record.created_at <= now - lease
+                         and record.endpoint == request.path and record.request_hash == request_hash)
+
+            if record and (record.expires_at <= now or abandoned):
+                # Key cũ đã hết hạn, hoặc lần xử lý trước bị bỏ dở: xóa rồi giành lại.
+                # Hai lần gửi lại cùng lúc: lần sau xóa 0 dòng, giành key thất bại và nhận 409
+                db.session.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.id == record.id,
+                    or_(IdempotencyKey.expires_at <= now, IdempotencyKey.status_code.is_(None))
+                ))
+                record_id = _claim_key(user_id, key, request_hash, now)
+            elif record:
+                db.session.rollback()
+                if record.endpoint != request.path or record.request_hash != request_hash:
+                    return jsonify({"msg": f"{IDEMPOTENCY_HEADER} was already used with a different request"}), 422
+                if record.status_code is None:
+                    return jsonify({"msg": "A request with this Idempotency-Key is still being processed"}), 409
+                response = current_app.response_class(
+                    record.response_body, status=record.status_code, mimetype='application/json'
+                )
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            if record_id is None:
+                db.session.rollback()
+                return jsonify({"msg": "A request with this Idempotency-Key is still being processed"}), 409
+        db.session.commit()
+
+        try:
+            response = make_response(fn(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == record_id))
+            db.session.commit()
+            raise
+
+        # Chỉ lưu kết quả xác định; lỗi server cho phép client thử lại với cùng key
+        if response.status_code >= 500:
+            db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == record_id))
+        else:
+            IdempotencyKey.query.filter_by(id=record_id).update({
+                'status_code': response.status_code,
+                'response_body': response.get_data(as_text=True)
+            }, synchronize_session=False)
+        db.session.commit()
+        return response
+
+    return wrapper
+
+def purge_expired_keys():
+    """Xóa các idempotency key đã hết hạn. Trả về số dòng bị xóa. Không commit."""
+    result = db.session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.utcnow())
+    )
+    return result.rowcount
@@ -0,0 +1,125 @@
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, date, timedelta
+from models import DoctorLeave
+from availability_cache import availability_cache
+
+# =============================================
+# CHỈ MỤC NGÀY NGHỈ BÁC SĨ (IN-MEMORY)
+# =============================================
+
+def _leave_interval(leave):
+    """Chuyển DoctorLeave thành khoảng [start, end) theo datetime"""
+    day_start = datetime.combine(leave.leave_date, datetime.min.time())
+    if leave.is_full_day or not leave.start_time or not leave.end_time:
+        return day_start, day_start + timedelta(days=1)
+    return (datetime.combine(leave.leave_date, leave.start_time),
+            datetime.combine(leave.leave_date, leave.end_time))
+
+def _merge_intervals(intervals):
+    """Gộp các khoảng chồng nhau, trả về hai list starts/ends đã sắp xếp"""
+    starts, ends = [], []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+class LeaveIndex:
+    """
+    Chỉ mục ngày nghỉ theo từng bác sĩ: các khoảng nghỉ được gộp thành danh sách
+    rời nhau đã sắp xếp, nên kiểm tra một slot có trùng ngày nghỉ chỉ mất O(log n).
+    Nạp từ DB ở lần dùng đầu tiên, làm mới khi có thay đổi (invalidate)
+    hoặc sau ttl_seconds.
+    Mỗi entry lưu kèm phiên bản ngày nghỉ của bác sĩ trong backend của availability_cache
+    (tăng sau commit qua mark_leave_changed); phiên bản được đối chiếu lại sau mỗi
+    version_check_seconds, nên worker khác thấy ngày nghỉ mới sau tối đa khoảng đó
+    (backend Redis; backend LRU chỉ đồng bộ trong một process).
+    """
+
+    def __init__(self, ttl_seconds=300, version_check_seconds=1):
+        self.ttl_seconds = ttl_seconds
+        self.version_check_seconds = version_check_seconds
+        self._lock = threading.Lock()
+        self._entries = {}  # doctor_id -> (loaded_at, checked_at, version, starts, ends)
+
+    def preload(self, doctor_ids):
+        """
+        Nạp ngày nghỉ của nhiều bác sĩ bằng một truy vấn (chỉ những bác sĩ hết hạn
+        hoặc đã đổi phiên bản). Trả về dict doctor_id -> entry.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = {doctor_id: self._entries.get(doctor_id) for doctor_id in doctor_ids}
+
+        stale = [d for d, entry in entries.items() if entry is None or now - entry[0] >= self.ttl_seconds]
+        to_check = [d for d, entry in entries.items()
+                    if d not in stale and now - entry[1] >= self.version_check_seconds]
+        if not stale and not to_check:
+            return entries
+
+        # Đọc phiên bản trước khi truy vấn DB: thay đổi commit sau đó sẽ làm entry hết hiệu lực
+        versions = dict(zip(stale + to_check, availability_cache.leave_versions(stale + to_check)))
+        for doctor_id in to_check:
+            loaded_at, _, version, starts, ends = entries[doctor_id]
+            if version == versions[doctor_id]:
+                entries[doctor_id] = (loaded_at, now, version, starts, ends)
+            else:
+                stale.append(doctor_id)
+
+        if stale:
+            leaves = DoctorLeave.query.filter(
+                DoctorLeave.doctor_id.in_(stale),
+                DoctorLeave.leave_date >= date.today()
+            ).all()
+
+            intervals = {doctor_id: [] for doctor_id in stale}
+            for leave in leaves:
+                intervals[leave.doctor_id].append(_leave_interval(leave))
+            for doctor_id, doctor_intervals in intervals.items():
+                starts, ends = _merge_intervals(doctor_intervals)
+                entries[doctor_id] = (now, now, versions[doctor_id], starts, ends)
+
+        with self._lock:
+            for doctor_id in to_check + stale:
+                self._entries[doctor_id] = entries[doctor_id]
+        return entries
+
+    def _get(self, doctor_id):
+        with self._lock:
+            entry = self._entries.get(doctor_id)
+        now = time.monotonic()
+        if entry is None or now - entry[1] >= self.version_check_seconds or now - entry[0] >= self.ttl_seconds:
+            # Dùng entry trả về thay vì đọc lại self._entries: invalidate chạy song song có thể vừa xóa nó
+            entry = self.preload([doctor_id])[doctor_id]
+        return entry
+
+    def overlaps(self, doctor_id, start_dt, end_dt):
+        """Kiểm tra khoảng [start_dt, end_dt) có trùng ngày nghỉ của bác sĩ không"""
+        _, _, _, starts, ends = self._get(doctor_id)
+        # Khoảng nghỉ đầu tiên kết thúc sau start_dt
+        i = bisect_right(ends, start_dt)
+        return i < len(starts) and starts[i] < end_dt
+
+    def is_on_leave(self, doctor_id, slot_date, start_time, end_time):
+        """Kiểm tra slot (ngày, giờ bắt đầu, giờ kết thúc) có rơi vào ngày nghỉ không"""
+        start_dt = datetime.combine(slot_date, start_time)
+        end_dt = datetime.combine(slot_date, end_time)
+        if end_dt <= start_dt:
+            end_dt += timedelta(days=1)
+        return self.overlaps(doctor_id, start_dt, end_dt)
+
+    def invalidate(self, doctor_id=None):
+        """Bỏ dữ liệu đã nạp trong process này (worker khác theo dõi qua mark_leave_changed)"""
+        with self._lock:
+            if doctor_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(doctor_id, None)
+
+leave_index = LeaveIndex()
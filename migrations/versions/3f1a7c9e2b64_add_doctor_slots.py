@@ -0,0 +1,38 @@
+"""Add doctor_slots table
+
+Revision ID: 3f1a7c9e2b64
+Revises: 926062b98eab
+Create Date: 2025-11-28 10:12:41.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a7c9e2b64'
+down_revision = '926062b98eab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('doctor_slots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('slot_date', sa.Date(), nullable=False),
+    sa.Column('start_time', sa.Time(), nullable=False),
+    sa.Column('end_time', sa.Time(), nullable=False),
+    sa.Column('capacity', sa.Integer(), nullable=False),
+    sa.Column('booked_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.CheckConstraint('booked_count >= 0', name='check_slot_booked_count'),
+    sa.ForeignKeyConstraint(['doctor_id'], ['doctors.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('doctor_id', 'slot_date', 'start_time', name='unique_doctor_slot')
+    )
+
+
+def downgrade():
+    op.drop_table('doctor_slots')
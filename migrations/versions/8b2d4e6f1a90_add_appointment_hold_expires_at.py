@@ -0,0 +1,29 @@
+"""Add hold_expires_at to appointments
+
+Revision ID: 8b2d4e6f1a90
+Revises: 3f1a7c9e2b64
+Create Date: 2025-11-29 14:03:17.552908
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2d4e6f1a90'
+down_revision = '3f1a7c9e2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('hold_expires_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('idx_appointments_hold_expires_at', ['hold_expires_at'], unique=False,
+                              postgresql_where=sa.text("status = 'pending' AND hold_expires_at IS NOT NULL"))
+
+
+def downgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('idx_appointments_hold_expires_at')
+        batch_op.drop_column('hold_expires_at')
@@ -0,0 +1,86 @@
+"""Add daily statistics rollup tables
+
+Revision ID: a9d3e5b7c2f1
+Revises: f2b8d6a4c19e
+Create Date: 2025-12-05 09:41:17.502936
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d3e5b7c2f1'
+down_revision = 'f2b8d6a4c19e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_appointment_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('stat_date', sa.Date(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('department_id', sa.Integer(), nullable=True),
+    sa.Column('doctor_id', sa.Integer(), nullable=True),
+    sa.Column('appointment_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_daily_appointment_stats_date', 'daily_appointment_stats', ['stat_date'])
+
+    op.create_table('daily_revenue_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('stat_date', sa.Date(), nullable=False),
+    sa.Column('payment_method', sa.String(length=50), nullable=True),
+    sa.Column('revenue', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('transaction_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_daily_revenue_stats_date', 'daily_revenue_stats', ['stat_date'])
+
+    op.create_table('daily_service_revenue_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('stat_date', sa.Date(), nullable=False),
+    sa.Column('service_id', sa.Integer(), nullable=True),
+    sa.Column('revenue', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_daily_service_revenue_stats_date', 'daily_service_revenue_stats', ['stat_date'])
+
+    op.create_table('daily_patient_stats',
+    sa.Column('stat_date', sa.Date(), nullable=False),
+    sa.Column('new_patients', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('stat_date')
+    )
+
+    op.create_table('rollup_dirty_days',
+    sa.Column('rollup', sa.String(length=30), nullable=False),
+    sa.Column('stat_date', sa.Date(), nullable=False),
+    sa.Column('marked_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('rollup', 'stat_date')
+    )
+
+    # Đánh dấu mọi ngày đã có dữ liệu: lần refresh đầu tiên (thread nền hoặc
+    # flask refresh-rollups) sẽ backfill toàn bộ rollup
+    op.execute("""
+        INSERT INTO rollup_dirty_days (rollup, stat_date, marked_at)
+        SELECT 'appointments', appointment_date, now() FROM appointments GROUP BY appointment_date
+        UNION SELECT 'revenue', DATE(payment_date), now() FROM payments
+            WHERE payment_date IS NOT NULL GROUP BY DATE(payment_date)
+        UNION SELECT 'service_revenue', DATE(payment_date), now() FROM payments
+            WHERE payment_date IS NOT NULL GROUP BY DATE(payment_date)
+        UNION SELECT 'patients', DATE(created_at), now() FROM patients
+            WHERE created_at IS NOT NULL GROUP BY DATE(created_at)
+    """)
+
+
+def downgrade():
+    op.drop_table('rollup_dirty_days')
+    op.drop_table('daily_patient_stats')
+    op.drop_index('idx_daily_service_revenue_stats_date', table_name='daily_service_revenue_stats')
+    op.drop_table('daily_service_revenue_stats')
+    op.drop_index('idx_daily_revenue_stats_date', table_name='daily_revenue_stats')
+    op.drop_table('daily_revenue_stats')
+    op.drop_index('idx_daily_appointment_stats_date', table_name='daily_appointment_stats')
+    op.drop_table('daily_appointment_stats')
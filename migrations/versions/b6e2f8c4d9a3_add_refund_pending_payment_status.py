@@ -0,0 +1,35 @@
+"""Allow refund_pending payment status
+
+Revision ID: b6e2f8c4d9a3
+Revises: a9d3e5b7c2f1
+Create Date: 2025-12-08 10:12:44.318506
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2f8c4d9a3'
+down_revision = 'a9d3e5b7c2f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_constraint('check_payment_status', type_='check')
+        batch_op.create_check_constraint(
+            'check_payment_status',
+            sa.text("payment_status IN ('pending', 'processing', 'completed', 'failed', 'refund_pending', 'refunded')")
+        )
+
+
+def downgrade():
+    op.execute("UPDATE payments SET payment_status = 'failed' WHERE payment_status = 'refund_pending'")
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_constraint('check_payment_status', type_='check')
+        batch_op.create_check_constraint(
+            'check_payment_status',
+            sa.text("payment_status IN ('pending', 'processing', 'completed', 'failed', 'refunded')")
+        )
@@ -0,0 +1,24 @@
+"""Add sequence leasing node ids to code generators
+
+Revision ID: d3c7a1f5e8b2
+Revises: b6e2f8c4d9a3
+Create Date: 2025-12-08 15:27:09.804113
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3c7a1f5e8b2'
+down_revision = 'b6e2f8c4d9a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Mỗi process lấy một giá trị làm node của codes.CodeGenerator; quay vòng sau 1024 process
+    op.execute("CREATE SEQUENCE code_node_id_seq MINVALUE 0 MAXVALUE 1023 START WITH 0 CYCLE")
+
+
+def downgrade():
+    op.execute("DROP SEQUENCE code_node_id_seq")
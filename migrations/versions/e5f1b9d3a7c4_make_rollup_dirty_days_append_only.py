@@ -0,0 +1,32 @@
+"""Make rollup_dirty_days an append-only log
+
+Revision ID: e5f1b9d3a7c4
+Revises: d3c7a1f5e8b2
+Create Date: 2025-12-09 11:04:52.617320
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f1b9d3a7c4'
+down_revision = 'd3c7a1f5e8b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Bỏ khóa (rollup, stat_date): mỗi transaction chỉ thêm dòng, refresh_rollups gộp trùng khi lấy lô
+    op.execute("ALTER TABLE rollup_dirty_days DROP CONSTRAINT rollup_dirty_days_pkey")
+    op.execute("ALTER TABLE rollup_dirty_days ADD COLUMN id SERIAL PRIMARY KEY")
+
+
+def downgrade():
+    op.execute("""
+        DELETE FROM rollup_dirty_days d
+        USING rollup_dirty_days keep
+        WHERE keep.rollup = d.rollup AND keep.stat_date = d.stat_date AND keep.id < d.id
+    """)
+    op.execute("ALTER TABLE rollup_dirty_days DROP CONSTRAINT rollup_dirty_days_pkey")
+    op.execute("ALTER TABLE rollup_dirty_days DROP COLUMN id")
+    op.execute("ALTER TABLE rollup_dirty_days ADD PRIMARY KEY (rollup, stat_date)")
@@ -0,0 +1,47 @@
+"""Add secondary indexes for appointment, payment, notification and medical record queries
+
+Revision ID: e7a3c5f90d18
+Revises: c4e9a1d7b352
+Create Date: 2025-12-02 09:41:26.730118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a3c5f90d18'
+down_revision = 'c4e9a1d7b352'
+branch_labels = None
+depends_on = None
+
+
+# (tên index, bảng, cột, điều kiện partial)
+INDEXES = [
+    ('idx_appointments_doctor_date_status', 'appointments', ['doctor_id', 'appointment_date', 'status'], None),
+    ('idx_appointments_booked_slots', 'appointments', ['doctor_id', 'appointment_date', 'appointment_time'],
+     "status IN ('pending', 'confirmed')"),
+    ('idx_appointments_patient_date', 'appointments', ['patient_id', 'appointment_date'], None),
+    ('idx_appointments_date_status', 'appointments', ['appointment_date', 'status'], None),
+    ('idx_medical_records_patient_visit', 'medical_records', ['patient_id', 'visit_date'], None),
+    ('idx_payments_status_date', 'payments', ['payment_status', 'payment_date'], None),
+    ('idx_payments_completed_date', 'payments', ['payment_date'], "payment_status = 'completed'"),
+    ('idx_payments_patient_created', 'payments', ['patient_id', 'created_at'], None),
+    ('idx_payments_appointment_id', 'payments', ['appointment_id'], None),
+    ('idx_notifications_user_read_created', 'notifications', ['user_id', 'is_read', 'created_at'], None),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY không chạy được trong transaction và không khóa ghi bảng
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_concurrently=True,
+                            postgresql_where=sa.text(where) if where else None)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,63 @@
+"""Add pg_trgm / unaccent search indexes and medical_records.diagnosis_tsv
+
+Revision ID: f2b8d6a4c19e
+Revises: e7a3c5f90d18
+Create Date: 2025-12-03 16:20:54.118402
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8d6a4c19e'
+down_revision = 'e7a3c5f90d18'
+branch_labels = None
+depends_on = None
+
+
+# (tên index, bảng, cột) - GIN trigram trên f_unaccent(cột)
+TRIGRAM_INDEXES = [
+    ('idx_users_full_name_trgm', 'users', 'full_name'),
+    ('idx_users_email_trgm', 'users', 'email'),
+    ('idx_users_phone_trgm', 'users', 'phone'),
+    ('idx_patients_patient_code_trgm', 'patients', 'patient_code'),
+    ('idx_doctors_specialization_trgm', 'doctors', 'specialization'),
+    ('idx_doctors_license_number_trgm', 'doctors', 'license_number'),
+    ('idx_appointments_appointment_code_trgm', 'appointments', 'appointment_code'),
+    ('idx_medical_records_record_code_trgm', 'medical_records', 'record_code'),
+    ('idx_medical_records_diagnosis_trgm', 'medical_records', 'diagnosis'),
+    ('idx_payments_payment_code_trgm', 'payments', 'payment_code'),
+]
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    # unaccent() không IMMUTABLE nên không dùng được trong index/cột sinh tự động;
+    # bọc lại với từ điển cố định để Postgres cho phép
+    op.execute("""
+        CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS
+        $$ SELECT public.unaccent('public.unaccent'::regdictionary, lower($1)) $$
+    """)
+    op.execute("""
+        ALTER TABLE medical_records ADD COLUMN IF NOT EXISTS diagnosis_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', f_unaccent(coalesce(diagnosis, '')))) STORED
+    """)
+
+    with op.get_context().autocommit_block():
+        for name, table, column in TRIGRAM_INDEXES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                       f"ON {table} USING gin (f_unaccent({column}) gin_trgm_ops)")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medical_records_diagnosis_tsv "
+                   "ON medical_records USING gin (diagnosis_tsv)")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_medical_records_diagnosis_tsv")
+        for name, _, _ in reversed(TRIGRAM_INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+    op.execute("ALTER TABLE medical_records DROP COLUMN IF EXISTS diagnosis_tsv")
+    op.execute("DROP FUNCTION IF EXISTS f_unaccent(text)")
@@ -3,6 +3,7 @@ from flask_bcrypt import Bcrypt
 from datetime import datetime, date, time
 from sqlalchemy import CheckConstraint
 from sqlalchemy.orm import relationship
+from hashing import password_hasher
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -37,12 +38,16 @@ class User(db.Model):
     )
 
     def set_password(self, password):
-        """Mã hóa và thiết lập mật khẩu."""
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        """Mã hóa và thiết lập mật khẩu (băm trong process pool của password_hasher)."""
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
         """Kiểm tra mật khẩu."""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """Hash hiện tại được tạo với cost factor khác cấu hình."""
+        return password_hasher.needs_rehash(self.password_hash)
 
     def to_json(self):
         """Chuyển đổi thông tin cơ bản sang JSON."""
@@ -172,11 +177,23 @@ class Appointment(db.Model):
     checked_in_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
     reminder_sent = db.Column(db.Boolean, default=False)
+    hold_expires_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     __table_args__ = (
         CheckConstraint(status.in_(['pending', 'confirmed', 'checked_in', 'completed', 'cancelled', 'no_show']), name='check_appointment_status'),
+        db.Index('idx_appointments_hold_expires_at', 'hold_expires_at',
+                 postgresql_where=db.text("status = 'pending' AND hold_expires_at IS NOT NULL")),
+        # Lịch hẹn của bác sĩ theo ngày/trạng thái (danh sách của bác sĩ, dashboard)
+        db.Index('idx_appointments_doctor_date_status', 'doctor_id', 'appointment_date', 'status'),
+        # Đếm chỗ đã đặt theo slot (materialize doctor_slots, availability)
+        db.Index('idx_appointments_booked_slots', 'doctor_id', 'appointment_date', 'appointment_time',
+                 postgresql_where=db.text("status IN ('pending', 'confirmed')")),
+        # Lịch hẹn của bệnh nhân sắp theo ngày
+        db.Index('idx_appointments_patient_date', 'patient_id', 'appointment_date'),
+        # Thống kê theo ngày
+        db.Index('idx_appointments_date_status', 'appointment_date', 'status'),
     )
 
     patient = db.relationship("Patient", backref="appointments")
@@ -220,6 +237,10 @@ class MedicalRecord(db.Model):
     patient = db.relationship("Patient", backref="medical_records")
     doctor = db.relationship("Doctor", backref="medical_records_created")
 
+    __table_args__ = (
+        db.Index('idx_medical_records_patient_visit', 'patient_id', 'visit_date'),
+    )
+
 # --- 11. BẢNG ĐƠN THUỐC (Prescriptions) ---
 class Prescription(db.Model):
     __tablename__ = 'prescriptions'
@@ -273,7 +294,13 @@ class Payment(db.Model):
 
     __table_args__ = (
         CheckConstraint(payment_method.in_(['cash', 'credit_card', 'momo', 'vnpay', 'zalopay', 'bank_transfer']), name='check_payment_method'),
-        CheckConstraint(payment_status.in_(['pending', 'processing', 'completed', 'failed', 'refunded']), name='check_payment_status'),
+        CheckConstraint(payment_status.in_(['pending', 'processing', 'completed', 'failed', 'refund_pending', 'refunded']), name='check_payment_status'),
+        db.Index('idx_payments_status_date', 'payment_status', 'payment_date'),
+        # Doanh thu: mọi truy vấn thống kê chỉ đọc payment đã hoàn tất
+        db.Index('idx_payments_completed_date', 'payment_date',
+                 postgresql_where=db.text("payment_status = 'completed'")),
+        db.Index('idx_payments_patient_created', 'patient_id', 'created_at'),
+        db.Index('idx_payments_appointment_id', 'appointment_id'),
     )
 
 # --- 14. BẢNG CHI TIẾT THANH TOÁN (Payment Items) ---
@@ -362,6 +389,7 @@ class Notification(db.Model):
 
     __table_args__ = (
         CheckConstraint(type.in_(['appointment', 'reminder', 'payment', 'review', 'system', 'promotion']), name='check_notification_type'),
+        db.Index('idx_notifications_user_read_created', 'user_id', 'is_read', 'created_at'),
     )
 
 # --- 18. BẢNG THIẾT BỊ (User Devices) ---
@@ -407,4 +435,93 @@ class ActivityLog(db.Model):
     description = db.Column(db.Text)
     ip_address = db.Column(db.String(45))
     user_agent = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# --- 21. BẢNG SLOT KHÁM THEO NGÀY (Doctor Slots) ---
+class DoctorSlot(db.Model):
+    __tablename__ = 'doctor_slots'
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id', ondelete='CASCADE'), nullable=False)
+    slot_date = db.Column(db.Date, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    capacity = db.Column(db.Integer, nullable=False, default=0)
+    booked_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        CheckConstraint(booked_count >= 0, name='check_slot_booked_count'),
+        db.UniqueConstraint('doctor_id', 'slot_date', 'start_time', name='unique_doctor_slot'),
+    )
+
+# --- 22. BẢNG IDEMPOTENCY KEY (Idempotency Keys) ---
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    endpoint = db.Column(db.String(200), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='unique_idempotency_key'),
+        db.Index('idx_idempotency_keys_expires_at', 'expires_at'),
+    )
+
+# --- 23. BẢNG THỐNG KÊ TỔNG HỢP THEO NGÀY (Rollups) ---
+# Được tính lại theo từng ngày bởi rollups.refresh_rollups; các endpoint /api/stats chỉ đọc các bảng này
+class DailyAppointmentStat(db.Model):
+    __tablename__ = 'daily_appointment_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    stat_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20))
+    department_id = db.Column(db.Integer)
+    doctor_id = db.Column(db.Integer)
+    appointment_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('idx_daily_appointment_stats_date', 'stat_date'),
+    )
+
+class DailyRevenueStat(db.Model):
+    __tablename__ = 'daily_revenue_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    stat_date = db.Column(db.Date, nullable=False)
+    payment_method = db.Column(db.String(50))
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('idx_daily_revenue_stats_date', 'stat_date'),
+    )
+
+class DailyServiceRevenueStat(db.Model):
+    __tablename__ = 'daily_service_revenue_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    stat_date = db.Column(db.Date, nullable=False)
+    service_id = db.Column(db.Integer)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('idx_daily_service_revenue_stats_date', 'stat_date'),
+    )
+
+class DailyPatientStat(db.Model):
+    __tablename__ = 'daily_patient_stats'
+    stat_date = db.Column(db.Date, primary_key=True)
+    new_patients = db.Column(db.Integer, nullable=False, default=0)
+
+# Ngày cần tính lại, ghi cùng transaction với thay đổi dữ liệu gốc.
+# Chỉ thêm dòng (không khóa duy nhất): ghi đồng thời cho cùng một ngày không chặn nhau
+class RollupDirtyDay(db.Model):
+    __tablename__ = 'rollup_dirty_days'
+    id = db.Column(db.Integer, primary_key=True)
+    rollup = db.Column(db.String(30), nullable=False)
+    stat_date = db.Column(db.Date, nullable=False)
+    marked_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,456 @@
+import heapq
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from models import db, User, Patient, Doctor
+from search_backend import fold_text
+
+# =============================================
+# CHỈ MỤC TÌM KIẾM BỆNH NHÂN / BÁC SĨ TRONG BỘ NHỚ
+# =============================================
+# Inverted index: term -> tập khóa tài liệu (('patient', id) hoặc ('doctor', id)).
+# - Tên: từng từ đã bỏ dấu, lưu mọi tiền tố (gõ dở) và trigram (chịu lỗi gõ)
+# - Số điện thoại: mọi hậu tố từ 3 chữ số (tìm theo vài số cuối)
+# - Email, mã bệnh nhân, số chứng chỉ: tiền tố
+# - Như ILIKE '%q%' của truy vấn SQL, email / số điện thoại / mã còn được so khớp chuỗi con
+#   (vd: 'gmail.com', vài số giữa, phần giữa của mã) bằng cách quét tuyến tính các giá trị đã
+#   chuẩn hóa; kết quả chuỗi con xếp sau kết quả khớp tiền tố
+# Được dựng một lần khi khởi động (thread nền) và cập nhật theo event after_insert /
+# after_update của User/Patient/Doctor; thay đổi chỉ được áp dụng sau khi transaction commit.
+# Event chỉ thấy các commit trong chính process: thread nền đọc lại định kỳ
+# (PEOPLE_INDEX_SYNC_SECONDS) các dòng có updated_at mới hơn lần đọc trước, để thay đổi
+# từ worker khác xuất hiện sau tối đa một chu kỳ. Lùi mốc SYNC_OVERLAP để không sót
+# transaction commit trễ hơn updated_at của nó (hoặc lệch giờ giữa các máy).
+# Bệnh nhân/bác sĩ không bị xóa cứng (chỉ khóa tài khoản) nên không cần theo dõi DELETE.
+
+MAX_PREFIX = 16
+MIN_PHONE_SUFFIX = 3
+FUZZY_THRESHOLD = 0.5
+SESSION_KEY = 'people_index_changes'
+SYNC_OVERLAP = timedelta(seconds=30)
+SUBSTRING_FIELDS = ('e', 'ph', 'c', 'l')
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_DIGITS_RE = re.compile(r'\D')
+_PHONE_QUERY_RE = re.compile(r'[\d\s+().-]+')
+
+USER_FIELDS = ('full_name', 'email', 'phone', 'gender', 'date_of_birth')
+PATIENT_FIELDS = ('user_id', 'patient_code', 'blood_type')
+DOCTOR_FIELDS = ('user_id', 'specialization', 'license_number')
+
+def _words(value):
+    return _WORD_RE.findall(fold_text(value) or '')
+
+def _prefixes(value, minimum=1):
+    return {value[:i] for i in range(minimum, min(len(value), MAX_PREFIX) + 1)}
+
+def _trigrams(word):
+    padded = f'${word}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _digits(value):
+    return _DIGITS_RE.sub('', value or '')
+
+class PeopleIndex:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        self._synced_at = None
+        self._reset()
+
+    def _reset(self):
+        self._users = {}              # user_id -> dict các trường của User
+        self._patients = {}           # patient_id -> dict các trường của Patient
+        self._doctors = {}            # doctor_id -> dict các trường của Doctor
+        self._user_docs = defaultdict(set)   # user_id -> khóa tài liệu dùng user đó
+        self._doc_terms = {}          # khóa tài liệu -> tập term
+        self._fields = {ns: {} for ns in SUBSTRING_FIELDS}   # 'e'|'ph'|'c'|'l' -> {khóa: giá trị đã chuẩn hóa}
+        self._postings = defaultdict(set)
+        self._pending = []            # thay đổi đến trong lúc đang dựng index
+
+    # ---------- DỰNG & CẬP NHẬT ----------
+
+    def _terms_for(self, key):
+        kind, entity_id = key
+        entity = (self._patients if kind == 'patient' else self._doctors).get(entity_id)
+        if entity is None:
+            return set()
+        user = self._users.get(entity['user_id']) or {}
+        terms = set()
+        for word in _words(user.get('full_name')):
+            terms |= {f'n:{p}' for p in _prefixes(word)}
+            terms |= {f't:{g}' for g in _trigrams(word)}
+        phone = _digits(user.get('phone'))
+        terms |= {f'ph:{phone[i:]}' for i in range(len(phone) - MIN_PHONE_SUFFIX + 1)}
+        if user.get('email'):
+            terms |= {f'e:{p}' for p in _prefixes(user['email'].lower(), 2)}
+        if kind == 'patient':
+            if entity.get('patient_code'):
+                terms |= {f'c:{p}' for p in _prefixes(entity['patient_code'].lower(), 2)}
+        else:
+            for word in _words(entity.get('specialization')):
+                terms |= {f's:{p}' for p in _prefixes(word)}
+            if entity.get('license_number'):
+                terms |= {f'l:{p}' for p in _prefixes(entity['license_number'].lower(), 2)}
+        return terms
+
+    def _substring_fields(self, key):
+        kind, entity_id = key
+        entity = (self._patients if kind == 'patient' else self._doctors).get(entity_id)
+        if entity is None:
+            return None
+        user = self._users.get(entity['user_id']) or {}
+        code = entity.get('patient_code' if kind == 'patient' else 'license_number')
+        return {'e': (user.get('email') or '').lower(), 'ph': _digits(user.get('phone')),
+                'c' if kind == 'patient' else 'l': (code or '').lower()}
+
+    def _reindex(self, key):
+        fields = self._substring_fields(key) or {}
+        for namespace, values in self._fields.items():
+            if fields.get(namespace):
+                values[key] = fields[namespace]
+            else:
+                values.pop(key, None)
+        for term in self._doc_terms.pop(key, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.discard(key)
+                if not postings:
+                    del self._postings[term]
+        terms = self._terms_for(key)
+        if terms:
+            self._doc_terms[key] = terms
+            for term in terms:
+                self._postings[term].add(key)
+
+    def _apply(self, change):
+        kind, entity_id, fields = change
+        if kind == 'user':
+            if fields is None:
+                self._users.pop(entity_id, None)
+            else:
+                self._users[entity_id] = fields
+            keys = list(self._user_docs.get(entity_id, ()))
+        else:
+            table = self._patients if kind == 'patient' else self._doctors
+            key = (kind, entity_id)
+            old = table.pop(entity_id, None)
+            if old is not None:
+                self._user_docs[old['user_id']].discard(key)
+            if fields is not None:
+                table[entity_id] = fields
+                self._user_docs[fields['user_id']].add(key)
+            keys = [key]
+        for key in keys:
+            self._reindex(key)
+
+    def apply_changes(self, changes):
+        with self._lock:
+            if not self.ready:
+                self._pending.extend(changes)
+                return
+            for change in changes:
+                self._apply(change)
+
+    @staticmethod
+    def _load(since=None):
+        """Đọc User/Patient/Doctor (chỉ các dòng có updated_at >= since nếu có) thành list thay đổi"""
+        changes = []
+        for kind, model, fields in (('user', User, USER_FIELDS), ('patient', Patient, PATIENT_FIELDS),
+                                    ('doctor', Doctor, DOCTOR_FIELDS)):
+            query = db.session.query(model.id, *[getattr(model, f) for f in fields])
+            if model is User:
+                query = query.filter(User.role.in_(['patient', 'doctor']))
+            if since is not None:
+                query = query.filter(model.updated_at >= since)
+            changes += [(kind, row[0], dict(zip(fields, row[1:]))) for row in query.all()]
+        db.session.remove()
+        return changes
+
+    def build(self):
+        """Nạp toàn bộ bệnh nhân/bác sĩ từ DB (cần app context)"""
+        started = datetime.utcnow()
+        changes = self._load()
+
+        with self._lock:
+            pending = self._pending
+            self._reset()
+            for change in changes + pending:
+                self._apply(change)
+            self._synced_at = started
+            self.ready = True
+        print(f"[PEOPLE INDEX] Indexed {len(self._patients)} patients, {len(self._doctors)} doctors, "
+              f"{len(self._postings)} terms")
+
+    def sync(self):
+        """Áp dụng thay đổi do process khác commit kể từ lần đọc trước (cần app context)"""
+        if not self.ready:
+            return 0
+        started = datetime.utcnow()
+        changes = self._load(self._synced_at - SYNC_OVERLAP)
+        with self._lock:
+            for change in changes:
+                self._apply(change)
+            self._synced_at = started
+        return len(changes)
+
+    # ---------- TRUY VẤN ----------
+
+    def _fuzzy(self, word, candidates=None):
+        """Điểm gần đúng theo tỷ lệ trigram chung, chỉ xét trong candidates nếu có"""
+        grams = _trigrams(word)
+        hits = defaultdict(int)
+        for gram in grams:
+            postings = self._postings.get(f't:{gram}', ())
+            if candidates is not None:
+                postings = candidates.intersection(postings)
+            for key in postings:
+                hits[key] += 1
+        return {key: count / len(grams) for key, count in hits.items()
+                if count / len(grams) >= FUZZY_THRESHOLD}
+
+    def _match_words(self, query, prefix_ns, fuzzy):
+        """Khóa tài liệu khớp mọi từ trong query, kèm điểm (tiền tố = 2, gần đúng = tỷ lệ trigram)"""
+        exact, typos = [], []
+        for word in _words(query):
+            postings = self._postings.get(f'{prefix_ns}:{word[:MAX_PREFIX]}')
+            if postings:
+                exact.append(postings)
+            elif fuzzy and len(word) >= 3:
+                typos.append(word)
+            else:
+                return {}
+        if not exact and not typos:
+            return {}
+
+        # Giao từ tập nhỏ nhất trước; từ gõ sai chỉ được chấm điểm trong các ứng viên còn lại
+        candidates = set.intersection(*sorted(exact, key=len)) if exact else None
+        scores = dict.fromkeys(candidates, 2.0 * len(exact)) if exact else None
+        for word in typos:
+            word_scores = self._fuzzy(word, candidates)
+            scores = word_scores if scores is None else {
+                key: scores[key] + s for key, s in word_scores.items() if key in scores}
+            candidates = set(scores)
+            if not scores:
+                return {}
+        return scores
+
+    def _match_prefix(self, namespace, value):
+        value = (value or '').strip().lower()
+        return {key: 2.0 for key in self._postings.get(f'{namespace}:{value[:MAX_PREFIX]}', ())}
+
+    def _match_phone(self, value):
+        digits = _digits(value)
+        if len(digits) < MIN_PHONE_SUFFIX:
+            return {}
+        return {key: 2.0 for key in self._postings.get(f'ph:{digits}', ())}
+
+    def _match_substring(self, namespaces, value):
+        """Khớp chuỗi con trên các trường namespaces (quét tuyến tính), điểm 1 (dưới khớp tiền tố)"""
+        matches = {}
+        for namespace in namespaces:
+            needle = _digits(value) if namespace == 'ph' else (value or '').strip().lower()
+            if needle:
+                matches.update((key, 1.0) for key, field in self._fields[namespace].items() if needle in field)
+        return matches
+
+    @staticmethod
+    def _merge(*results):
+        scores = defaultdict(float)
+        for result in results:
+            for key, s in result.items():
+                scores[key] = max(scores[key], s)
+        return scores
+
+    def _match_any(self, query):
+        """Một ô tìm kiếm chung: tên, số điện thoại, email hoặc mã"""
+        results = []
+        substring_fields = ('e', 'c', 'l')
+        if _PHONE_QUERY_RE.fullmatch(query.strip()):
+            results.append(self._match_phone(query))
+            substring_fields += ('ph',)
+        results += [self._match_words(query, 'n', True), self._match_words(query, 's', False),
+                    self._match_prefix('e', query), self._match_prefix('c', query),
+                    self._match_prefix('l', query), self._match_substring(substring_fields, query)]
+        return self._merge(*results)
+
+    @staticmethod
+    def _intersect(current, new):
+        if current is None:
+            return dict(new)
+        return {key: current[key] + s for key, s in new.items() if key in current}
+
+    def _document(self, key):
+        kind, entity_id = key
+        entity = (self._patients if kind == 'patient' else self._doctors)[entity_id]
+        return dict(self._users.get(entity['user_id']) or {}, id=entity_id, **entity)
+
+    def search(self, kind, q=None, name=None, phone=None, email=None, code=None,
+               filters=None, limit=None):
+        """
+        Tìm tài liệu loại kind ('patient' | 'doctor'). Các tiêu chí được AND với nhau;
+        filters là hàm tùy chọn nhận document và trả về bool.
+        Trả về list document đã sắp theo điểm giảm dần.
+        """
+        with self._lock:
+            scores = None
+            if q:
+                scores = self._intersect(scores, self._match_any(q))
+            if name:
+                scores = self._intersect(scores, self._match_words(name, 'n', True))
+            if phone:
+                scores = self._intersect(scores, self._merge(
+                    self._match_phone(phone), self._match_substring(('ph',), phone)))
+            if email:
+                scores = self._intersect(scores, self._merge(
+                    self._match_prefix('e', email), self._match_substring(('e',), email)))
+            if code:
+                namespace = 'c' if kind == 'patient' else 'l'
+                scores = self._intersect(scores, self._merge(
+                    self._match_prefix(namespace, code), self._match_substring((namespace,), code)))
+
+            if scores is None:
+                table = self._patients if kind == 'patient' else self._doctors
+                scores = {(kind, entity_id): 0.0 for entity_id in table}
+
+            candidates = ((s, key) for key, s in scores.items() if key[0] == kind)
+            order = lambda item: (-item[0], item[1][1])
+            # Không có bộ lọc: chỉ cần limit kết quả đầu, khỏi sắp xếp toàn bộ (vd: khớp chuỗi con rất rộng)
+            ranked = (heapq.nsmallest(limit, candidates, key=order) if limit and filters is None
+                      else sorted(candidates, key=order))
+            results = []
+            for _, key in ranked:
+                document = self._document(key)
+                if filters is None or filters(document):
+                    results.append(document)
+                    if limit and len(results) >= limit:
+                        break
+            return results
+
+people_index = PeopleIndex()
+
+def patient_age(document, today=None):
+    dob = document.get('date_of_birth')
+    if not dob:
+        return None
+    return (today or date.today()).year - dob.year
+
+# =============================================
+# ĐỒNG BỘ THEO EVENT CỦA SQLALCHEMY
+# =============================================
+
+def _snapshot(target, fields):
+    return {field: getattr(target, field) for field in fields}
+
+def _record(target, change):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(SESSION_KEY, []).append(change)
+
+def _changed(target, fields):
+    # after_update cũng chạy khi chỉ đổi last_login, is_active...: bỏ qua nếu không đụng trường được index
+    state = inspect(target)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+def _listeners(kind, fields):
+    def on_insert(mapper, connection, target):
+        if kind == 'user' and target.role not in ('patient', 'doctor'):
+            return
+        _record(target, (kind, target.id, _snapshot(target, fields)))
+
+    def on_update(mapper, connection, target):
+        if _changed(target, fields):
+            on_insert(mapper, connection, target)
+
+    def on_delete(mapper, connection, target):
+        _record(target, (kind, target.id, None))
+
+    return on_insert, on_update, on_delete
+
+for _model, _kind, _fields in ((User, 'user', USER_FIELDS), (Patient, 'patient', PATIENT_FIELDS),
+                               (Doctor, 'doctor', DOCTOR_FIELDS)):
+    _on_insert, _on_update, _on_delete = _listeners(_kind, _fields)
+    event.listen(_model, 'after_insert', _on_insert)
+    event.listen(_model, 'after_update', _on_update)
+    event.listen(_model, 'after_delete', _on_delete)
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_after_commit(session):
+    changes = session.info.pop(SESSION_KEY, None)
+    if changes:
+        people_index.apply_changes(changes)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_after_rollback(session, previous_transaction):
+    # Chỉ bỏ thay đổi khi cả transaction bị rollback, không phải một SAVEPOINT
+    if previous_transaction.parent is not None:
+        return
+    session.info.pop(SESSION_KEY, None)
+
+def init_people_index(app):
+    """Dựng index ở thread nền khi khởi động (PEOPLE_INDEX_ENABLED), sau đó đồng bộ định kỳ"""
+    if not app.config.get('PEOPLE_INDEX_ENABLED'):
+        return
+
+    interval = app.config.get('PEOPLE_INDEX_SYNC_SECONDS', 5)
+
+    def run():
+        with app.app_context():
+            try:
+                people_index.build()
+            except Exception as e:
+                print(f"[PEOPLE INDEX] Build failed, searches will use the database: {e}")
+                return
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    people_index.sync()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[PEOPLE INDEX] Sync error: {e}")
+                finally:
+                    db.session.remove()
+
+    threading.Thread(target=run, name='people-index-build', daemon=True).start()
+
+
+if __name__ == '__main__':
+    # Benchmark: python people_index.py (dữ liệu giả, không cần DB)
+    import random
+    import timeit
+
+    random.seed(1)
+    last = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng']
+    middle = ['Văn', 'Thị', 'Minh', 'Ngọc', 'Hữu', 'Thanh', 'Quốc', 'Bảo']
+    first = ['An', 'Bình', 'Châu', 'Dũng', 'Giang', 'Hà', 'Hùng', 'Lan', 'Long', 'Mai', 'Nam', 'Phương',
+             'Quân', 'Sơn', 'Thảo', 'Trang', 'Tuấn', 'Việt', 'Yến', 'Đức']
+
+    index = PeopleIndex()
+    index.ready = True
+    total = 50000
+    changes = []
+    for i in range(1, total + 1):
+        name = f'{random.choice(last)} {random.choice(middle)} {random.choice(first)}'
+        phone = f'09{random.randrange(10 ** 8):08d}'
+        changes.append(('user', i, {'full_name': name, 'email': f'user{i}@example.com', 'phone': phone,
+                                    'gender': None, 'date_of_birth': None}))
+        changes.append(('patient', i, {'user_id': i, 'patient_code': f'PT{i:08d}', 'blood_type': None}))
+    elapsed = timeit.timeit(lambda: index.apply_changes(changes), number=1)
+    print(f"build       : {total:,} patients in {elapsed:.2f}s, {len(index._postings):,} terms")
+
+    sample_phone = changes[0][2]['phone']
+    for label, kwargs in (('prefix', {'name': 'nguyen van h'}),
+                          ('typo', {'name': 'nguyn thao'}),
+                          ('phone tail', {'phone': sample_phone[-4:]}),
+                          ('any field', {'q': 'PT0000123'}),
+                          ('substring', {'q': 'example.com'})):
+        runs = 200
+        seconds = timeit.timeit(lambda: index.search('patient', limit=20, **kwargs), number=runs)
+        hits = len(index.search('patient', **kwargs))
+        print(f"{label:12}: {seconds / runs * 1e6:9,.0f} us/query ({hits:,} matches)")
@@ -0,0 +1,183 @@
+from sqlalchemy import select, func, case
+from models import db, User, Doctor, Department, Appointment, Review
+
+# =============================================
+# HIỆU SUẤT BÁC SĨ / THỐNG KÊ CHUYÊN KHOA
+# =============================================
+# Mỗi bảng con (appointments, reviews, doctors) được gom nhóm theo khóa trong CTE riêng
+# rồi mới join với bảng chính, mỗi khóa còn đúng một dòng. Join thẳng nhiều bảng con
+# rồi GROUP BY (cách cũ) sinh tích Descartes appointments x reviews cho mỗi bác sĩ:
+# chi phí tăng theo tích và COUNT/SUM bị nhân lên.
+
+def doctor_performance(date_from=None, date_to=None):
+    """Số lịch hẹn (trong khoảng ngày), tỷ lệ hoàn tất và đánh giá của từng bác sĩ"""
+    appointment_query = select(
+        Appointment.doctor_id,
+        func.count(Appointment.id).label('total_appointments'),
+        func.count(Appointment.id).filter(Appointment.status == 'completed').label('completed')
+    ).group_by(Appointment.doctor_id)
+    if date_from:
+        appointment_query = appointment_query.where(Appointment.appointment_date >= date_from)
+    if date_to:
+        appointment_query = appointment_query.where(Appointment.appointment_date <= date_to)
+    appointment_stats = appointment_query.cte('appointment_stats')
+
+    review_stats = select(
+        Review.doctor_id,
+        func.avg(Review.rating).label('avg_rating'),
+        func.count(Review.id).label('review_count')
+    ).group_by(Review.doctor_id).cte('review_stats')
+
+    total_appointments = func.coalesce(appointment_stats.c.total_appointments, 0)
+    rows = db.session.execute(
+        select(
+            User.full_name,
+            Doctor.id,
+            Department.name,
+            total_appointments,
+            func.coalesce(appointment_stats.c.completed, 0),
+            review_stats.c.avg_rating,
+            func.coalesce(review_stats.c.review_count, 0)
+        ).select_from(Doctor)
+        .join(User, User.id == Doctor.user_id)
+        .join(Department, Doctor.department_id == Department.id)
+        .outerjoin(appointment_stats, appointment_stats.c.doctor_id == Doctor.id)
+        .outerjoin(review_stats, review_stats.c.doctor_id == Doctor.id)
+        .order_by(total_appointments.desc(), Doctor.id)
+    ).all()
+
+    return [{
+        'doctor_name': full_name,
+        'doctor_id': doctor_id,
+        'department': dept_name,
+        'total_appointments': total_apps,
+        'completed_appointments': completed,
+        'completion_rate': round((completed / total_apps * 100) if total_apps > 0 else 0, 2),
+        'average_rating': round(float(avg_rating) if avg_rating else 0, 2),
+        'review_count': review_count
+    } for full_name, doctor_id, dept_name, total_apps, completed, avg_rating, review_count in rows]
+
+def department_statistics():
+    """Số bác sĩ, số lịch hẹn và số lịch hoàn tất của từng chuyên khoa"""
+    doctor_stats = select(
+        Doctor.department_id,
+        func.count(Doctor.id).label('doctor_count')
+    ).group_by(Doctor.department_id).cte('doctor_stats')
+
+    appointment_stats = select(
+        Appointment.department_id,
+        func.count(Appointment.id).label('appointment_count'),
+        func.count(Appointment.id).filter(Appointment.status == 'completed').label('completed_count')
+    ).group_by(Appointment.department_id).cte('appointment_stats')
+
+    appointment_count = func.coalesce(appointment_stats.c.appointment_count, 0)
+    rows = db.session.execute(
+        select(
+            Department.name,
+            Department.id,
+            func.coalesce(doctor_stats.c.doctor_count, 0),
+            appointment_count,
+            func.coalesce(appointment_stats.c.completed_count, 0)
+        ).select_from(Department)
+        .outerjoin(doctor_stats, doctor_stats.c.department_id == Department.id)
+        .outerjoin(appointment_stats, appointment_stats.c.department_id == Department.id)
+        .order_by(appointment_count.desc(), Department.id)
+    ).all()
+
+    return [{
+        'department_name': dept_name,
+        'department_id': dept_id,
+        'doctor_count': doctor_count,
+        'appointment_count': appt_count,
+        'completed_appointments': completed
+    } for dept_name, dept_id, doctor_count, appt_count, completed in rows]
+
+# =============================================
+# BENCHMARK (python performance_stats.py)
+# =============================================
+
+def _legacy_doctor_performance():
+    """Cách cũ (join thẳng appointments và reviews), giữ lại chỉ để so sánh"""
+    return db.session.query(
+        Doctor.id,
+        func.count(Appointment.id),
+        func.count(Review.id)
+    ).join(User, User.id == Doctor.user_id).join(
+        Department, Doctor.department_id == Department.id
+    ).outerjoin(
+        Appointment, Doctor.id == Appointment.doctor_id
+    ).outerjoin(
+        Review, Doctor.id == Review.doctor_id
+    ).group_by(Doctor.id).all()
+
+def _legacy_department_statistics():
+    return db.session.query(
+        Department.id,
+        func.count(func.distinct(Doctor.id)),
+        func.count(Appointment.id),
+        func.sum(case((Appointment.status == 'completed', 1), else_=0))
+    ).outerjoin(
+        Doctor, Department.id == Doctor.department_id
+    ).outerjoin(
+        Appointment, Department.id == Appointment.department_id
+    ).group_by(Department.id).all()
+
+def _seed(doctor_count, appointments_per_doctor, reviews_per_doctor, departments=5):
+    from datetime import date, time, timedelta
+    from sqlalchemy import insert
+
+    db.session.execute(insert(Department), [{'name': f'Khoa {i}'} for i in range(departments)])
+    db.session.execute(insert(User), [{
+        'username': f'doctor{i}', 'email': f'doctor{i}@example.com', 'password_hash': '-',
+        'full_name': f'Bác sĩ {i}', 'phone': f'09{i:08d}', 'role': 'doctor'
+    } for i in range(doctor_count)])
+    db.session.execute(insert(Doctor), [{
+        'user_id': i + 1, 'department_id': i % departments + 1, 'license_number': f'LIC{i:06d}'
+    } for i in range(doctor_count)])
+
+    statuses = ['pending', 'confirmed', 'completed', 'cancelled']
+    db.session.execute(insert(Appointment), [{
+        'appointment_code': f'AP{d:04d}{a:06d}', 'doctor_id': d + 1, 'department_id': d % departments + 1,
+        'appointment_date': date(2025, 1, 1) + timedelta(days=a % 365), 'appointment_time': time(8 + a % 9),
+        'status': statuses[a % len(statuses)]
+    } for d in range(doctor_count) for a in range(appointments_per_doctor)])
+    db.session.execute(insert(Review), [{
+        'doctor_id': d + 1, 'rating': 1 + r % 5
+    } for d in range(doctor_count) for r in range(reviews_per_doctor)])
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    # Dữ liệu giả trên SQLite trong bộ nhớ: nhân đôi số lịch hẹn và đánh giá mỗi bước.
+    # Cách mới tăng tuyến tính (~x2 mỗi bước), cách cũ tăng theo tích (~x4) và đếm sai.
+    import time
+    from flask import Flask
+
+    DOCTORS = 20
+    for scale in (1, 2, 4, 8, 16):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            appointments, reviews = 50 * scale, 10 * scale
+            _seed(DOCTORS, appointments, reviews)
+
+            timings = {}
+            for name, fn in (('legacy doctors', _legacy_doctor_performance), ('doctors', doctor_performance),
+                             ('legacy departments', _legacy_department_statistics),
+                             ('departments', department_statistics)):
+                started = time.perf_counter()
+                fn()
+                timings[name] = (time.perf_counter() - started) * 1000
+
+            legacy_count = _legacy_doctor_performance()[0][1]
+            new_count = doctor_performance()[0]['total_appointments']
+            assert new_count == appointments, "doctor_performance miscounted appointments"
+            assert sum(d['appointment_count'] for d in department_statistics()) == DOCTORS * appointments
+
+            print(f"{appointments:4d} appts x {reviews:3d} reviews/doctor: "
+                  + "  ".join(f"{name} {ms:8.2f}ms" for name, ms in timings.items())
+                  + f"  | appointments per doctor: legacy {legacy_count}, new {new_count}")
+            db.session.remove()
+            db.drop_all()
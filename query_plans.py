@@ -0,0 +1,70 @@
+from sqlalchemy import text
+from models import db
+
+# =============================================
+# KIỂM TRA QUERY PLAN (CHỐNG HỒI QUY INDEX)
+# =============================================
+# Mỗi truy vấn đại diện cho một mẫu truy vấn thật trong các blueprint, kèm các index
+# được phép dùng. EXPLAIN được chạy với enable_seqscan = off để kết quả không phụ thuộc
+# vào kích thước dữ liệu (bảng nhỏ thì planner luôn chọn seq scan).
+
+PLAN_CHECKS = [
+    ("doctor appointments by day/status",
+     "SELECT id FROM appointments WHERE doctor_id = 1 AND appointment_date = CURRENT_DATE AND status = 'pending'",
+     ('idx_appointments_doctor_date_status', 'idx_appointments_booked_slots')),
+    ("booked count per slot",
+     "SELECT appointment_time, COUNT(*) FROM appointments WHERE doctor_id = 1 AND appointment_date = CURRENT_DATE "
+     "AND status IN ('pending', 'confirmed') GROUP BY appointment_time",
+     ('idx_appointments_booked_slots',)),
+    ("patient appointments",
+     "SELECT id FROM appointments WHERE patient_id = 1 ORDER BY appointment_date DESC",
+     ('idx_appointments_patient_date',)),
+    ("appointments today",
+     "SELECT COUNT(*) FROM appointments WHERE appointment_date = CURRENT_DATE",
+     ('idx_appointments_date_status',)),
+    ("monthly revenue",
+     "SELECT SUM(amount) FROM payments WHERE payment_status = 'completed' AND payment_date >= date_trunc('month', now())",
+     ('idx_payments_completed_date', 'idx_payments_status_date')),
+    ("patient payments",
+     "SELECT id FROM payments WHERE patient_id = 1 ORDER BY created_at DESC LIMIT 10",
+     ('idx_payments_patient_created',)),
+    ("payment by code",
+     "SELECT id FROM payments WHERE payment_code = 'PAY0000000000000'",
+     ('payments_payment_code_key',)),
+    ("unread notifications",
+     "SELECT COUNT(*) FROM notifications WHERE user_id = 1 AND is_read = false",
+     ('idx_notifications_user_read_created',)),
+    ("patient medical records",
+     "SELECT id FROM medical_records WHERE patient_id = 1 ORDER BY visit_date DESC",
+     ('idx_medical_records_patient_visit',)),
+    ("name search (trigram)",
+     "SELECT id FROM users WHERE f_unaccent(full_name) LIKE '%nguyen%'",
+     ('idx_users_full_name_trgm',)),
+    ("diagnosis full-text search",
+     "SELECT id FROM medical_records WHERE diagnosis_tsv @@ plainto_tsquery('simple', 'viem phoi')",
+     ('idx_medical_records_diagnosis_tsv',)),
+]
+
+def _index_names(plan):
+    names = set()
+    if 'Index Name' in plan:
+        names.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        names |= _index_names(child)
+    return names
+
+def check_query_plans():
+    """
+    Chạy EXPLAIN cho các truy vấn trong PLAN_CHECKS.
+    Trả về list (tên, ok, index được dùng, index mong đợi). Không thay đổi dữ liệu.
+    """
+    results = []
+    try:
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, sql, expected in PLAN_CHECKS:
+            plan = db.session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            used = _index_names(plan[0]['Plan'])
+            results.append((name, bool(used & set(expected)), sorted(used), expected))
+    finally:
+        db.session.rollback()
+    return results
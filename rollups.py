@@ -0,0 +1,283 @@
+import threading
+import time
+from datetime import datetime, date, timedelta
+from sqlalchemy import event, func, select, insert, delete, text, inspect
+from sqlalchemy.orm import object_session
+from models import (db, Appointment, Payment, PaymentItem, Patient, DailyAppointmentStat,
+                    DailyRevenueStat, DailyServiceRevenueStat, DailyPatientStat, RollupDirtyDay)
+from stats_cache import stats_cache, mark_stats_changed
+
+# =============================================
+# BẢNG TỔNG HỢP THỐNG KÊ THEO NGÀY (ROLLUPS)
+# =============================================
+# - appointments    : số lịch hẹn theo ngày / trạng thái / khoa / bác sĩ
+# - revenue         : doanh thu (payment completed) theo ngày / phương thức thanh toán
+# - service_revenue : doanh thu theo ngày / dịch vụ (payment_items của payment completed)
+# - patients        : số bệnh nhân mới theo ngày
+# Cập nhật tăng dần: mỗi thay đổi trên dữ liệu gốc ghi (rollup, ngày) vào rollup_dirty_days
+# trong cùng transaction (event của mapper, hoặc mark_rollup_dirty với câu lệnh Core);
+# refresh_rollups (thread nền / flask refresh-rollups) tính lại đúng những ngày đó
+# rồi xóa các nhóm tương ứng trong stats_cache.
+# Số liệu trên /api/stats vì vậy trễ tối đa ROLLUP_REFRESH_INTERVAL_SECONDS.
+# rollup_dirty_days là log chỉ thêm dòng (id tăng dần, không khóa duy nhất): hai booking cùng
+# ngày, hay booking trong lúc refresh đang giữ lô đã lấy, không phải chờ nhau trên một dòng chung.
+# Trùng lặp được gộp khi lấy lô (DISTINCT); advisory lock theo (rollup, ngày) giữ cho hai
+# worker không tính lại cùng một ngày cùng lúc.
+
+SESSION_KEY = 'rollup_dirty_days'
+REFRESH_BATCH_MARKS = 2000
+
+# Rollup -> nhóm phiên bản của stats_cache
+ROLLUP_GROUPS = {
+    'appointments': 'appointments',
+    'revenue': 'revenue',
+    'service_revenue': 'revenue',
+    'patients': 'patients'
+}
+
+def _as_date(value):
+    if value is None:
+        return None
+    return value.date() if isinstance(value, datetime) else value
+
+# ---------- ĐÁNH DẤU NGÀY CẦN TÍNH LẠI ----------
+
+def _insert_dirty(connection, pairs):
+    now = datetime.utcnow()
+    connection.execute(
+        insert(RollupDirtyDay.__table__).values([
+            {'rollup': rollup, 'stat_date': stat_date, 'marked_at': now} for rollup, stat_date in pairs
+        ])
+    )
+
+def mark_rollup_dirty(rollup, dates):
+    """Dùng sau các câu lệnh Core (insert/update hàng loạt) không đi qua event của mapper. Không commit."""
+    pairs = {(rollup, _as_date(value)) for value in dates if value is not None}
+    if pairs:
+        _insert_dirty(db.session.connection(), sorted(pairs))
+        mark_stats_changed({ROLLUP_GROUPS[rollup]})
+
+def _record(target, rollups, values):
+    session = object_session(target)
+    if session is None:
+        return
+    values = [value for value in values if value is not None]
+    if not values:
+        return
+    dirty = session.info.setdefault(SESSION_KEY, set())
+    for value in values:
+        for rollup in rollups:
+            dirty.add((rollup, _as_date(value)))
+    mark_stats_changed({ROLLUP_GROUPS[rollup] for rollup in rollups}, session)
+
+def _values(target, field, changed_fields=None):
+    """Giá trị hiện tại và cũ của field; rỗng nếu không trường nào trong changed_fields thay đổi"""
+    state = inspect(target)
+    if changed_fields is not None and not any(
+            state.attrs[name].history.has_changes() for name in changed_fields):
+        return []
+    history = state.attrs[field].history
+    return [getattr(target, field), *history.deleted]
+
+APPOINTMENT_FIELDS = ('appointment_date', 'status', 'department_id', 'doctor_id')
+PAYMENT_FIELDS = ('payment_date', 'payment_status', 'amount', 'payment_method')
+
+def _on_appointment(changed_only):
+    def listener(mapper, connection, target):
+        fields = APPOINTMENT_FIELDS if changed_only else None
+        _record(target, ('appointments',), _values(target, 'appointment_date', fields))
+    return listener
+
+def _on_payment(changed_only):
+    def listener(mapper, connection, target):
+        fields = PAYMENT_FIELDS if changed_only else None
+        values = _values(target, 'payment_date', fields)
+        _record(target, ('revenue', 'service_revenue'), values)
+        if values and all(value is None for value in values) and object_session(target) is not None:
+            # Không có ngày để đánh dấu, nhưng tổng doanh thu (đọc trực tiếp payments) vẫn đổi
+            mark_stats_changed({'revenue'}, object_session(target))
+    return listener
+
+def _on_payment_item(mapper, connection, target):
+    payment_date = connection.execute(
+        select(Payment.payment_date).where(Payment.id == target.payment_id)
+    ).scalar()
+    _record(target, ('service_revenue',), [payment_date])
+
+def _on_patient(mapper, connection, target):
+    _record(target, ('patients',), [target.created_at or datetime.utcnow()])
+
+for _name, _changed_only in (('after_insert', False), ('after_update', True), ('after_delete', False)):
+    event.listen(Appointment, _name, _on_appointment(_changed_only))
+    event.listen(Payment, _name, _on_payment(_changed_only))
+    event.listen(PaymentItem, _name, _on_payment_item)
+event.listen(Patient, 'after_insert', _on_patient)
+event.listen(Patient, 'after_delete', _on_patient)
+
+@event.listens_for(db.session, 'after_flush')
+def _write_dirty_days(session, flush_context):
+    dirty = session.info.pop(SESSION_KEY, None)
+    if dirty:
+        _insert_dirty(session.connection(), sorted(dirty))
+
+# ---------- TÍNH LẠI ----------
+
+def _day_filter(column, dates):
+    # So sánh theo khoảng để dùng được index trên cột datetime, rồi lọc đúng ngày
+    day = func.date(column)
+    return (column >= min(dates), column < max(dates) + timedelta(days=1), day.in_(dates))
+
+def _replace(model, dates, columns, query):
+    db.session.execute(
+        delete(model).where(model.stat_date.in_(dates)).execution_options(synchronize_session=False)
+    )
+    db.session.execute(insert(model).from_select(columns, query))
+
+def _rebuild_appointments(dates):
+    _replace(DailyAppointmentStat, dates,
+             ['stat_date', 'status', 'department_id', 'doctor_id', 'appointment_count'],
+             select(Appointment.appointment_date, Appointment.status, Appointment.department_id,
+                    Appointment.doctor_id, func.count(Appointment.id))
+             .where(Appointment.appointment_date.in_(dates))
+             .group_by(Appointment.appointment_date, Appointment.status,
+                       Appointment.department_id, Appointment.doctor_id))
+
+def _rebuild_revenue(dates):
+    day = func.date(Payment.payment_date)
+    _replace(DailyRevenueStat, dates,
+             ['stat_date', 'payment_method', 'revenue', 'transaction_count'],
+             select(day, Payment.payment_method, func.sum(Payment.amount), func.count(Payment.id))
+             .where(Payment.payment_status == 'completed', *_day_filter(Payment.payment_date, dates))
+             .group_by(day, Payment.payment_method))
+
+def _rebuild_service_revenue(dates):
+    day = func.date(Payment.payment_date)
+    _replace(DailyServiceRevenueStat, dates,
+             ['stat_date', 'service_id', 'revenue', 'quantity'],
+             select(day, PaymentItem.service_id, func.sum(PaymentItem.total_price),
+                    func.coalesce(func.sum(PaymentItem.quantity), 0))
+             .join(Payment, PaymentItem.payment_id == Payment.id)
+             .where(Payment.payment_status == 'completed', *_day_filter(Payment.payment_date, dates))
+             .group_by(day, PaymentItem.service_id))
+
+def _rebuild_patients(dates):
+    day = func.date(Patient.created_at)
+    _replace(DailyPatientStat, dates,
+             ['stat_date', 'new_patients'],
+             select(day, func.count(Patient.id))
+             .where(*_day_filter(Patient.created_at, dates))
+             .group_by(day))
+
+REBUILDERS = {
+    'appointments': _rebuild_appointments,
+    'revenue': _rebuild_revenue,
+    'service_revenue': _rebuild_service_revenue,
+    'patients': _rebuild_patients
+}
+
+# Lấy và xóa một lô dấu cần tính lại (gộp trùng); SKIP LOCKED để nhiều worker chạy song song không tranh nhau
+CLAIM_DIRTY_DAYS_SQL = text("""
+    WITH claimed AS (
+        DELETE FROM rollup_dirty_days
+        WHERE id IN (
+            SELECT id FROM rollup_dirty_days
+            ORDER BY id
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING rollup, stat_date
+    )
+    SELECT DISTINCT rollup, stat_date FROM claimed
+""")
+
+# Khóa (rollup, ngày) đến hết transaction, theo thứ tự cố định để hai worker không deadlock
+LOCK_DAYS_SQL = text("""
+    SELECT pg_advisory_xact_lock(hashtext(day_key))
+    FROM unnest(CAST(:keys AS text[])) AS day_key
+    ORDER BY day_key
+""")
+
+# Đánh dấu mọi ngày có dữ liệu gốc hoặc đã có trong rollup (dựng lại toàn bộ / backfill)
+MARK_ALL_DAYS_SQL = text("""
+    INSERT INTO rollup_dirty_days (rollup, stat_date, marked_at)
+    SELECT 'appointments', appointment_date, :now FROM appointments GROUP BY appointment_date
+    UNION SELECT 'appointments', stat_date, :now FROM daily_appointment_stats
+    UNION SELECT 'revenue', DATE(payment_date), :now FROM payments
+        WHERE payment_date IS NOT NULL GROUP BY DATE(payment_date)
+    UNION SELECT 'revenue', stat_date, :now FROM daily_revenue_stats
+    UNION SELECT 'service_revenue', DATE(payment_date), :now FROM payments
+        WHERE payment_date IS NOT NULL GROUP BY DATE(payment_date)
+    UNION SELECT 'service_revenue', stat_date, :now FROM daily_service_revenue_stats
+    UNION SELECT 'patients', DATE(created_at), :now FROM patients
+        WHERE created_at IS NOT NULL GROUP BY DATE(created_at)
+    UNION SELECT 'patients', stat_date, :now FROM daily_patient_stats
+""")
+
+def refresh_rollups(batch_size=REFRESH_BATCH_MARKS):
+    """Tính lại các ngày đã bị đánh dấu, commit theo từng lô. Trả về số (rollup, ngày) đã tính lại."""
+    refreshed = 0
+    while True:
+        claimed = db.session.execute(CLAIM_DIRTY_DAYS_SQL, {'limit': batch_size}).all()
+        if not claimed:
+            db.session.commit()
+            return refreshed
+
+        # Cùng ngày có thể vừa được worker khác lấy từ một dấu trùng: chờ nó tính xong
+        keys = sorted(f'{rollup}:{stat_date}' for rollup, stat_date in claimed)
+        db.session.execute(LOCK_DAYS_SQL, {'keys': keys})
+        by_rollup = {}
+        for rollup, stat_date in claimed:
+            by_rollup.setdefault(rollup, []).append(stat_date)
+        for rollup, dates in by_rollup.items():
+            rebuild = REBUILDERS.get(rollup)
+            if rebuild:
+                rebuild(dates)
+        db.session.commit()
+        refreshed += len(claimed)
+        # Cache có thể đã lưu số liệu cũ của rollup trong lúc chờ refresh
+        stats_cache.invalidate(sorted({ROLLUP_GROUPS[rollup] for rollup in by_rollup if rollup in ROLLUP_GROUPS}))
+
+def rebuild_rollups():
+    """Dựng lại toàn bộ rollup từ dữ liệu gốc"""
+    db.session.execute(MARK_ALL_DAYS_SQL, {'now': datetime.utcnow()})
+    db.session.commit()
+    return refresh_rollups()
+
+_refresher_lock = threading.Lock()
+_refresher_started = False
+
+def start_rollup_refresher(app):
+    """Chạy tiến trình nền định kỳ gọi refresh_rollups (mỗi process chỉ chạy một lần)"""
+    global _refresher_started
+    with _refresher_lock:
+        if _refresher_started:
+            return
+        _refresher_started = True
+
+    interval = app.config.get('ROLLUP_REFRESH_INTERVAL_SECONDS', 60)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    refreshed = refresh_rollups()
+                    if refreshed:
+                        print(f"[ROLLUPS] Refreshed {refreshed} rollup days")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[ROLLUPS] Error: {e}")
+                finally:
+                    db.session.remove()
+
+    threading.Thread(target=run, name='rollup-refresher', daemon=True).start()
+
+# ---------- ĐỌC ----------
+
+def month_range(year, month):
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+def year_range(year):
+    return date(year, 1, 1), date(year + 1, 1, 1)
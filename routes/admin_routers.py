@@ -3,7 +3,11 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import (db, User, Doctor, Patient, Department, Service, 
                      Appointment, DoctorSchedule, Review, Feedback, 
                      MedicalRecord, Payment, SystemSetting)
-from utils import log_activity, generate_code, admin_required
+from utils import log_activity, generate_code, admin_required, invalidate_user_status, flush_with_unique_code
+from slots import sync_slot_status, invalidate_slots
+from availability_cache import availability_cache
+from stats_cache import stats_cache
+from settings_registry import bump_settings_version
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import func, extract
@@ -146,7 +150,7 @@ def create_user():
         
         # Nếu role là patient, tạo Patient record
         if data['role'] == 'patient':
-            patient_code = generate_code(prefix='PN', length=8)
+            patient_code = generate_code('PN')
             new_patient = Patient(
                 user_id=new_user.id,
                 patient_code=patient_code,
@@ -154,7 +158,7 @@ def create_user():
                 insurance_number=data.get('insurance_number'),
                 insurance_provider=data.get('insurance_provider')
             )
-            db.session.add(new_patient)
+            flush_with_unique_code(new_patient, 'patient_code', 'PN')
         
         # Nếu role là doctor, tạo Doctor record
         elif data['role'] == 'doctor':
@@ -238,6 +242,8 @@ def update_user(user_id):
     
     try:
         db.session.commit()
+        if 'is_active' in data:
+            invalidate_user_status(user.id)
         log_activity(admin_id, "UPDATE_USER", "user", user.id, f"Updated user: {user.username}")
         return jsonify({"msg": "User updated successfully"}), 200
     except IntegrityError:
@@ -264,6 +270,7 @@ def delete_user(user_id):
     
     try:
         db.session.commit()
+        invalidate_user_status(user.id)
         log_activity(admin_id, "DELETE_USER", "user", user.id, f"Deactivated user: {user.username}")
         return jsonify({"msg": "User deactivated successfully"}), 200
     except Exception as e:
@@ -699,6 +706,8 @@ def update_appointment_status(appointment_id):
     
     old_status = appointment.status
     appointment.status = new_status
+    # Admin xử lý trực tiếp: không còn áp dụng hạn giữ chỗ chờ thanh toán
+    appointment.hold_expires_at = None
     
     if new_status == 'checked_in':
         appointment.checked_in_at = datetime.utcnow()
@@ -710,6 +719,9 @@ def update_appointment_status(appointment_id):
         appointment.cancellation_reason = data.get('reason', 'Cancelled by admin')
     
     try:
+        if not sync_slot_status(appointment, old_status):
+            db.session.rollback()
+            return jsonify({"msg": "This time slot is fully booked"}), 409
         db.session.commit()
         log_activity(admin_id, "UPDATE_APPOINTMENT_STATUS", "appointment", appointment.id, 
                     f"Changed status from {old_status} to {new_status}")
@@ -921,9 +933,26 @@ def update_system_setting(setting_id):
     setting.updated_by = admin_id
     
     try:
+        # Độ dài slot thay đổi: các slot đã materialize không còn đúng
+        if setting.key == 'appointment_buffer_minutes':
+            invalidate_slots()
+        bump_settings_version(setting)
         db.session.commit()
         log_activity(admin_id, "UPDATE_SETTING", "system_setting", setting.id, f"Updated setting: {setting.key}")
         return jsonify({"msg": "Setting updated successfully"}), 200
     except Exception as e:
         db.session.rollback()
-        return jsonify({"msg": f"Error updating setting: {str(e)}"}), 500
\ No newline at end of file
+        return jsonify({"msg": f"Error updating setting: {str(e)}"}), 500
+# =============================================
+# THỐNG KÊ CACHE
+# =============================================
+
+@admin_bp.route('/cache-stats', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_cache_stats():
+    """Số lần hit/miss của các cache trong process hiện tại"""
+    return jsonify({
+        'availability': dict(availability_cache.stats.as_dict(), entries=len(availability_cache.backend)),
+        'stats': stats_cache.as_dict()
+    }), 200
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from models import db, User, Patient
-from utils import log_activity, generate_code
+from utils import log_activity, generate_code, build_identity_claims, flush_with_unique_code
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
@@ -30,9 +30,9 @@ def register():
         db.session.add(new_user)
         db.session.flush() 
         
-        patient_code = generate_code(prefix='PN', length=8)
+        patient_code = generate_code('PN')
         new_patient = Patient(user_id=new_user.id, patient_code=patient_code)
-        db.session.add(new_patient)
+        flush_with_unique_code(new_patient, 'patient_code', 'PN')
         
         db.session.commit()
         log_activity(new_user.id, "REGISTER", "user", new_user.id, "New patient registered")
@@ -60,9 +60,12 @@ def login():
         # Use string identity to ensure JWT 'sub' is a string (avoid PyJWT Subject type errors)
         access_token = create_access_token(
             identity=str(user.id),
-            additional_claims={'role': user.role}
+            additional_claims=build_identity_claims(user)
         )
         user.last_login = datetime.utcnow()
+        # Cost factor đã đổi: băm lại mật khẩu khi còn có mật khẩu gốc trong tay
+        if user.password_needs_rehash():
+            user.set_password(password)
         db.session.commit()
         log_activity(user.id, "LOGIN", "user", user.id, "User logged in")
         return jsonify(
@@ -1,9 +1,18 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Payment, db, Appointment, Doctor, DoctorSchedule, Service, User
-from utils import log_activity, generate_code, get_patient_id_from_user, get_system_setting
-from datetime import datetime, timedelta, time
+from models import Payment, db, Appointment, Doctor, Service, User, Patient, ActivityLog
+from utils import (log_activity, generate_code, get_patient_id_from_user, get_system_setting, staff_or_admin_required,
+                   flush_with_unique_code)
+from slots import (get_available_day_slots, reserve_slot, sync_slot_status, build_availability,
+                   get_hold_expiry, is_doctor_on_leave, find_next_available, reserve_slots_bulk)
+from leave_index import leave_index
+from idempotency import idempotent
+from codes import next_codes
+from rollups import mark_rollup_dirty
+from datetime import datetime, time
+from sqlalchemy import insert
 from sqlalchemy.exc import SQLAlchemyError
+from collections import Counter
 import pytz
 
 booking_bp = Blueprint('booking', __name__)
@@ -16,57 +25,124 @@ def get_available_slots(doctor_id):
     
     try:
         target_date = datetime.strptime(target_date_str, '%Y-%m-%d').date()
-        day_of_week = target_date.weekday() + 1
-        if day_of_week == 7: 
-             day_of_week = 0 
     except ValueError:
         return jsonify({"msg": "Invalid date format. Use YYYY-MM-DD"}), 400
 
-    schedules = DoctorSchedule.query.filter_by(
-        doctor_id=doctor_id, 
-        day_of_week=day_of_week, 
-        is_active=True
-    ).all()
+    available_slots = get_available_day_slots(doctor_id, target_date)
 
-    if not schedules:
+    if available_slots is None:
         return jsonify({"msg": "Doctor is not scheduled on this day"}), 404
 
-    booked_appointments = Appointment.query.filter(
-        Appointment.doctor_id == doctor_id,
-        Appointment.appointment_date == target_date,
-        Appointment.status.in_(['pending', 'confirmed'])
-    ).all()
-    
-    booked_slots = {} 
-    for app in booked_appointments:
-        slot_key = (app.appointment_time.hour, app.appointment_time.minute)
-        booked_slots[slot_key] = booked_slots.get(slot_key, 0) + 1
-        
-    buffer_minutes = int(get_system_setting('appointment_buffer_minutes', '15'))
-    available_slots = []
+    return jsonify(available_slots), 200
 
-    for schedule in schedules:
-        start = datetime.combine(target_date, schedule.start_time)
-        end = datetime.combine(target_date, schedule.end_time)
-        current_slot_start = start
-        
-        while current_slot_start + timedelta(minutes=buffer_minutes) <= end:
-            slot_key = (current_slot_start.hour, current_slot_start.minute)
-            current_bookings = booked_slots.get(slot_key, 0)
-            
-            if current_bookings < schedule.max_patients:
-                available_slots.append({
-                    'start_time': current_slot_start.strftime('%H:%M'),
-                    'end_time': (current_slot_start + timedelta(minutes=buffer_minutes)).strftime('%H:%M'),
-                    'capacity': schedule.max_patients - current_bookings
-                })
-            
-            current_slot_start += timedelta(minutes=buffer_minutes)
+MAX_AVAILABILITY_DAYS = 31
 
-    return jsonify(available_slots), 200
+@booking_bp.route('/availability', methods=['GET'])
+def get_batch_availability():
+    """
+    Slot còn trống của nhiều bác sĩ trong nhiều ngày (một response duy nhất)
+    GET /api/booking/availability?department_id=1&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD
+    GET /api/booking/availability?doctor_ids=1,2,3&date_from=...&date_to=...
+    """
+    department_id = request.args.get('department_id', type=int)
+    doctor_ids_str = request.args.get('doctor_ids')
+
+    if not department_id and not doctor_ids_str:
+        return jsonify({"msg": "Missing 'department_id' or 'doctor_ids' parameter"}), 400
+
+    try:
+        date_from = datetime.strptime(request.args.get('date_from', ''), '%Y-%m-%d').date()
+        date_to = datetime.strptime(request.args.get('date_to', request.args.get('date_from', '')), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({"msg": "Invalid or missing date_from/date_to. Use YYYY-MM-DD"}), 400
+
+    if date_to < date_from:
+        return jsonify({"msg": "date_to must not be before date_from"}), 400
+    if (date_to - date_from).days + 1 > MAX_AVAILABILITY_DAYS:
+        return jsonify({"msg": f"Date range must not exceed {MAX_AVAILABILITY_DAYS} days"}), 400
+
+    if doctor_ids_str:
+        try:
+            doctor_ids = sorted({int(x) for x in doctor_ids_str.split(',') if x.strip()})
+        except ValueError:
+            return jsonify({"msg": "Invalid doctor_ids. Use comma-separated integers"}), 400
+    else:
+        doctor_ids = [
+            doctor_id for (doctor_id,) in db.session.query(Doctor.id).filter(
+                Doctor.department_id == department_id,
+                Doctor.is_available == True
+            ).order_by(Doctor.id).all()
+        ]
+
+    availability = build_availability(doctor_ids, date_from, date_to)
+
+    results = []
+    for doctor_id in doctor_ids:
+        days = availability.get(doctor_id, {})
+        results.append({
+            'doctor_id': doctor_id,
+            'days': [
+                {'date': slot_date.strftime('%Y-%m-%d'), 'slots': slots}
+                for slot_date, slots in sorted(days.items())
+            ]
+        })
+
+    return jsonify({
+        'date_from': date_from.strftime('%Y-%m-%d'),
+        'date_to': date_to.strftime('%Y-%m-%d'),
+        'doctors': results
+    }), 200
+
+MAX_NEXT_AVAILABLE_LIMIT = 50
+MAX_NEXT_AVAILABLE_HORIZON_DAYS = 90
+
+@booking_bp.route('/next-available', methods=['GET'])
+def get_next_available_slots():
+    """
+    N slot trống sớm nhất của một chuyên khoa hoặc nhóm bác sĩ
+    GET /api/booking/next-available?department_id=1&limit=5
+    GET /api/booking/next-available?doctor_ids=1,2,3&from=YYYY-MM-DD&horizon_days=30
+    """
+    department_id = request.args.get('department_id', type=int)
+    doctor_ids_str = request.args.get('doctor_ids')
+    limit = min(request.args.get('limit', 5, type=int), MAX_NEXT_AVAILABLE_LIMIT)
+    horizon_days = min(request.args.get('horizon_days', 30, type=int), MAX_NEXT_AVAILABLE_HORIZON_DAYS)
+
+    if not department_id and not doctor_ids_str:
+        return jsonify({"msg": "Missing 'department_id' or 'doctor_ids' parameter"}), 400
+
+    if limit < 1 or horizon_days < 1:
+        return jsonify({"msg": "limit and horizon_days must be positive"}), 400
+
+    try:
+        start_date = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else datetime.utcnow().date()
+    except ValueError:
+        return jsonify({"msg": "Invalid 'from' date. Use YYYY-MM-DD"}), 400
+
+    doctor_query = db.session.query(Doctor.id, User.full_name).join(
+        User, Doctor.user_id == User.id
+    ).filter(Doctor.is_available == True)
+
+    if doctor_ids_str:
+        try:
+            doctor_ids = {int(x) for x in doctor_ids_str.split(',') if x.strip()}
+        except ValueError:
+            return jsonify({"msg": "Invalid doctor_ids. Use comma-separated integers"}), 400
+        doctor_query = doctor_query.filter(Doctor.id.in_(doctor_ids))
+    else:
+        doctor_query = doctor_query.filter(Doctor.department_id == department_id)
+
+    doctor_names = dict(doctor_query.all())
+
+    slots = find_next_available(list(doctor_names), limit, start_date, horizon_days)
+    for slot in slots:
+        slot['doctor_name'] = doctor_names.get(slot['doctor_id'], 'N/A')
+
+    return jsonify(slots), 200
 
 @booking_bp.route('/appointments', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_appointment():
     # Debug: log incoming request headers and raw body to help trace 422 errors
     try:
@@ -109,19 +185,13 @@ def create_appointment():
     service = Service.query.get(service_id)
     if not doctor or not service:
           return jsonify({"msg": "Doctor or Service not found"}), 404
-          
-    existing_appointment = Appointment.query.filter(
-        Appointment.doctor_id == doctor_id,
-        Appointment.appointment_date == appointment_date,
-        Appointment.appointment_time == appointment_time,
-        Appointment.status.in_(['pending', 'confirmed'])
-    ).first()
-    if existing_appointment:
-        return jsonify({"msg": "This time slot is already booked"}), 409
 
+    if is_doctor_on_leave(doctor_id, appointment_date, appointment_time):
+        return jsonify({"msg": "Doctor is on leave at this time"}), 409
+          
     # --- 1. TẠO APPOINTMENT ---
     new_appointment = Appointment(
-        appointment_code=generate_code(prefix='AP', length=10),
+        appointment_code=generate_code('AP'),
         patient_id=patient_id,
         doctor_id=doctor_id,
         department_id=doctor.department_id,
@@ -129,12 +199,13 @@ def create_appointment():
         appointment_date=appointment_date,
         appointment_time=appointment_time,
         status='pending',
+        hold_expires_at=get_hold_expiry(),
         reason=data.get('reason'),
         symptoms=data.get('symptoms')
     )
 
     # --- 2. TẠO PAYMENT RECORD (STATUS: PENDING) ---
-    payment_code = generate_code('PAY', length=12) # Generate mã thanh toán
+    payment_code = generate_code('PAY') # Generate mã thanh toán
     
     new_payment = Payment(
         payment_code=payment_code,
@@ -147,13 +218,18 @@ def create_appointment():
     )
     
     try:
-        # Thêm Appointment trước để có ID
-        db.session.add(new_appointment)
-        db.session.flush() # Lấy ID của new_appointment trước khi commit
+        # Giữ chỗ trong slot (UPDATE có điều kiện, khóa dòng) thay cho SELECT kiểm tra trùng
+        if not reserve_slot(doctor_id, appointment_date, appointment_time):
+            db.session.rollback()
+            return jsonify({"msg": "This time slot is fully booked or not available"}), 409
+
+        # Thêm Appointment trước để có ID (mã trùng thì sinh mã mới và thử lại)
+        flush_with_unique_code(new_appointment, 'appointment_code', 'AP')
 
         # Gán appointment_id cho payment
         new_payment.appointment_id = new_appointment.id 
-        db.session.add(new_payment)
+        new_payment.description = f'Thanh toán khám bệnh: {new_appointment.appointment_code}'
+        flush_with_unique_code(new_payment, 'payment_code', 'PAY')
 
         db.session.commit()
         
@@ -178,6 +254,171 @@ def create_appointment():
         print(f"Critical Error: {e}") 
         return jsonify({"msg": f"Critical server error: {str(e)}"}), 500
 
+MAX_BATCH_BOOKING_ITEMS = 100
+
+@booking_bp.route('/appointments/batch', methods=['POST'])
+@jwt_required()
+@staff_or_admin_required
+def create_appointments_batch():
+    """
+    Đặt nhiều lịch hẹn cùng lúc (dành cho nhân viên tổng đài)
+    Body: {"items": [{"patient_id", "doctor_id", "service_id", "appointment_date", "appointment_time",
+                      "reason", "symptoms", "payment_method"}, ...]}
+    Toàn bộ lịch hẹn, payment và activity log được ghi trong một transaction.
+    Nhiều dòng cùng một slot: giữ được bao nhiêu chỗ thì nhận bấy nhiêu dòng đầu, các dòng còn lại thất bại.
+    """
+    staff_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"msg": "items must be a non-empty list"}), 400
+    if len(items) > MAX_BATCH_BOOKING_ITEMS:
+        return jsonify({"msg": f"At most {MAX_BATCH_BOOKING_ITEMS} items per batch"}), 400
+
+    results = [None] * len(items)
+    parsed = {}
+
+    # --- 1. KIỂM TRA DỮ LIỆU TỪNG DÒNG ---
+    now_utc = datetime.utcnow()
+    for index, item in enumerate(items):
+        try:
+            parsed[index] = {
+                'patient_id': int(item['patient_id']),
+                'doctor_id': int(item['doctor_id']),
+                'service_id': int(item['service_id']),
+                'appointment_date': datetime.strptime(item['appointment_date'], '%Y-%m-%d').date(),
+                'appointment_time': datetime.strptime(item['appointment_time'], '%H:%M').time(),
+                'reason': item.get('reason'),
+                'symptoms': item.get('symptoms'),
+                'payment_method': item.get('payment_method', 'cash')
+            }
+        except (KeyError, ValueError, TypeError) as e:
+            results[index] = {'index': index, 'success': False, 'msg': f"Missing or invalid data field: {e}"}
+            continue
+
+        booking = parsed[index]
+        if datetime.combine(booking['appointment_date'], booking['appointment_time']) < now_utc:
+            results[index] = {'index': index, 'success': False, 'msg': "Cannot book an appointment in the past"}
+            del parsed[index]
+        elif booking['payment_method'] not in ('cash', 'credit_card', 'momo', 'vnpay', 'zalopay', 'bank_transfer'):
+            results[index] = {'index': index, 'success': False, 'msg': "Invalid payment_method"}
+            del parsed[index]
+
+    # --- 2. NẠP BÁC SĨ / DỊCH VỤ / BỆNH NHÂN BẰNG TRUY VẤN IN ---
+    doctors = {d.id: d for d in Doctor.query.filter(
+        Doctor.id.in_({b['doctor_id'] for b in parsed.values()})).all()} if parsed else {}
+    services = {s.id: s for s in Service.query.filter(
+        Service.id.in_({b['service_id'] for b in parsed.values()})).all()} if parsed else {}
+    patient_ids = {pid for (pid,) in db.session.query(Patient.id).filter(
+        Patient.id.in_({b['patient_id'] for b in parsed.values()})).all()} if parsed else set()
+
+    # Một truy vấn ngày nghỉ cho mọi bác sĩ trong batch thay vì một truy vấn mỗi dòng
+    leave_index.preload({b['doctor_id'] for b in parsed.values() if b['doctor_id'] in doctors})
+
+    for index in list(parsed):
+        booking = parsed[index]
+        msg = None
+        if booking['doctor_id'] not in doctors or booking['service_id'] not in services:
+            msg = "Doctor or Service not found"
+        elif booking['patient_id'] not in patient_ids:
+            msg = "Patient not found"
+        elif is_doctor_on_leave(booking['doctor_id'], booking['appointment_date'], booking['appointment_time']):
+            msg = "Doctor is on leave at this time"
+        if msg:
+            results[index] = {'index': index, 'success': False, 'msg': msg}
+            del parsed[index]
+
+    try:
+        # --- 3. GIỮ CHỖ CHO TẤT CẢ SLOT BẰNG MỘT CÂU UPDATE ---
+        slot_key = lambda b: (b['doctor_id'], b['appointment_date'], b['appointment_time'])
+        reserved = reserve_slots_bulk(Counter(slot_key(b) for b in parsed.values()))
+
+        # Slot còn ít chỗ hơn số dòng yêu cầu: các dòng đầu (theo thứ tự trong batch) được giữ chỗ,
+        # phần vượt quá bị từ chối
+        remaining = dict(reserved)
+        for index in sorted(parsed):
+            key = slot_key(parsed[index])
+            if remaining.get(key, 0) > 0:
+                remaining[key] -= 1
+                continue
+            results[index] = {'index': index, 'success': False,
+                              'msg': "This time slot is fully booked or not available"}
+            del parsed[index]
+
+        if parsed:
+            indexes = sorted(parsed)
+            appointment_codes = next_codes('AP', len(indexes))
+            payment_codes = next_codes('PAY', len(indexes))
+
+            # --- 4. INSERT ... RETURNING CHO APPOINTMENTS ---
+            appointment_rows = db.session.execute(
+                insert(Appointment).returning(Appointment.id, Appointment.appointment_code,
+                                              sort_by_parameter_order=True),
+                [{
+                    'appointment_code': code,
+                    'patient_id': parsed[i]['patient_id'],
+                    'doctor_id': parsed[i]['doctor_id'],
+                    'department_id': doctors[parsed[i]['doctor_id']].department_id,
+                    'service_id': parsed[i]['service_id'],
+                    'appointment_date': parsed[i]['appointment_date'],
+                    'appointment_time': parsed[i]['appointment_time'],
+                    'status': 'pending',
+                    'reason': parsed[i]['reason'],
+                    'symptoms': parsed[i]['symptoms']
+                } for i, code in zip(indexes, appointment_codes)]
+            ).all()
+
+            # --- 5. INSERT ... RETURNING CHO PAYMENTS ---
+            payment_rows = db.session.execute(
+                insert(Payment).returning(Payment.id, sort_by_parameter_order=True),
+                [{
+                    'payment_code': code,
+                    'appointment_id': appointment_id,
+                    'patient_id': parsed[i]['patient_id'],
+                    'amount': services[parsed[i]['service_id']].price,
+                    'payment_method': parsed[i]['payment_method'],
+                    'payment_status': 'pending',
+                    'description': f'Thanh toán khám bệnh: {appointment_code}'
+                } for i, (appointment_id, appointment_code), code in zip(indexes, appointment_rows, payment_codes)]
+            ).all()
+
+            # Insert hàng loạt không đi qua event của mapper: tự đánh dấu ngày cho rollup thống kê
+            mark_rollup_dirty('appointments', {parsed[i]['appointment_date'] for i in indexes})
+
+            # --- 6. ACTIVITY LOG TRONG CÙNG TRANSACTION ---
+            db.session.execute(insert(ActivityLog), [{
+                'user_id': staff_id,
+                'action': "CREATE_APPOINTMENT",
+                'entity_type': "appointment",
+                'entity_id': appointment_id,
+                'description': f"Batch booked AP code: {appointment_code}"
+            } for appointment_id, appointment_code in appointment_rows])
+
+            for i, (appointment_id, appointment_code), (payment_id,) in zip(indexes, appointment_rows, payment_rows):
+                results[i] = {
+                    'index': i,
+                    'success': True,
+                    'appointment_id': appointment_id,
+                    'appointment_code': appointment_code,
+                    'payment_id': payment_id,
+                    'required_payment': str(services[parsed[i]['service_id']].price)
+                }
+
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"SQLAlchemy Error: {e}")
+        return jsonify({"msg": f"Database error during batch booking: {str(e)}"}), 500
+
+    created = sum(1 for r in results if r['success'])
+    return jsonify({
+        "msg": f"{created}/{len(items)} appointments created",
+        "created": created,
+        "failed": len(items) - created,
+        "results": results
+    }), 201 if created else 400
+
 @booking_bp.route('/appointments/me', methods=['GET'])
 @jwt_required()
 def get_my_appointments():
@@ -230,10 +471,13 @@ def cancel_appointment(appointment_id):
         return jsonify({"msg": f"Cancellation is only allowed {cancellation_hours} hours before the appointment."}), 400
 
     try:
+        old_status = appointment.status
         appointment.status = 'cancelled'
         appointment.cancellation_reason = request.get_json().get('reason', 'Cancelled by patient via app')
         appointment.cancelled_by = user_id
         appointment.cancelled_at = datetime.utcnow()
+        appointment.hold_expires_at = None
+        sync_slot_status(appointment, old_status)
         db.session.commit()
         log_activity(user_id, "CANCEL_APPOINTMENT", "appointment", appointment.id, f"Cancelled AP code: {appointment.appointment_code}")
         
@@ -3,7 +3,10 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import (db, User, Doctor, Appointment, MedicalRecord, 
                      Prescription, DoctorSchedule, DoctorLeave, Patient,
                      FollowUpReminder)
-from utils import log_activity, generate_code, doctor_required, get_doctor_id_from_user
+from utils import log_activity, generate_code, doctor_required, get_doctor_id_from_user, flush_with_unique_code
+from slots import sync_slot_status, invalidate_slots
+from leave_index import leave_index
+from availability_cache import mark_leave_changed
 from datetime import datetime, timedelta
 from sqlalchemy.exc import IntegrityError
 from flask import Blueprint, jsonify, request
@@ -270,6 +273,7 @@ def check_in_appointment(appointment_id):
     appointment.checked_in_at = datetime.utcnow()
     
     try:
+        sync_slot_status(appointment, 'confirmed')
         db.session.commit()
         log_activity(user_id, "CHECK_IN_APPOINTMENT", "appointment", appointment.id, 
                     f"Checked in appointment: {appointment.appointment_code}")
@@ -308,7 +312,7 @@ def create_medical_record():
         return jsonify({"msg": "Appointment must be checked-in first"}), 400
     
     # Tạo medical record
-    record_code = generate_code(prefix='MR', length=10)
+    record_code = generate_code('MR')
     
     new_record = MedicalRecord(
         record_code=record_code,
@@ -331,15 +335,15 @@ def create_medical_record():
     appointment.completed_at = datetime.utcnow()
     
     try:
-        db.session.add(new_record)
+        flush_with_unique_code(new_record, 'record_code', 'MR')
         db.session.commit()
         log_activity(user_id, "CREATE_MEDICAL_RECORD", "medical_record", new_record.id, 
-                    f"Created medical record: {record_code}")
+                    f"Created medical record: {new_record.record_code}")
         
         return jsonify({
             "msg": "Medical record created successfully",
             "record_id": new_record.id,
-            "record_code": record_code
+            "record_code": new_record.record_code
         }), 201
     except Exception as e:
         db.session.rollback()
@@ -566,6 +570,7 @@ def create_recurring_schedule(): # <<< TÊN HÀM MỚI
     
     try:
         db.session.add(new_schedule)
+        invalidate_slots(doctor_id)
         db.session.commit()
         log_activity(user_id, "CREATE_SCHEDULE", "doctor_schedule", new_schedule.id, 
                     f"Created schedule for day {day_name}")
@@ -596,6 +601,7 @@ def delete_schedule(schedule_id):
     
     try:
         db.session.delete(schedule)
+        invalidate_slots(doctor_id)
         db.session.commit()
         log_activity(user_id, "DELETE_SCHEDULE", "doctor_schedule", schedule_id, 
                     f"Deleted schedule ID: {schedule_id}")
@@ -636,7 +642,9 @@ def register_leave():
     
     try:
         db.session.add(new_leave)
+        mark_leave_changed(doctor_id)
         db.session.commit()
+        leave_index.invalidate(doctor_id)
         log_activity(user_id, "REGISTER_LEAVE", "doctor_leave", new_leave.id, 
                     f"Registered leave for {leave_date}")
         
@@ -718,6 +726,7 @@ def create_schedule():
     
     try:
         db.session.add(new_schedule)
+        invalidate_slots(doctor_id)
         db.session.commit()
         log_activity(user_id, "CREATE_SCHEDULE", "doctor_schedule", new_schedule.id, 
                     f"Created schedule for {data['day_of_week']}")
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Notification, User
-from utils import log_activity
+from utils import log_activity, get_current_role
 from datetime import datetime
 from sqlalchemy import or_
 
@@ -102,10 +102,9 @@ def mark_all_as_read():
 @jwt_required()
 def get_sent_history():
     """Admin xem lịch sử tất cả thông báo đã gửi"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role != 'admin':
+    if role != 'admin':
         return jsonify({"msg": "Admin access required"}), 403
     
     page = request.args.get('page', 1, type=int)
@@ -207,9 +206,9 @@ def get_unread_count():
 def send_notification():
     """Gửi thông báo (Admin hoặc System)"""
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role not in ['admin', 'staff']:
+    if role not in ['admin', 'staff']:
         return jsonify({"msg": "Permission denied"}), 403
     
     data = request.get_json()
@@ -248,9 +247,9 @@ def send_notification():
 def broadcast_notification():
     """Gửi thông báo hàng loạt (Broadcast)"""
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role != 'admin':
+    if role != 'admin':
         return jsonify({"msg": "Admin access required"}), 403
     
     data = request.get_json()
@@ -301,9 +300,9 @@ def broadcast_notification():
 def update_broadcast_notification():
     """Admin cập nhật thông báo broadcast đã gửi"""
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role != 'admin':
+    if role != 'admin':
         return jsonify({"msg": "Admin access required"}), 403
     
     data = request.get_json()
@@ -354,9 +353,9 @@ def update_broadcast_notification():
 def delete_broadcast_notification():
     """Admin xóa thông báo broadcast đã gửi"""
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role != 'admin':
+    if role != 'admin':
         return jsonify({"msg": "Admin access required"}), 403
     
     data = request.get_json()
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User
-from utils import log_activity, generate_code
+from utils import log_activity, generate_code, get_current_role
 from datetime import datetime, timedelta
 import secrets
 
@@ -251,9 +251,8 @@ def resend_verification_email():
 def admin_verify_user(user_id):
     """Admin xác thực user thủ công"""
     admin_id = get_jwt_identity()
-    admin = User.query.get(admin_id)
     
-    if admin.role != 'admin':
+    if get_current_role() != 'admin':
         return jsonify({"msg": "Admin access required"}), 403
     
     user = User.query.get_or_404(user_id)
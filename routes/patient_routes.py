@@ -3,6 +3,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import (db, User, Patient, Appointment, MedicalRecord, 
                      Prescription, Payment, Review)
 from utils import log_activity, get_patient_id_from_user, patient_required
+from slots import sync_slot_reschedule, is_doctor_on_leave
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
 
@@ -207,17 +208,8 @@ def reschedule_appointment(appointment_id):
     except (KeyError, ValueError):
         return jsonify({"msg": "Invalid date or time format"}), 400
     
-    # Kiểm tra slot mới có trống không
-    existing_appointment = Appointment.query.filter(
-        Appointment.doctor_id == appointment.doctor_id,
-        Appointment.appointment_date == new_date,
-        Appointment.appointment_time == new_time,
-        Appointment.status.in_(['pending', 'confirmed']),
-        Appointment.id != appointment_id
-    ).first()
-    
-    if existing_appointment:
-        return jsonify({"msg": "This time slot is already booked"}), 409
+    if is_doctor_on_leave(appointment.doctor_id, new_date, new_time):
+        return jsonify({"msg": "Doctor is on leave at this time"}), 409
     
     # Lưu lịch sử thay đổi (có thể tạo AppointmentHistory record)
     from models import AppointmentHistory
@@ -233,10 +225,16 @@ def reschedule_appointment(appointment_id):
         change_reason=data.get('reason', 'Rescheduled by patient')
     )
     
+    old_date = appointment.appointment_date
+    old_time = appointment.appointment_time
     appointment.appointment_date = new_date
     appointment.appointment_time = new_time
     
     try:
+        # Giữ chỗ ở slot mới và trả chỗ ở slot cũ
+        if not sync_slot_reschedule(appointment, old_date, old_time):
+            db.session.rollback()
+            return jsonify({"msg": "This time slot is fully booked or not available"}), 409
         db.session.add(history)
         db.session.commit()
         log_activity(user_id, "RESCHEDULE_APPOINTMENT", "appointment", appointment.id, 
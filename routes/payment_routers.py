@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify, redirect
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Payment, PaymentItem, Appointment, Service, Patient, User
-from utils import log_activity, generate_code, get_patient_id_from_user
-from datetime import datetime
+from utils import log_activity, generate_code, get_patient_id_from_user, flush_with_unique_code
+from slots import get_hold_expiry, settle_paid_appointment
+from idempotency import idempotent
 import hashlib
 import hmac
 import json
@@ -36,8 +37,19 @@ def generate_momo_signature(raw_signature, secret_key):
 
 
 
+def extend_appointment_hold(appointment_id):
+    """Gia hạn giữ chỗ của lịch hẹn pending khi bắt đầu thanh toán (không commit)"""
+    if not appointment_id:
+        return
+    Appointment.query.filter(
+        Appointment.id == appointment_id,
+        Appointment.status == 'pending'
+    ).update({'hold_expires_at': get_hold_expiry()}, synchronize_session=False)
+
+
 @payment_bp.route('/create', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_payment_record():
     """Tạo payment record ban đầu với status pending"""
     user_id = get_jwt_identity()
@@ -92,13 +104,13 @@ def create_payment_record():
     )
     
     try:
-        db.session.add(payment)
+        flush_with_unique_code(payment, 'payment_code', 'PAY')
         db.session.commit()
         
-        print(f"[CREATE PAYMENT] ✅ Created payment: {payment_code} (ID: {payment.id})")
+        print(f"[CREATE PAYMENT] ✅ Created payment: {payment.payment_code} (ID: {payment.id})")
         
         log_activity(user_id, "CREATE_PAYMENT", "payment", payment.id, 
-                    f"Created payment record {payment_code}")
+                    f"Created payment record {payment.payment_code}")
         
         return jsonify({
             "payment_id": payment.id,
@@ -192,6 +204,8 @@ def initiate_momo_payment_gateway():
         if result.get('resultCode') == 0:
             payment.payment_status = 'processing'
             payment.transaction_id = request_id
+            # Gia hạn giữ chỗ trong lúc người dùng thanh toán trên MoMo
+            extend_appointment_hold(payment.appointment_id)
             db.session.commit()
             
             log_activity(user_id, "INIT_MOMO_PAYMENT", "payment", payment.id, 
@@ -275,17 +289,13 @@ def momo_payment_callback():
     
     # ✅ CẬP NHẬT DATABASE
     if result_code == '0':
-        payment.payment_status = 'completed'
-        payment.payment_date = datetime.utcnow()
-        payment.transaction_id = trans_id
-        
-        if payment.appointment_id:
-            appointment = Appointment.query.get(payment.appointment_id)
-            if appointment and appointment.status == 'pending':
-                appointment.status = 'confirmed'
-        
+        completed, appointment = settle_paid_appointment(payment, trans_id)
         db.session.commit()
         
+        if not completed:
+            print(f"[REFUND] ⚠️ Payment received for cancelled appointment: {order_id}")
+            return jsonify({"msg": "Appointment was cancelled before payment; the payment will be refunded"}), 200
+        
         print(f"[SUCCESS] ✅ Payment completed: {order_id}")
         print(f"[SUCCESS] ✅ Appointment confirmed: {appointment.appointment_code if appointment else 'N/A'}")
         
@@ -352,16 +362,11 @@ def momo_payment_ipn():
         return jsonify({'resultCode': 99, 'message': 'Payment not found'}), 200
     
     if result_code == '0':
-        payment.payment_status = 'completed'
-        payment.payment_date = datetime.utcnow()
-        payment.transaction_id = trans_id
-        
-        if payment.appointment_id:
-            appointment = Appointment.query.get(payment.appointment_id)
-            if appointment and appointment.status == 'pending':
-                appointment.status = 'confirmed'
-        
+        completed, _ = settle_paid_appointment(payment, trans_id)
         db.session.commit()
+        if not completed:
+            print(f"[IPN REFUND] ⚠️ Payment received for cancelled appointment: {order_id}")
+            return jsonify({'resultCode': 0, 'message': 'Confirmed'}), 200
         print(f"[IPN SUCCESS] ✅ Payment completed via IPN: {order_id}")
         return jsonify({'resultCode': 0, 'message': 'Success'}), 200
     else:
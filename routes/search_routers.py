@@ -1,9 +1,16 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required
 from models import (db, User, Doctor, Patient, Appointment, MedicalRecord, 
                      Department, Service, Payment)
 from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import aliased, contains_eager, joinedload
 from datetime import datetime
+from functools import partial
+import time
+from utils import get_current_role
+from search_backend import get_search_backend
+from people_index import people_index, patient_age
+from fanout import run_parallel
 
 search_bp = Blueprint('search', __name__)
 
@@ -15,10 +22,9 @@ search_bp = Blueprint('search', __name__)
 @jwt_required()
 def global_search():
     """Tìm kiếm toàn cục - Admin"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role not in ['admin', 'staff']:
+    if role not in ['admin', 'staff']:
         return jsonify({"msg": "Permission denied"}), 403
     
     query = request.args.get('q', '').strip()
@@ -27,92 +33,133 @@ def global_search():
     if not query or len(query) < 2:
         return jsonify({"msg": "Search query must be at least 2 characters"}), 400
     
-    results = {
-        'query': query,
-        'patients': [],
-        'doctors': [],
-        'appointments': [],
-        'medical_records': []
+    sections = {
+        'patients': _global_patients,
+        'doctors': _global_doctors,
+        'appointments': _global_appointments,
+        'medical_records': _global_medical_records
     }
-    
-    search_pattern = f'%{query}%'
-    
-    # Tìm kiếm Patients
-    if search_type in ['all', 'patient']:
-        patients = Patient.query.join(User).filter(
-            or_(
-                User.full_name.ilike(search_pattern),
-                User.email.ilike(search_pattern),
-                User.phone.ilike(search_pattern),
-                Patient.patient_code.ilike(search_pattern)
-            )
-        ).limit(10).all()
-        
-        for patient in patients:
-            results['patients'].append({
-                'id': patient.id,
-                'patient_code': patient.patient_code,
-                'full_name': patient.user.full_name,
-                'email': patient.user.email,
-                'phone': patient.user.phone
-            })
-    
-    # Tìm kiếm Doctors
-    if search_type in ['all', 'doctor']:
-        doctors = Doctor.query.join(User).filter(
-            or_(
-                User.full_name.ilike(search_pattern),
-                User.email.ilike(search_pattern),
-                Doctor.specialization.ilike(search_pattern),
-                Doctor.license_number.ilike(search_pattern)
-            )
-        ).limit(10).all()
-        
-        for doctor in doctors:
-            results['doctors'].append({
-                'id': doctor.id,
-                'full_name': doctor.user.full_name,
-                'specialization': doctor.specialization,
-                'license_number': doctor.license_number,
-                'email': doctor.user.email
-            })
-    
-    # Tìm kiếm Appointments
-    if search_type in ['all', 'appointment']:
-        appointments = Appointment.query.filter(
-            Appointment.appointment_code.ilike(search_pattern)
-        ).limit(10).all()
-        
-        for appointment in appointments:
-            results['appointments'].append({
-                'id': appointment.id,
-                'appointment_code': appointment.appointment_code,
-                'patient_name': appointment.patient.user.full_name if appointment.patient else 'N/A',
-                'doctor_name': appointment.doctor.user.full_name if appointment.doctor else 'N/A',
-                'appointment_date': appointment.appointment_date.strftime('%Y-%m-%d'),
-                'status': appointment.status
-            })
-    
-    # Tìm kiếm Medical Records
-    if search_type in ['all', 'medical_record']:
-        records = MedicalRecord.query.filter(
-            or_(
-                MedicalRecord.record_code.ilike(search_pattern),
-                MedicalRecord.diagnosis.ilike(search_pattern)
-            )
-        ).limit(10).all()
-        
-        for record in records:
-            results['medical_records'].append({
-                'id': record.id,
-                'record_code': record.record_code,
-                'patient_name': record.patient.user.full_name if record.patient else 'N/A',
-                'diagnosis': record.diagnosis,
-                'visit_date': record.visit_date.strftime('%Y-%m-%d')
-            })
+    wanted = {
+        'all': list(sections),
+        'patient': ['patients'],
+        'doctor': ['doctors'],
+        'appointment': ['appointments'],
+        'medical_record': ['medical_records']
+    }.get(search_type, [])
+    
+    results = {'query': query}
+    results.update({name: [] for name in sections})
+    
+    # Bệnh nhân/bác sĩ: trả lời từ index trong bộ nhớ nếu đã sẵn sàng
+    tasks = {}
+    timings = {}
+    for name in wanted:
+        if name in ('patients', 'doctors') and people_index.ready:
+            started = time.perf_counter()
+            results[name] = _indexed_people(name, query)
+            timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        else:
+            tasks[name] = partial(sections[name], query)
+    
+    # Các truy vấn còn lại chạy song song, mỗi truy vấn một connection
+    timeout_ms = current_app.config.get('GLOBAL_SEARCH_TIMEOUT_MS', 2000)
+    outcome = run_parallel(tasks, timeout_ms=timeout_ms, statement_timeout_ms=timeout_ms)
+    results.update(outcome.results)
+    timings.update(outcome.timings_ms)
+    
+    results['timings_ms'] = timings
+    results['partial'] = outcome.partial
+    results['incomplete_sections'] = outcome.timed_out + outcome.failed
     
     return jsonify(results), 200
 
+def _indexed_people(section, query):
+    if section == 'patients':
+        return [{
+            'id': document['id'],
+            'patient_code': document['patient_code'],
+            'full_name': document['full_name'],
+            'email': document['email'],
+            'phone': document['phone']
+        } for document in people_index.search('patient', q=query, limit=10)]
+    
+    return [{
+        'id': document['id'],
+        'full_name': document['full_name'],
+        'specialization': document['specialization'],
+        'license_number': document['license_number'],
+        'email': document['email']
+    } for document in people_index.search('doctor', q=query, limit=10)]
+
+def _global_patients(query):
+    backend = get_search_backend()
+    condition, rank = backend.match(
+        [User.full_name, User.email, User.phone, Patient.patient_code], query
+    )
+    patients = Patient.query.join(User).options(contains_eager(Patient.user)).filter(
+        condition
+    ).order_by(rank.desc()).limit(10).all()
+    
+    return [{
+        'id': patient.id,
+        'patient_code': patient.patient_code,
+        'full_name': patient.user.full_name,
+        'email': patient.user.email,
+        'phone': patient.user.phone
+    } for patient in patients]
+
+def _global_doctors(query):
+    backend = get_search_backend()
+    condition, rank = backend.match(
+        [User.full_name, User.email, Doctor.specialization, Doctor.license_number], query
+    )
+    doctors = Doctor.query.join(User).options(contains_eager(Doctor.user)).filter(
+        condition
+    ).order_by(rank.desc()).limit(10).all()
+    
+    return [{
+        'id': doctor.id,
+        'full_name': doctor.user.full_name,
+        'specialization': doctor.specialization,
+        'license_number': doctor.license_number,
+        'email': doctor.user.email
+    } for doctor in doctors]
+
+def _global_appointments(query):
+    backend = get_search_backend()
+    condition, rank = backend.match([Appointment.appointment_code], query)
+    appointments = Appointment.query.options(
+        joinedload(Appointment.patient).joinedload(Patient.user),
+        joinedload(Appointment.doctor).joinedload(Doctor.user)
+    ).filter(condition).order_by(rank.desc()).limit(10).all()
+    
+    return [{
+        'id': appointment.id,
+        'appointment_code': appointment.appointment_code,
+        'patient_name': appointment.patient.user.full_name if appointment.patient else 'N/A',
+        'doctor_name': appointment.doctor.user.full_name if appointment.doctor else 'N/A',
+        'appointment_date': appointment.appointment_date.strftime('%Y-%m-%d'),
+        'status': appointment.status
+    } for appointment in appointments]
+
+def _global_medical_records(query):
+    backend = get_search_backend()
+    code_condition, code_rank = backend.match([MedicalRecord.record_code], query)
+    diagnosis_condition, diagnosis_rank = backend.match_diagnosis(MedicalRecord.diagnosis, query)
+    records = MedicalRecord.query.options(
+        joinedload(MedicalRecord.patient).joinedload(Patient.user)
+    ).filter(
+        or_(code_condition, diagnosis_condition)
+    ).order_by(backend.combine_ranks(code_rank, diagnosis_rank).desc()).limit(10).all()
+    
+    return [{
+        'id': record.id,
+        'record_code': record.record_code,
+        'patient_name': record.patient.user.full_name if record.patient else 'N/A',
+        'diagnosis': record.diagnosis,
+        'visit_date': record.visit_date.strftime('%Y-%m-%d')
+    } for record in records]
+
 # =============================================
 # PATIENT SEARCH
 # =============================================
@@ -121,10 +168,9 @@ def global_search():
 @jwt_required()
 def search_patients():
     """Tìm kiếm bệnh nhân nâng cao"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role not in ['admin', 'doctor', 'staff']:
+    if role not in ['admin', 'doctor', 'staff']:
         return jsonify({"msg": "Permission denied"}), 403
     
     # Các filters
@@ -140,19 +186,50 @@ def search_patients():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     
-    query = Patient.query.join(User)
-    
-    if name:
-        query = query.filter(User.full_name.ilike(f'%{name}%'))
-    
-    if phone:
-        query = query.filter(User.phone.ilike(f'%{phone}%'))
+    # Index trong bộ nhớ đã dựng xong: trả lời không cần truy vấn DB
+    if people_index.ready:
+        today = datetime.now().date()
+        
+        def matches(document):
+            if blood_type and document['blood_type'] != blood_type:
+                return False
+            if gender and document['gender'] != gender:
+                return False
+            if age_from or age_to:
+                age = patient_age(document, today)
+                if age is None or (age_from and age < age_from) or (age_to and age > age_to):
+                    return False
+            return True
+        
+        documents = people_index.search('patient', name=name, phone=phone, email=email,
+                                        code=patient_code, filters=matches)
+        start = max(page - 1, 0) * per_page
+        return jsonify({
+            'patients': [{
+                'id': document['id'],
+                'patient_code': document['patient_code'],
+                'full_name': document['full_name'],
+                'email': document['email'],
+                'phone': document['phone'],
+                'gender': document['gender'],
+                'age': patient_age(document, today),
+                'blood_type': document['blood_type']
+            } for document in documents[start:start + per_page]],
+            'total': len(documents),
+            'pages': (len(documents) + per_page - 1) // per_page if per_page > 0 else 0,
+            'current_page': page
+        }), 200
     
-    if email:
-        query = query.filter(User.email.ilike(f'%{email}%'))
+    query = Patient.query.join(User)
+    backend = get_search_backend()
+    ranks = []
     
-    if patient_code:
-        query = query.filter(Patient.patient_code.ilike(f'%{patient_code}%'))
+    for column, value in ((User.full_name, name), (User.phone, phone),
+                          (User.email, email), (Patient.patient_code, patient_code)):
+        if value:
+            condition, rank = backend.match([column], value)
+            query = query.filter(condition)
+            ranks.append(rank)
     
     if blood_type:
         query = query.filter(Patient.blood_type == blood_type)
@@ -172,6 +249,9 @@ def search_patients():
             birth_year_min = today.year - age_to
             query = query.filter(func.extract('year', User.date_of_birth) >= birth_year_min)
     
+    if ranks:
+        query = query.order_by(backend.combine_ranks(*ranks).desc(), Patient.id)
+    
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
     
     results = []
@@ -207,10 +287,9 @@ def search_patients():
 @jwt_required()
 def search_appointments():
     """Tìm kiếm lịch hẹn nâng cao"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role not in ['admin', 'doctor', 'staff']:
+    if role not in ['admin', 'doctor', 'staff']:
         return jsonify({"msg": "Permission denied"}), 403
     
     # Filters
@@ -226,19 +305,29 @@ def search_appointments():
     per_page = request.args.get('per_page', 20, type=int)
     
     query = Appointment.query
+    backend = get_search_backend()
+    ranks = []
     
     if appointment_code:
-        query = query.filter(Appointment.appointment_code.ilike(f'%{appointment_code}%'))
+        condition, rank = backend.match([Appointment.appointment_code], appointment_code)
+        query = query.filter(condition)
+        ranks.append(rank)
     
     if patient_name:
-        query = query.join(Patient).join(User, Patient.user_id == User.id).filter(
-            User.full_name.ilike(f'%{patient_name}%')
-        )
+        patient_user = aliased(User)
+        condition, rank = backend.match([patient_user.full_name], patient_name)
+        query = query.join(Patient, Appointment.patient_id == Patient.id).join(
+            patient_user, Patient.user_id == patient_user.id
+        ).filter(condition)
+        ranks.append(rank)
     
     if doctor_name:
-        query = query.join(Doctor).join(User, Doctor.user_id == User.id).filter(
-            User.full_name.ilike(f'%{doctor_name}%')
-        )
+        doctor_user = aliased(User)
+        condition, rank = backend.match([doctor_user.full_name], doctor_name)
+        query = query.join(Doctor, Appointment.doctor_id == Doctor.id).join(
+            doctor_user, Doctor.user_id == doctor_user.id
+        ).filter(condition)
+        ranks.append(rank)
     
     if department_id:
         query = query.filter(Appointment.department_id == department_id)
@@ -262,6 +351,9 @@ def search_appointments():
         except ValueError:
             pass
     
+    if ranks:
+        query = query.order_by(backend.combine_ranks(*ranks).desc())
+    
     pagination = query.order_by(
         Appointment.appointment_date.desc(),
         Appointment.appointment_time.desc()
@@ -295,10 +387,9 @@ def search_appointments():
 @jwt_required()
 def search_medical_records():
     """Tìm kiếm hồ sơ bệnh án nâng cao"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role not in ['admin', 'doctor', 'staff']:
+    if role not in ['admin', 'doctor', 'staff']:
         return jsonify({"msg": "Permission denied"}), 403
     
     # Filters
@@ -313,22 +404,34 @@ def search_medical_records():
     per_page = request.args.get('per_page', 20, type=int)
     
     query = MedicalRecord.query
+    backend = get_search_backend()
+    ranks = []
     
     if record_code:
-        query = query.filter(MedicalRecord.record_code.ilike(f'%{record_code}%'))
+        condition, rank = backend.match([MedicalRecord.record_code], record_code)
+        query = query.filter(condition)
+        ranks.append(rank)
     
     if patient_name:
-        query = query.join(Patient).join(User, Patient.user_id == User.id).filter(
-            User.full_name.ilike(f'%{patient_name}%')
-        )
+        patient_user = aliased(User)
+        condition, rank = backend.match([patient_user.full_name], patient_name)
+        query = query.join(Patient, MedicalRecord.patient_id == Patient.id).join(
+            patient_user, Patient.user_id == patient_user.id
+        ).filter(condition)
+        ranks.append(rank)
     
     if doctor_name:
-        query = query.join(Doctor).join(User, Doctor.user_id == User.id).filter(
-            User.full_name.ilike(f'%{doctor_name}%')
-        )
+        doctor_user = aliased(User)
+        condition, rank = backend.match([doctor_user.full_name], doctor_name)
+        query = query.join(Doctor, MedicalRecord.doctor_id == Doctor.id).join(
+            doctor_user, Doctor.user_id == doctor_user.id
+        ).filter(condition)
+        ranks.append(rank)
     
     if diagnosis:
-        query = query.filter(MedicalRecord.diagnosis.ilike(f'%{diagnosis}%'))
+        condition, rank = backend.match_diagnosis(MedicalRecord.diagnosis, diagnosis)
+        query = query.filter(condition)
+        ranks.append(rank)
     
     if date_from:
         try:
@@ -346,6 +449,9 @@ def search_medical_records():
         except ValueError:
             pass
     
+    if ranks:
+        query = query.order_by(backend.combine_ranks(*ranks).desc())
+    
     pagination = query.order_by(
         MedicalRecord.visit_date.desc()
     ).paginate(page=page, per_page=per_page, error_out=False)
@@ -377,10 +483,9 @@ def search_medical_records():
 @jwt_required()
 def search_payments():
     """Tìm kiếm thanh toán nâng cao"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    role = get_current_role()
     
-    if user.role not in ['admin', 'staff']:
+    if role not in ['admin', 'staff']:
         return jsonify({"msg": "Permission denied"}), 403
     
     # Filters
@@ -397,14 +502,20 @@ def search_payments():
     per_page = request.args.get('per_page', 20, type=int)
     
     query = Payment.query
+    backend = get_search_backend()
+    ranks = []
     
     if payment_code:
-        query = query.filter(Payment.payment_code.ilike(f'%{payment_code}%'))
+        condition, rank = backend.match([Payment.payment_code], payment_code)
+        query = query.filter(condition)
+        ranks.append(rank)
     
     if patient_name:
-        query = query.join(Patient).join(User, Patient.user_id == User.id).filter(
-            User.full_name.ilike(f'%{patient_name}%')
-        )
+        condition, rank = backend.match([User.full_name], patient_name)
+        query = query.join(Patient, Payment.patient_id == Patient.id).join(
+            User, Patient.user_id == User.id
+        ).filter(condition)
+        ranks.append(rank)
     
     if payment_method:
         query = query.filter(Payment.payment_method == payment_method)
@@ -434,6 +545,9 @@ def search_payments():
         except ValueError:
             pass
     
+    if ranks:
+        query = query.order_by(backend.combine_ranks(*ranks).desc())
+    
     pagination = query.order_by(
         Payment.created_at.desc()
     ).paginate(page=page, per_page=per_page, error_out=False)
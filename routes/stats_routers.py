@@ -1,14 +1,49 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import (db, User, Appointment, Payment, Patient, Doctor, 
-                     Department, Review, MedicalRecord, Service)
+                     Department, MedicalRecord, Service, DailyAppointmentStat,
+                     DailyRevenueStat, DailyServiceRevenueStat, DailyPatientStat)
 from utils import admin_required
-from sqlalchemy import func, extract, and_, or_
+from sqlalchemy import func, extract, and_
 from datetime import datetime, timedelta, date
 from decimal import Decimal
+from dashboard_stats import load_dashboard_overview, DashboardUnavailableError
+from rollups import month_range, year_range
+from stats_cache import cached_stats
+from bucketing import range_buckets, width_buckets, bucket_bounds, bucket_counts
+from performance_stats import doctor_performance, department_statistics
 
 stats_bp = Blueprint('stats', __name__)
 
+HEATMAP_BUCKET_MINUTES = (15, 30, 60, 120)
+MAX_AMOUNT_BUCKETS = 50
+
+# =============================================
+# KỲ SỐ LIỆU CỦA TỪNG ENDPOINT (CHỌN TTL CHO CACHE)
+# =============================================
+
+def _today_period(args):
+    today = date.today()
+    return today, today + timedelta(days=1)
+
+def _day_period(args):
+    target_date = datetime.strptime(args.get('date', date.today().strftime('%Y-%m-%d')), '%Y-%m-%d').date()
+    return target_date, target_date + timedelta(days=1)
+
+def _month_period(args):
+    return month_range(args.get('year', datetime.now().year, type=int),
+                       args.get('month', datetime.now().month, type=int))
+
+def _year_period(args):
+    return year_range(args.get('year', datetime.now().year, type=int))
+
+def _date_range_period(args):
+    # Không có date_to: kỳ đang mở
+    if not args.get('date_to'):
+        return None
+    start = datetime.strptime(args['date_from'], '%Y-%m-%d').date() if args.get('date_from') else date.min
+    return start, datetime.strptime(args['date_to'], '%Y-%m-%d').date() + timedelta(days=1)
+
 # =============================================
 # DASHBOARD OVERVIEW
 # =============================================
@@ -16,89 +51,20 @@ stats_bp = Blueprint('stats', __name__)
 @stats_bp.route('/dashboard/overview', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('appointments', 'revenue', 'patients', 'doctors', 'reviews'), period=_today_period)
 def get_dashboard_overview():
     """Tổng quan dashboard - Thống kê tổng thể"""
-    
-    today = date.today()
-    this_month_start = today.replace(day=1)
-    last_month_start = (this_month_start - timedelta(days=1)).replace(day=1)
-    
-    # Tổng số bệnh nhân
-    total_patients = Patient.query.count()
-    
-    # Bệnh nhân mới trong tháng
-    new_patients_this_month = Patient.query.filter(
-        Patient.created_at >= this_month_start
-    ).count()
-    
-    # Tổng số bác sĩ
-    total_doctors = Doctor.query.filter_by(is_available=True).count()
-    
-    # Tổng số lịch hẹn
-    total_appointments = Appointment.query.count()
-    
-    # Lịch hẹn hôm nay
-    appointments_today = Appointment.query.filter_by(appointment_date=today).count()
-    
-    # Lịch hẹn pending
-    appointments_pending = Appointment.query.filter_by(status='pending').count()
-    
-    # Lịch hẹn confirmed hôm nay
-    appointments_today_confirmed = Appointment.query.filter(
-        Appointment.appointment_date == today,
-        Appointment.status.in_(['confirmed', 'checked_in'])
-    ).count()
-    
-    # Doanh thu tháng này
-    revenue_this_month = db.session.query(func.sum(Payment.amount)).filter(
-        Payment.payment_status == 'completed',
-        Payment.payment_date >= this_month_start
-    ).scalar() or Decimal(0)
-    
-    # Doanh thu tháng trước
-    revenue_last_month = db.session.query(func.sum(Payment.amount)).filter(
-        Payment.payment_status == 'completed',
-        Payment.payment_date >= last_month_start,
-        Payment.payment_date < this_month_start
-    ).scalar() or Decimal(0)
-    
-    # Tính phần trăm tăng/giảm
-    revenue_change = 0
-    if revenue_last_month > 0:
-        revenue_change = ((revenue_this_month - revenue_last_month) / revenue_last_month) * 100
-    
-    # Đánh giá trung bình
-    avg_rating = db.session.query(func.avg(Review.rating)).filter(
-        Review.is_approved == True
-    ).scalar() or 0
-    
-    # Số lượng đánh giá mới chưa duyệt
-    pending_reviews = Review.query.filter_by(is_approved=False).count()
-    
-    overview_data = {
-        'patients': {
-            'total': total_patients,
-            'new_this_month': new_patients_this_month
-        },
-        'doctors': {
-            'total': total_doctors
-        },
-        'appointments': {
-            'total': total_appointments,
-            'today': appointments_today,
-            'today_confirmed': appointments_today_confirmed,
-            'pending': appointments_pending
-        },
-        'revenue': {
-            'this_month': str(revenue_this_month),
-            'last_month': str(revenue_last_month),
-            'change_percent': round(float(revenue_change), 2)
-        },
-        'reviews': {
-            'average_rating': round(float(avg_rating), 2),
-            'pending_count': pending_reviews
-        }
-    }
+    try:
+        overview_data = load_dashboard_overview()
+    except DashboardUnavailableError as e:
+        print(f"[STATS] {e}")
+        return jsonify({
+            "msg": "Dashboard overview is temporarily unavailable, please try again",
+            "failed_sections": e.sections
+        }), 503
+    except Exception as e:
+        print(f"[STATS] Dashboard overview failed: {e}")
+        return jsonify({"msg": "Error loading dashboard overview"}), 500
     
     return jsonify(overview_data), 200
 
@@ -109,6 +75,7 @@ def get_dashboard_overview():
 @stats_bp.route('/appointments/daily', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('appointments',), period=_day_period)
 def get_daily_appointments():
     """Thống kê lịch hẹn theo ngày"""
     date_str = request.args.get('date', date.today().strftime('%Y-%m-%d'))
@@ -153,31 +120,26 @@ def get_daily_appointments():
 @stats_bp.route('/appointments/monthly', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('appointments',), period=_month_period)
 def get_monthly_appointments():
     """Thống kê lịch hẹn theo tháng"""
     year = request.args.get('year', datetime.now().year, type=int)
     month = request.args.get('month', datetime.now().month, type=int)
     
     # Lấy ngày đầu và cuối tháng
-    start_date = date(year, month, 1)
-    if month == 12:
-        end_date = date(year + 1, 1, 1)
-    else:
-        end_date = date(year, month + 1, 1)
+    start_date, end_date = month_range(year, month)
+    in_month = and_(DailyAppointmentStat.stat_date >= start_date, DailyAppointmentStat.stat_date < end_date)
     
     # Thống kê theo ngày trong tháng
     daily_stats = db.session.query(
-        Appointment.appointment_date,
-        func.count(Appointment.id).label('count')
-    ).filter(
-        Appointment.appointment_date >= start_date,
-        Appointment.appointment_date < end_date
-    ).group_by(Appointment.appointment_date).order_by(Appointment.appointment_date).all()
+        DailyAppointmentStat.stat_date,
+        func.sum(DailyAppointmentStat.appointment_count).label('count')
+    ).filter(in_month).group_by(DailyAppointmentStat.stat_date).order_by(DailyAppointmentStat.stat_date).all()
     
     daily_data = [
         {
             'date': appt_date.strftime('%Y-%m-%d'),
-            'count': count
+            'count': int(count)
         } for appt_date, count in daily_stats
     ]
     
@@ -186,14 +148,11 @@ def get_monthly_appointments():
     
     # Thống kê theo status
     status_stats = db.session.query(
-        Appointment.status,
-        func.count(Appointment.id).label('count')
-    ).filter(
-        Appointment.appointment_date >= start_date,
-        Appointment.appointment_date < end_date
-    ).group_by(Appointment.status).all()
+        DailyAppointmentStat.status,
+        func.sum(DailyAppointmentStat.appointment_count).label('count')
+    ).filter(in_month).group_by(DailyAppointmentStat.status).all()
     
-    status_data = {status: count for status, count in status_stats}
+    status_data = {status: int(count) for status, count in status_stats}
     
     return jsonify({
         'year': year,
@@ -203,9 +162,60 @@ def get_monthly_appointments():
         'by_status': status_data
     }), 200
 
+@stats_bp.route('/appointments/heatmap', methods=['GET'])
+@jwt_required()
+@admin_required
+@cached_stats(('appointments',), period=_date_range_period)
+def get_appointment_heatmap():
+    """Số lịch hẹn theo thứ trong tuần x khung giờ (mặc định 90 ngày gần nhất)"""
+    bucket_minutes = request.args.get('bucket_minutes', 60, type=int)
+    doctor_id = request.args.get('doctor_id', type=int)
+    department_id = request.args.get('department_id', type=int)
+    status = request.args.get('status')
+    
+    if bucket_minutes not in HEATMAP_BUCKET_MINUTES:
+        return jsonify({"msg": f"bucket_minutes must be one of {', '.join(map(str, HEATMAP_BUCKET_MINUTES))}"}), 400
+    
+    try:
+        date_to = datetime.strptime(request.args['date_to'], '%Y-%m-%d').date() if request.args.get('date_to') else date.today()
+        date_from = datetime.strptime(request.args['date_from'], '%Y-%m-%d').date() if request.args.get('date_from') else date_to - timedelta(days=89)
+    except ValueError:
+        return jsonify({"msg": "Invalid date format"}), 400
+    
+    # Thứ theo quy ước của hệ thống: 0 = Chủ nhật (giống DOW của Postgres)
+    weekday = extract('dow', Appointment.appointment_date).label('weekday')
+    minutes = extract('hour', Appointment.appointment_time) * 60 + extract('minute', Appointment.appointment_time)
+    slot_count = 24 * 60 // bucket_minutes
+    
+    query = bucket_counts(width_buckets(minutes, 0, 24 * 60, slot_count), group_by=(weekday,)).where(
+        Appointment.appointment_date >= date_from,
+        Appointment.appointment_date <= date_to
+    )
+    if doctor_id:
+        query = query.where(Appointment.doctor_id == doctor_id)
+    if department_id:
+        query = query.where(Appointment.department_id == department_id)
+    if status:
+        query = query.where(Appointment.status == status)
+    
+    matrix = [[0] * slot_count for _ in range(7)]
+    for day, bucket, count in db.session.execute(query).all():
+        matrix[int(day)][int(bucket) - 1] = count
+    
+    return jsonify({
+        'date_from': date_from.strftime('%Y-%m-%d'),
+        'date_to': date_to.strftime('%Y-%m-%d'),
+        'bucket_minutes': bucket_minutes,
+        'slots': [f'{m // 60:02d}:{m % 60:02d}' for m in range(0, 24 * 60, bucket_minutes)],
+        'weekdays': ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday'],
+        'matrix': matrix,
+        'total': sum(map(sum, matrix))
+    }), 200
+
 @stats_bp.route('/appointments/by-doctor', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('appointments', 'doctors'), period=_date_range_period)
 def get_appointments_by_doctor():
     """Thống kê lịch hẹn theo bác sĩ"""
     date_from = request.args.get('date_from')
@@ -215,8 +225,8 @@ def get_appointments_by_doctor():
         User.full_name,
         Doctor.id,
         func.count(Appointment.id).label('total_appointments'),
-        func.sum(func.case((Appointment.status == 'completed', 1), else_=0)).label('completed'),
-        func.sum(func.case((Appointment.status == 'cancelled', 1), else_=0)).label('cancelled')
+        func.count(Appointment.id).filter(Appointment.status == 'completed').label('completed'),
+        func.count(Appointment.id).filter(Appointment.status == 'cancelled').label('cancelled')
     ).join(Doctor, User.id == Doctor.user_id).join(
         Appointment, Doctor.id == Appointment.doctor_id
     )
@@ -255,65 +265,62 @@ def get_appointments_by_doctor():
 @stats_bp.route('/revenue/overview', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('revenue',), period=_today_period)
 def get_revenue_overview():
     """Tổng quan doanh thu"""
     today = date.today()
     this_month_start = today.replace(day=1)
     this_year_start = today.replace(month=1, day=1)
     
-    # Doanh thu hôm nay
-    revenue_today = db.session.query(func.sum(Payment.amount)).filter(
-        Payment.payment_status == 'completed',
-        func.date(Payment.payment_date) == today
-    ).scalar() or Decimal(0)
-    
-    # Doanh thu tháng này
-    revenue_this_month = db.session.query(func.sum(Payment.amount)).filter(
-        Payment.payment_status == 'completed',
-        Payment.payment_date >= this_month_start
-    ).scalar() or Decimal(0)
-    
-    # Doanh thu năm nay
-    revenue_this_year = db.session.query(func.sum(Payment.amount)).filter(
-        Payment.payment_status == 'completed',
-        Payment.payment_date >= this_year_start
-    ).scalar() or Decimal(0)
-    
-    # Tổng doanh thu
-    revenue_total = db.session.query(func.sum(Payment.amount)).filter(
-        Payment.payment_status == 'completed'
-    ).scalar() or Decimal(0)
-    
-    # Số lượng giao dịch
-    payment_count = Payment.query.filter_by(payment_status='completed').count()
+    revenue = DailyRevenueStat.revenue
+    stat_date = DailyRevenueStat.stat_date
+    
+    # Doanh thu hôm nay / tháng này / năm nay / tổng và số giao dịch trong một lần đọc rollup
+    revenue_today, revenue_this_month, revenue_this_year, revenue_total, payment_count = db.session.query(
+        func.sum(revenue).filter(stat_date == today),
+        func.sum(revenue).filter(stat_date >= this_month_start),
+        func.sum(revenue).filter(stat_date >= this_year_start),
+        func.sum(revenue),
+        func.sum(DailyRevenueStat.transaction_count)
+    ).one()
+    
+    # Rollup theo ngày bỏ qua payment completed không có payment_date (dữ liệu cũ / nhập tay),
+    # nhưng tổng doanh thu và số giao dịch vẫn tính chúng (idx_payments_status_date)
+    undated_revenue, undated_count = db.session.query(
+        func.sum(Payment.amount), func.count(Payment.id)
+    ).filter(Payment.payment_status == 'completed', Payment.payment_date.is_(None)).one()
+    revenue_total = (revenue_total or Decimal(0)) + (undated_revenue or Decimal(0))
+    payment_count = (payment_count or 0) + undated_count
     
     return jsonify({
-        'today': str(revenue_today),
-        'this_month': str(revenue_this_month),
-        'this_year': str(revenue_this_year),
-        'total': str(revenue_total),
-        'transaction_count': payment_count
+        'today': str(revenue_today or Decimal(0)),
+        'this_month': str(revenue_this_month or Decimal(0)),
+        'this_year': str(revenue_this_year or Decimal(0)),
+        'total': str(revenue_total or Decimal(0)),
+        'transaction_count': int(payment_count or 0)
     }), 200
 
 @stats_bp.route('/revenue/monthly', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('revenue',), period=_year_period)
 def get_monthly_revenue():
     """Doanh thu theo tháng trong năm"""
     year = request.args.get('year', datetime.now().year, type=int)
+    start_date, end_date = year_range(year)
     
     monthly_revenue = db.session.query(
-        extract('month', Payment.payment_date).label('month'),
-        func.sum(Payment.amount).label('revenue'),
-        func.count(Payment.id).label('count')
+        extract('month', DailyRevenueStat.stat_date).label('month'),
+        func.sum(DailyRevenueStat.revenue).label('revenue'),
+        func.sum(DailyRevenueStat.transaction_count).label('count')
     ).filter(
-        Payment.payment_status == 'completed',
-        extract('year', Payment.payment_date) == year
-    ).group_by(extract('month', Payment.payment_date)).order_by('month').all()
+        DailyRevenueStat.stat_date >= start_date,
+        DailyRevenueStat.stat_date < end_date
+    ).group_by(extract('month', DailyRevenueStat.stat_date)).order_by('month').all()
     
     # Tạo dữ liệu cho tất cả 12 tháng
     monthly_data = []
-    revenue_by_month = {int(month): (float(revenue), count) for month, revenue, count in monthly_revenue}
+    revenue_by_month = {int(month): (float(revenue), int(count)) for month, revenue, count in monthly_revenue}
     
     for month in range(1, 13):
         revenue, count = revenue_by_month.get(month, (0.0, 0))
@@ -335,6 +342,7 @@ def get_monthly_revenue():
 @stats_bp.route('/revenue/by-service', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('revenue',), period=_date_range_period)
 def get_revenue_by_service():
     """Doanh thu theo dịch vụ"""
     date_from = request.args.get('date_from')
@@ -342,32 +350,30 @@ def get_revenue_by_service():
     
     query = db.session.query(
         Service.name,
-        func.sum(PaymentItem.total_price).label('revenue'),
-        func.sum(PaymentItem.quantity).label('quantity')
-    ).join(PaymentItem, Service.id == PaymentItem.service_id).join(
-        Payment, PaymentItem.payment_id == Payment.id
-    ).filter(Payment.payment_status == 'completed')
+        func.sum(DailyServiceRevenueStat.revenue).label('revenue'),
+        func.sum(DailyServiceRevenueStat.quantity).label('quantity')
+    ).join(DailyServiceRevenueStat, Service.id == DailyServiceRevenueStat.service_id)
     
     if date_from:
         try:
-            query = query.filter(Payment.payment_date >= datetime.strptime(date_from, '%Y-%m-%d'))
+            query = query.filter(DailyServiceRevenueStat.stat_date >= datetime.strptime(date_from, '%Y-%m-%d').date())
         except ValueError:
             pass
     
     if date_to:
         try:
-            query = query.filter(Payment.payment_date <= datetime.strptime(date_to, '%Y-%m-%d'))
+            query = query.filter(DailyServiceRevenueStat.stat_date <= datetime.strptime(date_to, '%Y-%m-%d').date())
         except ValueError:
             pass
     
-    results = query.group_by(Service.name).order_by(func.sum(PaymentItem.total_price).desc()).all()
+    results = query.group_by(Service.name).order_by(func.sum(DailyServiceRevenueStat.revenue).desc()).all()
     
     service_revenue = []
     for service_name, revenue, quantity in results:
         service_revenue.append({
             'service_name': service_name,
             'revenue': str(revenue),
-            'quantity': quantity
+            'quantity': int(quantity or 0)
         })
     
     total_revenue = sum(float(item['revenue']) for item in service_revenue)
@@ -377,6 +383,64 @@ def get_revenue_by_service():
         'services': service_revenue
     }), 200
 
+@stats_bp.route('/revenue/amount-distribution', methods=['GET'])
+@jwt_required()
+@admin_required
+@cached_stats(('revenue',), period=_date_range_period)
+def get_payment_amount_distribution():
+    """Phân bố số tiền thanh toán theo khoảng bằng nhau"""
+    bucket_count = request.args.get('buckets', 10, type=int)
+    status = request.args.get('status', 'completed')
+    low = request.args.get('min', type=float)
+    high = request.args.get('max', type=float)
+    
+    if not 1 <= bucket_count <= MAX_AMOUNT_BUCKETS:
+        return jsonify({"msg": f"buckets must be between 1 and {MAX_AMOUNT_BUCKETS}"}), 400
+    
+    filters = [Payment.payment_status == status]
+    try:
+        if request.args.get('date_from'):
+            filters.append(Payment.payment_date >= datetime.strptime(request.args['date_from'], '%Y-%m-%d'))
+        if request.args.get('date_to'):
+            filters.append(Payment.payment_date < datetime.strptime(request.args['date_to'], '%Y-%m-%d') + timedelta(days=1))
+    except ValueError:
+        return jsonify({"msg": "Invalid date format"}), 400
+    
+    # Không truyền min/max: lấy theo dữ liệu, cận trên cộng thêm 0.01 để số lớn nhất rơi vào bucket cuối
+    if low is None or high is None:
+        data_low, data_high = db.session.query(func.min(Payment.amount), func.max(Payment.amount)).filter(*filters).one()
+        if data_low is None:
+            return jsonify({'status': status, 'buckets': [], 'below_min': 0, 'above_max': 0, 'total_count': 0}), 200
+        low = float(data_low) if low is None else low
+        high = float(data_high) + 0.01 if high is None else high
+    
+    if high <= low:
+        return jsonify({"msg": "max must be greater than min"}), 400
+    
+    rows = db.session.execute(
+        bucket_counts(width_buckets(Payment.amount, low, high, bucket_count),
+                      func.sum(Payment.amount).label('total')).where(*filters)
+    ).all()
+    by_bucket = {int(bucket): (count, total) for bucket, count, total in rows}
+    
+    buckets = []
+    for index, (lower, upper) in enumerate(bucket_bounds(low, high, bucket_count), start=1):
+        count, total = by_bucket.get(index, (0, Decimal(0)))
+        buckets.append({
+            'min': str(lower.quantize(Decimal('0.01'))),
+            'max': str(upper.quantize(Decimal('0.01'))),
+            'count': count,
+            'total_amount': str(total)
+        })
+    
+    return jsonify({
+        'status': status,
+        'buckets': buckets,
+        'below_min': by_bucket.get(0, (0, None))[0],
+        'above_max': by_bucket.get(bucket_count + 1, (0, None))[0],
+        'total_count': sum(count for count, _ in by_bucket.values())
+    }), 200
+
 # =============================================
 # PATIENT STATISTICS
 # =============================================
@@ -384,6 +448,7 @@ def get_revenue_by_service():
 @stats_bp.route('/patients/overview', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('patients',))
 def get_patient_overview():
     """Tổng quan bệnh nhân"""
     
@@ -412,29 +477,22 @@ def get_patient_overview():
     
     gender_data = {gender: count for gender, count in gender_stats if gender}
     
-    # Thống kê theo nhóm tuổi
-    age_groups = {
-        '0-5': 0,
-        '6-12': 0,
-        '13-18': 0,
-        '18+': 0
-    }
+    # Thống kê theo nhóm tuổi (tuổi = số ngày // 365), đếm trong SQL theo ngưỡng ngày sinh
+    age_labels = ['0-5', '6-12', '13-18', '18+']
+    age_group = range_buckets(
+        User.date_of_birth,
+        [today - timedelta(days=365 * years) for years in (6, 13, 19)],
+        age_labels,
+        descending=True
+    )
+    age_stats = db.session.execute(
+        bucket_counts(age_group).select_from(Patient).join(User, Patient.user_id == User.id).where(
+            User.date_of_birth.isnot(None)
+        )
+    ).all()
     
-    patients_with_dob = db.session.query(User.date_of_birth).join(
-        Patient, User.id == Patient.user_id
-    ).filter(User.date_of_birth.isnot(None)).all()
-    
-    for (dob,) in patients_with_dob:
-        if dob:
-            age = (today - dob).days // 365
-            if age <= 5:
-                age_groups['0-5'] += 1
-            elif age <= 12:
-                age_groups['6-12'] += 1
-            elif age <= 18:
-                age_groups['13-18'] += 1
-            else:
-                age_groups['18+'] += 1
+    age_groups = dict.fromkeys(age_labels, 0)
+    age_groups.update({label: count for label, count in age_stats})
     
     return jsonify({
         'total': total_patients,
@@ -447,18 +505,21 @@ def get_patient_overview():
 @stats_bp.route('/patients/growth', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('patients',), period=_year_period)
 def get_patient_growth():
     """Tăng trưởng bệnh nhân theo tháng"""
     year = request.args.get('year', datetime.now().year, type=int)
+    start_date, end_date = year_range(year)
     
     monthly_growth = db.session.query(
-        extract('month', Patient.created_at).label('month'),
-        func.count(Patient.id).label('count')
+        extract('month', DailyPatientStat.stat_date).label('month'),
+        func.sum(DailyPatientStat.new_patients).label('count')
     ).filter(
-        extract('year', Patient.created_at) == year
-    ).group_by(extract('month', Patient.created_at)).order_by('month').all()
+        DailyPatientStat.stat_date >= start_date,
+        DailyPatientStat.stat_date < end_date
+    ).group_by(extract('month', DailyPatientStat.stat_date)).order_by('month').all()
     
-    growth_by_month = {int(month): count for month, count in monthly_growth}
+    growth_by_month = {int(month): int(count) for month, count in monthly_growth}
     
     monthly_data = []
     cumulative = 0
@@ -486,67 +547,23 @@ def get_patient_growth():
 @stats_bp.route('/doctors/performance', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('appointments', 'doctors', 'reviews'))
 def get_doctor_performance():
     """Hiệu suất làm việc của bác sĩ"""
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
-    query = db.session.query(
-        User.full_name,
-        Doctor.id,
-        Department.name.label('department_name'),
-        func.count(Appointment.id).label('total_appointments'),
-        func.sum(func.case((Appointment.status == 'completed', 1), else_=0)).label('completed'),
-        func.avg(Review.rating).label('avg_rating'),
-        func.count(Review.id).label('review_count')
-    ).join(Doctor, User.id == Doctor.user_id).join(
-        Department, Doctor.department_id == Department.id
-    ).outerjoin(
-        Appointment, Doctor.id == Appointment.doctor_id
-    ).outerjoin(
-        Review, Doctor.id == Review.doctor_id
-    )
-    
-    if date_from:
-        try:
-            query = query.filter(
-                or_(
-                    Appointment.appointment_date >= datetime.strptime(date_from, '%Y-%m-%d').date(),
-                    Appointment.appointment_date.is_(None)
-                )
-            )
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            query = query.filter(
-                or_(
-                    Appointment.appointment_date <= datetime.strptime(date_to, '%Y-%m-%d').date(),
-                    Appointment.appointment_date.is_(None)
-                )
-            )
-        except ValueError:
-            pass
-    
-    results = query.group_by(
-        User.full_name, Doctor.id, Department.name
-    ).order_by(func.count(Appointment.id).desc()).all()
+    try:
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+    except ValueError:
+        date_from = None
     
-    performance_data = []
-    for full_name, doctor_id, dept_name, total_apps, completed, avg_rating, review_count in results:
-        performance_data.append({
-            'doctor_name': full_name,
-            'doctor_id': doctor_id,
-            'department': dept_name,
-            'total_appointments': total_apps or 0,
-            'completed_appointments': completed or 0,
-            'completion_rate': round((completed / total_apps * 100) if total_apps and total_apps > 0 else 0, 2),
-            'average_rating': round(float(avg_rating) if avg_rating else 0, 2),
-            'review_count': review_count or 0
-        })
+    try:
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    except ValueError:
+        date_to = None
     
-    return jsonify(performance_data), 200
+    return jsonify(doctor_performance(date_from, date_to)), 200
 
 # =============================================
 # DEPARTMENT STATISTICS
@@ -555,34 +572,7 @@ def get_doctor_performance():
 @stats_bp.route('/departments/statistics', methods=['GET'])
 @jwt_required()
 @admin_required
+@cached_stats(('appointments', 'doctors'))
 def get_department_statistics():
     """Thống kê theo chuyên khoa"""
-    
-    dept_stats = db.session.query(
-        Department.name,
-        Department.id,
-        func.count(func.distinct(Doctor.id)).label('doctor_count'),
-        func.count(Appointment.id).label('appointment_count'),
-        func.sum(func.case((Appointment.status == 'completed', 1), else_=0)).label('completed_count')
-    ).outerjoin(
-        Doctor, Department.id == Doctor.department_id
-    ).outerjoin(
-        Appointment, Department.id == Appointment.department_id
-    ).group_by(Department.name, Department.id).order_by(
-        func.count(Appointment.id).desc()
-    ).all()
-    
-    results = []
-    for dept_name, dept_id, doctor_count, appt_count, completed in dept_stats:
-        results.append({
-            'department_name': dept_name,
-            'department_id': dept_id,
-            'doctor_count': doctor_count or 0,
-            'appointment_count': appt_count or 0,
-            'completed_appointments': completed or 0
-        })
-    
-    return jsonify(results), 200
-
-# Import PaymentItem
-from models import PaymentItem
\ No newline at end of file
+    return jsonify(department_statistics()), 200
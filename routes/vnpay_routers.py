@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify, redirect
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Payment, PaymentItem, Appointment, Service
+from models import db, Payment, PaymentItem, Service
 from utils import log_activity, get_patient_id_from_user
+from routes.payment_routers import extend_appointment_hold
+from slots import settle_paid_appointment
 from datetime import datetime
 import hashlib
 import hmac
@@ -94,6 +96,7 @@ def create_vnpay_payment():
     # Cập nhật payment status
     payment.payment_status = 'processing'
     payment.transaction_id = request_id
+    extend_appointment_hold(payment.appointment_id)
     
     try:
         db.session.commit()
@@ -139,18 +142,13 @@ def vnpay_payment_callback():
     
     # Cập nhật payment status
     if response_code == '00':  # Giao dịch thành công
-        payment.payment_status = 'completed'
-        payment.payment_date = datetime.utcnow()
-        payment.transaction_id = transaction_no
-        
-        # Cập nhật appointment status thành confirmed
-        if payment.appointment_id:
-            appointment = Appointment.query.get(payment.appointment_id)
-            if appointment and appointment.status == 'pending':
-                appointment.status = 'confirmed'
-        
+        # Xác nhận appointment; lịch đã bị hủy do hết hạn giữ chỗ thì giữ lại chỗ hoặc chờ hoàn tiền
+        completed, _ = settle_paid_appointment(payment, transaction_no)
         db.session.commit()
         
+        if not completed:
+            return redirect(f'http://localhost:3000/payment/failed?msg=Appointment cancelled, payment will be refunded&payment_code={txn_ref}')
+        
         return redirect(f'http://localhost:3000/payment/success?payment_code={txn_ref}&trans_id={transaction_no}')
     else:
         payment.payment_status = 'failed'
@@ -194,7 +192,7 @@ def vnpay_payment_ipn():
         }), 200
     
     # Kiểm tra trạng thái payment
-    if payment.payment_status == 'completed':
+    if payment.payment_status in ('completed', 'refund_pending'):
         return jsonify({
             'RspCode': '02',
             'Message': 'Order already confirmed'
@@ -202,16 +200,8 @@ def vnpay_payment_ipn():
     
     # Cập nhật payment status
     if response_code == '00':
-        payment.payment_status = 'completed'
-        payment.payment_date = datetime.utcnow()
-        payment.transaction_id = transaction_no
-        
-        # Cập nhật appointment status
-        if payment.appointment_id:
-            appointment = Appointment.query.get(payment.appointment_id)
-            if appointment and appointment.status == 'pending':
-                appointment.status = 'confirmed'
-        
+        # Lịch hẹn đã bị hủy trước khi nhận tiền: payment chuyển refund_pending (vẫn trả 00 cho VNPay)
+        settle_paid_appointment(payment, transaction_no)
         db.session.commit()
         
         return jsonify({
@@ -295,6 +285,3 @@ def query_vnpay_transaction():
         
     except Exception as e:
         return jsonify({"msg": f"Error querying VNPay: {str(e)}"}), 500
-
-# Import models
-from models import Appointment
\ No newline at end of file
@@ -16,7 +16,20 @@ from routes.password_reset_routers import password_reset_bp
 from routes.notification_routers import notification_bp 
 from routes.search_routers import search_bp     
 from routes.stats_routers import stats_bp      
-from utils import log_activity, generate_code, get_system_setting
+from utils import log_activity, generate_code, get_system_setting, init_user_status_cache
+from slots import expire_holds, start_hold_sweeper
+from idempotency import purge_expired_keys
+from availability_cache import init_availability_cache
+from stats_cache import init_stats_cache
+from settings_registry import init_settings_registry, bump_settings_version
+from audit import init_audit_writer
+from hashing import init_password_hasher, HashingBusyError
+from codes import init_code_generator
+from query_plans import check_query_plans
+from search_backend import init_search_backend
+from dashboard_stats import benchmark_dashboard
+from rollups import start_rollup_refresher, refresh_rollups, rebuild_rollups
+from people_index import init_people_index
 import click
 
 def create_app(config_class=Config):
@@ -28,6 +41,15 @@ def create_app(config_class=Config):
     bcrypt.init_app(app)
     jwt = JWTManager(app)
     migrate = Migrate(app, db)  
+    init_availability_cache(app)
+    init_user_status_cache(app)
+    init_stats_cache(app)
+    init_settings_registry(app)
+    init_audit_writer(app)
+    init_password_hasher(app)
+    init_code_generator(app)
+    init_search_backend(app)
+    init_people_index(app)
 
     # JWT Error Handlers (Giữ nguyên)
     @jwt.unauthorized_loader
@@ -50,6 +72,11 @@ def create_app(config_class=Config):
         print("[JWT] Token revoked")
         return jsonify({"msg": "Token has been revoked"}), 401
 
+    @app.errorhandler(HashingBusyError)
+    def _hashing_busy(error):
+        print(f"[AUTH] {error}")
+        return jsonify({"msg": "Server is busy, please try again in a moment"}), 503
+
     # --- ĐĂNG KÝ TẤT CẢ CÁC BLUEPRINTS (Đã xóa /v1) ---
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(public_bp, url_prefix='/api/public')
@@ -67,6 +94,18 @@ def create_app(config_class=Config):
     app.register_blueprint(notification_bp, url_prefix='/api/notifications')
     app.register_blueprint(search_bp, url_prefix='/api/search')
     app.register_blueprint(stats_bp, url_prefix='/api/stats')
+
+    # Tiến trình nền hủy lịch hẹn hết hạn giữ chỗ (khởi động ở request đầu tiên, không chạy với CLI)
+    if app.config.get('HOLD_SWEEPER_ENABLED'):
+        @app.before_request
+        def _ensure_hold_sweeper():
+            start_hold_sweeper(app)
+
+    # Tiến trình nền tính lại các ngày thống kê đã thay đổi
+    if app.config.get('ROLLUP_REFRESH_ENABLED'):
+        @app.before_request
+        def _ensure_rollup_refresher():
+            start_rollup_refresher(app)
     
     @app.cli.command("init-db")
     def init_db():
@@ -81,7 +120,9 @@ def create_app(config_class=Config):
                         SystemSetting(key='hospital_name', value='Bệnh viện Nhi Đồng II TP.HCM', description='Tên bệnh viện'),
                         SystemSetting(key='appointment_buffer_minutes', value='15', description='Khoảng cách giữa các lịch hẹn (phút)', data_type='integer'),
                         SystemSetting(key='cancellation_allowed_hours', value='24', description='Cho phép hủy lịch trước bao nhiêu giờ', data_type='integer'),
+                        SystemSetting(key='appointment_hold_minutes', value='15', description='Thời gian giữ chỗ chờ thanh toán (phút)', data_type='integer'),
                     ])
+                    bump_settings_version()
                     db.session.commit()
                     click.echo("Default system settings inserted.")
                 
@@ -89,10 +130,71 @@ def create_app(config_class=Config):
             except Exception as e:
                 click.echo(f"Error creating database tables: {e}")
 
+    @app.cli.command("expire-holds")
+    def expire_holds_command():
+        """Hủy các lịch hẹn pending đã hết hạn giữ chỗ (dùng cho cron)"""
+        with app.app_context():
+            try:
+                expired_count = expire_holds()
+                db.session.commit()
+                click.echo(f"Released {expired_count} expired holds.")
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f"Error expiring holds: {e}")
+
+    @app.cli.command("purge-idempotency-keys")
+    def purge_idempotency_keys_command():
+        """Xóa các Idempotency-Key đã hết hạn (dùng cho cron)"""
+        with app.app_context():
+            try:
+                purged_count = purge_expired_keys()
+                db.session.commit()
+                click.echo(f"Purged {purged_count} expired idempotency keys.")
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f"Error purging idempotency keys: {e}")
+
+    @app.cli.command("refresh-rollups")
+    @click.option("--rebuild", is_flag=True, help="Tính lại toàn bộ thay vì chỉ các ngày đã thay đổi")
+    def refresh_rollups_command(rebuild):
+        """Cập nhật các bảng thống kê theo ngày (dùng cho cron hoặc backfill)"""
+        with app.app_context():
+            try:
+                refreshed = rebuild_rollups() if rebuild else refresh_rollups()
+                click.echo(f"Refreshed {refreshed} rollup days.")
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f"Error refreshing rollups: {e}")
+
+    @app.cli.command("benchmark-dashboard")
+    @click.option("--runs", default=20, show_default=True, help="Số lần chạy mỗi cách tính")
+    def benchmark_dashboard_command(runs):
+        """So sánh số câu SQL và độ trễ của dashboard overview (cách cũ / mới)"""
+        with app.app_context():
+            for name, result in benchmark_dashboard(runs).items():
+                click.echo(f"{name:34} queries={result['queries']:<3} p50={result['p50_ms']:>8.2f}ms "
+                           f"max={result['max_ms']:>8.2f}ms same_result={result['same_result']}")
+
+    @app.cli.command("check-query-plans")
+    def check_query_plans_command():
+        """Kiểm tra các truy vấn chính vẫn dùng đúng index (thoát với mã 1 nếu sai)"""
+        with app.app_context():
+            failures = 0
+            for name, ok, used, expected in check_query_plans():
+                failures += not ok
+                status = "OK  " if ok else "FAIL"
+                click.echo(f"[{status}] {name}: uses {', '.join(used) or 'no index'}"
+                           + ("" if ok else f" (expected one of: {', '.join(expected)})"))
+            if failures:
+                raise SystemExit(1)
+
     return app
 
 
-app = create_app()
+# Process con của multiprocessing kiểu spawn (pool băm mật khẩu) import lại file này
+# dưới tên __mp_main__: không tạo app trong các process đó
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     print("\n" + "="*60)
@@ -0,0 +1,145 @@
+import unicodedata
+from flask import current_app
+from sqlalchemy import event, func, or_, case, literal_column, text
+from models import db
+
+# =============================================
+# BACKEND TÌM KIẾM (PG_TRGM + TSVECTOR, FALLBACK LIKE)
+# =============================================
+# - trigram: Postgres có pg_trgm + unaccent (migration f2b8d6a4c19e). So khớp trên
+#   f_unaccent(cột) (bỏ dấu + chữ thường) bằng LIKE '%q%' hoặc toán tử % (gần đúng, chịu lỗi gõ),
+#   cả hai đều dùng GIN index; xếp hạng theo similarity().
+#   Chẩn đoán (MedicalRecord.diagnosis) dùng cột diagnosis_tsv + ts_rank.
+# - like: Postgres chưa cài extension hoặc SQLite (test). SQLite được đăng ký hàm
+#   f_unaccent bằng Python nên vẫn tìm được không dấu; xếp hạng: khớp đầu chuỗi trước.
+
+def fold_text(value):
+    """Chuẩn hóa tiếng Việt để so khớp: chữ thường, bỏ dấu, đ -> d"""
+    if value is None:
+        return None
+    value = unicodedata.normalize('NFD', str(value).lower().replace('đ', 'd'))
+    return ''.join(char for char in value if unicodedata.category(char) != 'Mn')
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+class LikeSearchBackend:
+    """So khớp chuỗi con trên văn bản đã bỏ dấu (không cần extension)"""
+
+    name = 'like'
+
+    def __init__(self, fold_in_sql=False):
+        # SQLite: f_unaccent là hàm Python đăng ký trên connection
+        self.fold_in_sql = fold_in_sql
+
+    def _target(self, column):
+        return func.f_unaccent(column) if self.fold_in_sql else func.lower(column)
+
+    def _term(self, query):
+        return fold_text(query) if self.fold_in_sql else query.lower()
+
+    def match(self, columns, query):
+        """Trả về (điều kiện lọc, biểu thức xếp hạng) cho query trên một hoặc nhiều cột"""
+        term = _escape_like(self._term(query))
+        conditions, ranks = [], []
+        for column in columns:
+            target = self._target(column)
+            conditions.append(target.like(f'%{term}%', escape='\\'))
+            ranks.append(case((target.like(f'{term}%', escape='\\'), 2),
+                              (target.like(f'%{term}%', escape='\\'), 1), else_=0))
+        return or_(*conditions), self.combine_ranks(*ranks)
+
+    def match_diagnosis(self, diagnosis_column, query):
+        return self.match([diagnosis_column], query)
+
+    def combine_ranks(self, *ranks):
+        """Hạng lớn nhất trong các biểu thức xếp hạng"""
+        rank = ranks[0]
+        for other in ranks[1:]:
+            rank = case((rank >= other, rank), else_=other)
+        return rank
+
+class TrigramSearchBackend:
+    """pg_trgm + unaccent trên Postgres"""
+
+    name = 'trigram'
+
+    def match(self, columns, query):
+        term = fold_text(query)
+        pattern = f'%{_escape_like(term)}%'
+        conditions, ranks = [], []
+        for column in columns:
+            target = func.f_unaccent(column)
+            conditions.append(target.like(pattern, escape='\\'))
+            conditions.append(target.op('%')(term))
+            ranks.append(func.similarity(target, term))
+        return or_(*conditions), self.combine_ranks(*ranks)
+
+    def match_diagnosis(self, diagnosis_column, query):
+        """Tìm toàn văn trên cột diagnosis_tsv (tsvector sinh tự động)"""
+        tsquery = func.plainto_tsquery(literal_column("'simple'::regconfig"), fold_text(query))
+        document = literal_column('medical_records.diagnosis_tsv')
+        trigram_condition, trigram_rank = self.match([diagnosis_column], query)
+        return (or_(document.op('@@')(tsquery), trigram_condition),
+                self.combine_ranks(func.ts_rank(document, tsquery), trigram_rank))
+
+    def combine_ranks(self, *ranks):
+        return ranks[0] if len(ranks) == 1 else func.greatest(*ranks)
+
+_backends = {}
+_modes = {}
+
+def _detect_backend(engine):
+    """Trả về backend phù hợp, hoặc None nếu chưa kiểm tra được (DB chưa sẵn sàng)"""
+    if engine.dialect.name == 'sqlite':
+        return LikeSearchBackend(fold_in_sql=True)
+    if engine.dialect.name != 'postgresql':
+        return LikeSearchBackend()
+    try:
+        with engine.connect() as conn:
+            installed = {name for (name,) in conn.execute(text(
+                "SELECT extname FROM pg_extension WHERE extname IN ('pg_trgm', 'unaccent')"))}
+            has_function = conn.execute(text(
+                "SELECT 1 FROM pg_proc WHERE proname = 'f_unaccent'")).first() is not None
+            has_tsv = conn.execute(text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'medical_records' AND column_name = 'diagnosis_tsv'")).first() is not None
+    except Exception as e:
+        print(f"[SEARCH] Cannot detect search extensions: {e}")
+        return None
+    if {'pg_trgm', 'unaccent'} <= installed and has_function and has_tsv:
+        return TrigramSearchBackend()
+    return LikeSearchBackend()
+
+def init_search_backend(app):
+    """Cấu hình backend theo SEARCH_BACKEND (auto | trigram | like); SQLite được đăng ký hàm f_unaccent"""
+    _modes[app.name] = app.config.get('SEARCH_BACKEND', 'auto')
+    _backends.pop(app.name, None)
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            @event.listens_for(engine, 'connect')
+            def _register_unaccent(dbapi_connection, connection_record):
+                dbapi_connection.create_function('f_unaccent', 1, fold_text, deterministic=True)
+
+def get_search_backend():
+    """Backend của app hiện tại, nhận diện ở lần dùng đầu tiên"""
+    backend = _backends.get(current_app.name)
+    if backend is not None:
+        return backend
+
+    engine = db.engine
+    mode = _modes.get(current_app.name, 'auto')
+    if mode == 'trigram':
+        backend = TrigramSearchBackend()
+    elif mode == 'like':
+        backend = LikeSearchBackend(fold_in_sql=engine.dialect.name == 'sqlite')
+    else:
+        backend = _detect_backend(engine)
+        if backend is None:
+            # Chưa nhận diện được: dùng LIKE cho request này, thử lại ở request sau
+            return LikeSearchBackend()
+
+    _backends[current_app.name] = backend
+    print(f"[SEARCH] Using '{backend.name}' search backend")
+    return backend
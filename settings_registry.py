@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event, func
+from models import db, SystemSetting
+
+# =============================================
+# REGISTRY CÀI ĐẶT HỆ THỐNG (CACHE TRONG PROCESS, CÓ KIỂU)
+# =============================================
+# Toàn bộ bảng system_settings được nạp một lần vào bộ nhớ và ép kiểu theo data_type.
+# Phiên bản của bảng là MAX(updated_at):
+# - Process ghi (admin cập nhật) gọi bump_settings_version(), registry nạp lại ngay sau commit
+# - Các process khác kiểm tra phiên bản tối đa mỗi refresh_seconds (một truy vấn nhỏ),
+#   nên các lần đọc giá trị không tốn truy vấn nào.
+
+SESSION_KEY = 'settings_changed'
+TRUE_VALUES = ('true', '1', 'yes', 'on')
+
+def coerce_setting(value, data_type):
+    """Ép giá trị dạng chuỗi trong DB sang kiểu Python theo data_type"""
+    if value is None:
+        return None
+    try:
+        if data_type == 'integer':
+            return int(value)
+        if data_type == 'boolean':
+            return str(value).strip().lower() in TRUE_VALUES
+        if data_type == 'json':
+            return json.loads(value)
+    except (TypeError, ValueError) as e:
+        print(f"[SETTINGS] Cannot coerce {value!r} to {data_type}: {e}")
+    return value
+
+class SettingsRegistry:
+
+    def __init__(self, refresh_seconds=30):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._values = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def _current_version(self):
+        return db.session.query(func.max(SystemSetting.updated_at)).scalar()
+
+    def reload(self):
+        """Nạp lại toàn bộ cài đặt từ DB"""
+        rows = db.session.query(SystemSetting.key, SystemSetting.value, SystemSetting.data_type).all()
+        version = self._current_version()
+        values = {key: coerce_setting(value, data_type) for key, value, data_type in rows}
+        with self._lock:
+            self._values = values
+            self._version = version
+            self._checked_at = time.monotonic()
+        return values
+
+    def _snapshot(self):
+        """Trả về dict cài đặt hiện tại, nạp lại khi chưa có hoặc phiên bản trong DB đã đổi"""
+        values = self._values
+        if values is None:
+            return self.reload()
+        if time.monotonic() - self._checked_at < self.refresh_seconds:
+            return values
+        with self._lock:
+            self._checked_at = time.monotonic()
+        if self._current_version() != self._version:
+            return self.reload()
+        return values
+
+    def get(self, key, default=None):
+        value = self._snapshot().get(key)
+        return default if value is None else value
+
+    def all(self):
+        return dict(self._snapshot())
+
+    def invalidate(self):
+        """Bỏ dữ liệu đã nạp; lần đọc sau sẽ nạp lại"""
+        with self._lock:
+            self._values = None
+
+settings_registry = SettingsRegistry()
+
+def init_settings_registry(app):
+    settings_registry.refresh_seconds = app.config.get('SETTINGS_REFRESH_SECONDS', 30)
+
+def bump_settings_version(setting=None):
+    """
+    Đánh dấu cài đặt đã thay đổi trong transaction hiện tại (không commit).
+    updated_at của setting được đặt lại để các process khác thấy phiên bản mới.
+    """
+    if setting is not None:
+        setting.updated_at = datetime.utcnow()
+    db.session.info[SESSION_KEY] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _reload_after_commit(session):
+    if session.info.pop(SESSION_KEY, None):
+        settings_registry.invalidate()
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_after_rollback(session, previous_transaction):
+    if previous_transaction.parent is not None:
+        return
+    session.info.pop(SESSION_KEY, None)
@@ -0,0 +1,104 @@
+from datetime import time
+from functools import lru_cache
+
+# =============================================
+# SLOT ENGINE - SINH SLOT THEO PHÚT (INTEGER OFFSET)
+# =============================================
+# Slot được biểu diễn bằng số phút tính từ 00:00 (0..1440).
+# Lưới phút và nhãn 'HH:MM' được tính sẵn một lần rồi dùng lại,
+# nên việc sinh slot cho nhiều ca/ngày không còn gọi timedelta/strftime cho từng slot.
+
+MINUTES_PER_DAY = 24 * 60
+
+# Nhãn 'HH:MM' và đối tượng time cho mọi phút trong ngày (phút 1440 = '24:00' / 00:00)
+MINUTE_LABELS = tuple(f'{m // 60:02d}:{m % 60:02d}' for m in range(MINUTES_PER_DAY)) + ('24:00',)
+MINUTE_TIMES = tuple(time(m // 60, m % 60) for m in range(MINUTES_PER_DAY)) + (time(0, 0),)
+
+def to_minutes(t):
+    """Chuyển datetime.time sang số phút từ 00:00"""
+    return t.hour * 60 + t.minute
+
+@lru_cache(maxsize=1024)
+def minute_grid(start_minute, end_minute, step):
+    """
+    Lưới phút bắt đầu của các slot trong ca [start_minute, end_minute).
+    Kết quả được cache theo (giờ bắt đầu, giờ kết thúc, độ dài slot).
+    """
+    if step <= 0 or end_minute <= start_minute:
+        return ()
+    return tuple(range(start_minute, end_minute - step + 1, step))
+
+def schedule_grid(schedule, step):
+    """Lưới phút của một DoctorSchedule"""
+    return minute_grid(to_minutes(schedule.start_time), to_minutes(schedule.end_time), step)
+
+def schedule_time_slots(schedule, step):
+    """Danh sách (start_time, end_time) kiểu datetime.time của một ca làm việc"""
+    return [(MINUTE_TIMES[m], MINUTE_TIMES[m + step]) for m in schedule_grid(schedule, step)]
+
+def emit_available(jobs, step, booked, is_blocked=None):
+    """
+    Sinh slot còn trống cho nhiều (doctor_id, date, schedule) trong một lượt.
+    - jobs: iterable các bộ (doctor_id, date, schedule)
+    - booked: dict {(doctor_id, date, start_minute): số lịch đã đặt}
+    - is_blocked: hàm tùy chọn (doctor_id, date, start_minute, end_minute) -> bool (vd: ngày nghỉ)
+    Trả về dict {(doctor_id, date): [slot, ...]}.
+    """
+    result = {}
+    for doctor_id, slot_date, schedule in jobs:
+        capacity = schedule.max_patients
+        day_slots = result.setdefault((doctor_id, slot_date), [])
+        for m in schedule_grid(schedule, step):
+            if is_blocked is not None and is_blocked(doctor_id, slot_date, m, m + step):
+                continue
+            current_bookings = booked.get((doctor_id, slot_date, m), 0)
+            if current_bookings < capacity:
+                day_slots.append({
+                    'start_time': MINUTE_LABELS[m],
+                    'end_time': MINUTE_LABELS[m + step],
+                    'capacity': capacity - current_bookings
+                })
+    return result
+
+
+if __name__ == '__main__':
+    # Micro-benchmark: so sánh với vòng lặp timedelta/strftime cũ
+    # Chạy: python slot_engine.py
+    import timeit
+    from collections import namedtuple
+    from datetime import date, datetime, timedelta
+
+    Schedule = namedtuple('Schedule', 'start_time end_time max_patients')
+    schedules = [Schedule(time(7, 30), time(11, 30), 20), Schedule(time(13, 0), time(17, 0), 20)]
+    dates = [date(2025, 1, 6) + timedelta(days=i) for i in range(28)]
+    doctors = range(20)
+    step = 15
+    booked = {}
+
+    def legacy_loop():
+        out = []
+        for _doctor in doctors:
+            for target_date in dates:
+                for schedule in schedules:
+                    current_slot_start = datetime.combine(target_date, schedule.start_time)
+                    end = datetime.combine(target_date, schedule.end_time)
+                    while current_slot_start + timedelta(minutes=step) <= end:
+                        out.append({
+                            'start_time': current_slot_start.strftime('%H:%M'),
+                            'end_time': (current_slot_start + timedelta(minutes=step)).strftime('%H:%M'),
+                            'capacity': schedule.max_patients
+                        })
+                        current_slot_start += timedelta(minutes=step)
+        return out
+
+    def engine():
+        jobs = ((d, day, s) for d in doctors for day in dates for s in schedules)
+        return emit_available(jobs, step, booked)
+
+    runs = 20
+    legacy = timeit.timeit(legacy_loop, number=runs) / runs
+    fast = timeit.timeit(engine, number=runs) / runs
+    slots = sum(len(v) for v in engine().values())
+    print(f"{slots} slots / run ({len(doctors)} doctors x {len(dates)} days)")
+    print(f"legacy loop : {legacy * 1000:8.2f} ms")
+    print(f"slot_engine : {fast * 1000:8.2f} ms  (x{legacy / fast:.1f})")
@@ -0,0 +1,557 @@
+import heapq
+import threading
+import time
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, select, update, delete, text, and_, tuple_, values, column, Integer, Date, Time
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import db, Appointment, DoctorSchedule, DoctorSlot
+from utils import get_system_setting
+from leave_index import leave_index
+from availability_cache import availability_cache, mark_day_changed, mark_doctor_changed, mark_all_changed
+from rollups import mark_rollup_dirty
+from slot_engine import schedule_time_slots, schedule_grid, emit_available, to_minutes, MINUTE_TIMES, MINUTE_LABELS
+
+# Các trạng thái lịch hẹn đang chiếm chỗ trong slot
+BOOKED_STATUSES = ('pending', 'confirmed')
+
+# =============================================
+# SINH SLOT TỪ LỊCH LÀM VIỆC
+# =============================================
+
+def get_day_of_week(target_date):
+    """Chuyển date sang day_of_week của DoctorSchedule (0=CN, 1=Thứ 2, ..., 6=Thứ 7)"""
+    return (target_date.weekday() + 1) % 7
+
+def get_buffer_minutes():
+    """Độ dài một slot (phút) theo cấu hình hệ thống"""
+    return int(get_system_setting('appointment_buffer_minutes', '15'))
+
+def generate_schedule_slots(schedule, target_date, buffer_minutes):
+    """Sinh danh sách (start_time, end_time) của một ca làm việc trong ngày"""
+    return schedule_time_slots(schedule, buffer_minutes)
+
+# =============================================
+# BẢNG SLOT (doctor_slots)
+# =============================================
+
+def materialize_day(doctor_id, target_date):
+    """
+    Tạo các dòng doctor_slots của bác sĩ trong ngày từ DoctorSchedule.
+    booked_count được tính lại từ các lịch hẹn hiện có. Không commit.
+    Trả về False nếu bác sĩ không có lịch làm việc trong ngày.
+    """
+    schedules = DoctorSchedule.query.filter_by(
+        doctor_id=doctor_id,
+        day_of_week=get_day_of_week(target_date),
+        is_active=True
+    ).all()
+
+    if not schedules:
+        return False
+
+    booked_rows = db.session.query(
+        Appointment.appointment_time,
+        func.count(Appointment.id)
+    ).filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.appointment_date == target_date,
+        Appointment.status.in_(BOOKED_STATUSES)
+    ).group_by(Appointment.appointment_time).all()
+    booked_slots = {slot_time: count for slot_time, count in booked_rows}
+
+    buffer_minutes = get_buffer_minutes()
+    rows = {}
+    for schedule in schedules:
+        for start_time, end_time in generate_schedule_slots(schedule, target_date, buffer_minutes):
+            # Hai ca trùng giờ bắt đầu: lấy sức chứa lớn hơn
+            if start_time in rows and rows[start_time]['capacity'] >= schedule.max_patients:
+                continue
+            rows[start_time] = {
+                'doctor_id': doctor_id,
+                'slot_date': target_date,
+                'start_time': start_time,
+                'end_time': end_time,
+                'capacity': schedule.max_patients,
+                'booked_count': booked_slots.get(start_time, 0)
+            }
+
+    if rows:
+        # Nhiều request cùng materialize một ngày: bỏ qua dòng đã tồn tại
+        stmt = pg_insert(DoctorSlot).values(list(rows.values())).on_conflict_do_nothing(
+            index_elements=['doctor_id', 'slot_date', 'start_time']
+        )
+        db.session.execute(stmt)
+    return True
+
+def get_day_slots(doctor_id, target_date):
+    """
+    Đọc toàn bộ slot của bác sĩ trong ngày (một lần range read theo index).
+    Lần đọc đầu tiên sẽ materialize từ lịch làm việc.
+    Trả về None nếu bác sĩ không có lịch làm việc trong ngày.
+    """
+    query = DoctorSlot.query.filter_by(
+        doctor_id=doctor_id, slot_date=target_date
+    ).order_by(DoctorSlot.start_time)
+
+    slots = query.all()
+    if slots:
+        return slots
+
+    if not materialize_day(doctor_id, target_date):
+        return None
+    db.session.commit()
+    return query.all()
+
+def get_available_day_slots(doctor_id, target_date):
+    """
+    Slot còn trống của bác sĩ trong ngày (đã trừ ngày nghỉ), đọc qua availability_cache.
+    Trả về None nếu bác sĩ không có lịch làm việc trong ngày.
+    """
+    def load():
+        slots = get_day_slots(doctor_id, target_date)
+        if slots is None:
+            return None
+        return [{
+            'start_time': slot.start_time.strftime('%H:%M'),
+            'end_time': slot.end_time.strftime('%H:%M'),
+            'capacity': slot.capacity - slot.booked_count
+        } for slot in slots
+            if slot.booked_count < slot.capacity
+            and not leave_index.is_on_leave(doctor_id, target_date, slot.start_time, slot.end_time)]
+
+    return availability_cache.get_or_load(doctor_id, target_date, get_buffer_minutes(), load)
+
+def adjust_booked_count(doctor_id, slot_date, start_time, delta):
+    """Cộng/trừ booked_count của một slot đã materialize (không commit)"""
+    db.session.execute(
+        update(DoctorSlot).where(
+            DoctorSlot.doctor_id == doctor_id,
+            DoctorSlot.slot_date == slot_date,
+            DoctorSlot.start_time == start_time
+        ).values(
+            booked_count=func.greatest(DoctorSlot.booked_count + delta, 0),
+            updated_at=datetime.utcnow()
+        )
+    )
+    mark_day_changed(doctor_id, slot_date)
+
+def reserve_slot(doctor_id, slot_date, start_time):
+    """
+    Giữ một chỗ trong slot bằng UPDATE có điều kiện (booked_count < capacity).
+    Postgres khóa dòng slot trong lúc UPDATE nên nhiều worker đặt cùng lúc
+    không thể vượt sức chứa. Trả về True nếu giữ chỗ thành công. Không commit.
+    """
+    stmt = update(DoctorSlot).where(
+        DoctorSlot.doctor_id == doctor_id,
+        DoctorSlot.slot_date == slot_date,
+        DoctorSlot.start_time == start_time,
+        DoctorSlot.booked_count < DoctorSlot.capacity
+    ).values(
+        booked_count=DoctorSlot.booked_count + 1,
+        updated_at=datetime.utcnow()
+    ).returning(DoctorSlot.id)
+
+    if db.session.execute(stmt).first():
+        mark_day_changed(doctor_id, slot_date)
+        return True
+
+    # Slot đã đầy hoặc ngày chưa được materialize: tạo slot rồi thử lại một lần
+    if not materialize_day(doctor_id, slot_date) or db.session.execute(stmt).first() is None:
+        return False
+    mark_day_changed(doctor_id, slot_date)
+    return True
+
+def reserve_slots_bulk(requested):
+    """
+    Giữ chỗ cho nhiều slot trong một câu UPDATE ... FROM (SELECT ... FOR UPDATE).
+    - requested: dict {(doctor_id, slot_date, start_time): số chỗ cần giữ}
+    Mỗi slot được giữ tối đa số chỗ còn lại (min(yêu cầu, capacity - booked_count));
+    phần vượt quá do nơi gọi từ chối.
+    Trả về dict {key: số chỗ đã giữ} cho các slot giữ được ít nhất một chỗ. Không commit.
+    """
+    if not requested:
+        return {}
+
+    days = {(doctor_id, slot_date) for doctor_id, slot_date, _ in requested}
+    materialized = set(db.session.query(DoctorSlot.doctor_id, DoctorSlot.slot_date).filter(
+        tuple_(DoctorSlot.doctor_id, DoctorSlot.slot_date).in_(list(days))
+    ).distinct().all())
+    for doctor_id, slot_date in days - materialized:
+        materialize_day(doctor_id, slot_date)
+
+    requested_slots = values(
+        column('doctor_id', Integer),
+        column('slot_date', Date),
+        column('start_time', Time),
+        column('requested', Integer),
+        name='requested_slots'
+    ).data([(d, day, t, n) for (d, day, t), n in requested.items()])
+
+    # Khóa các slot trước rồi mới tính số chỗ còn lại, để hai batch chạy song song
+    # không cùng thấy một chỗ trống
+    granted = select(
+        DoctorSlot.id,
+        func.least(requested_slots.c.requested, DoctorSlot.capacity - DoctorSlot.booked_count).label('granted')
+    ).join(requested_slots, and_(
+        DoctorSlot.doctor_id == requested_slots.c.doctor_id,
+        DoctorSlot.slot_date == requested_slots.c.slot_date,
+        DoctorSlot.start_time == requested_slots.c.start_time
+    )).where(
+        DoctorSlot.booked_count < DoctorSlot.capacity
+    ).order_by(DoctorSlot.id).with_for_update(of=DoctorSlot).subquery('granted')
+
+    stmt = update(DoctorSlot).where(
+        DoctorSlot.id == granted.c.id,
+        DoctorSlot.booked_count + granted.c.granted <= DoctorSlot.capacity
+    ).values(
+        booked_count=DoctorSlot.booked_count + granted.c.granted,
+        updated_at=datetime.utcnow()
+    ).returning(DoctorSlot.doctor_id, DoctorSlot.slot_date, DoctorSlot.start_time, granted.c.granted)
+
+    reserved = {}
+    for doctor_id, slot_date, start_time, count in db.session.execute(stmt).all():
+        reserved[(doctor_id, slot_date, start_time)] = count
+        mark_day_changed(doctor_id, slot_date)
+    return reserved
+
+def release_slot(doctor_id, slot_date, start_time):
+    """Trả lại một chỗ của slot (không commit)"""
+    adjust_booked_count(doctor_id, slot_date, start_time, -1)
+
+def sync_slot_status(appointment, old_status):
+    """
+    Cập nhật booked_count khi lịch hẹn chuyển trạng thái (không commit).
+    Trả về False nếu lịch hẹn được mở lại nhưng slot đã hết chỗ.
+    """
+    was_booked = old_status in BOOKED_STATUSES
+    is_booked = appointment.status in BOOKED_STATUSES
+
+    if was_booked and not is_booked:
+        release_slot(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)
+    elif is_booked and not was_booked:
+        return reserve_slot(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)
+    return True
+
+def sync_slot_reschedule(appointment, old_date, old_time):
+    """
+    Chuyển một chỗ từ slot cũ sang slot mới khi đổi lịch (không commit).
+    Trả về False nếu slot mới đã hết chỗ.
+    """
+    if appointment.status not in BOOKED_STATUSES:
+        return True
+    if (old_date, old_time) == (appointment.appointment_date, appointment.appointment_time):
+        return True
+    if not reserve_slot(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time):
+        return False
+    release_slot(appointment.doctor_id, old_date, old_time)
+    return True
+
+def get_hold_expiry():
+    """Thời điểm hết hạn giữ chỗ cho lịch hẹn đang chờ thanh toán"""
+    hold_minutes = int(get_system_setting('appointment_hold_minutes', '15'))
+    return datetime.utcnow() + timedelta(minutes=hold_minutes)
+
+def is_doctor_on_leave(doctor_id, slot_date, start_time):
+    """Kiểm tra slot bắt đầu lúc start_time có trùng ngày nghỉ của bác sĩ không"""
+    end_time = (datetime.combine(slot_date, start_time) + timedelta(minutes=get_buffer_minutes())).time()
+    return leave_index.is_on_leave(doctor_id, slot_date, start_time, end_time)
+
+def invalidate_slots(doctor_id=None, from_date=None):
+    """
+    Xóa các slot từ from_date trở đi để materialize lại ở lần đọc sau.
+    Dùng khi lịch làm việc hoặc appointment_buffer_minutes thay đổi. Không commit.
+    """
+    stmt = delete(DoctorSlot).where(DoctorSlot.slot_date >= (from_date or date.today()))
+    if doctor_id is not None:
+        stmt = stmt.where(DoctorSlot.doctor_id == doctor_id)
+        mark_doctor_changed(doctor_id)
+    else:
+        mark_all_changed()
+    db.session.execute(stmt)
+
+# =============================================
+# AVAILABILITY NHIỀU BÁC SĨ / NHIỀU NGÀY
+# =============================================
+
+def build_availability(doctor_ids, date_from, date_to):
+    """
+    Tính slot còn trống cho nhiều bác sĩ trong khoảng ngày [date_from, date_to]
+    bằng một số truy vấn cố định (lịch làm việc, số lịch hẹn theo slot);
+    ngày nghỉ được trừ qua leave_index.
+    Trả về dict {doctor_id: {date: [slot, ...]}}.
+    """
+    if not doctor_ids:
+        return {}
+
+    schedules = DoctorSchedule.query.filter(
+        DoctorSchedule.doctor_id.in_(doctor_ids),
+        DoctorSchedule.is_active == True
+    ).order_by(DoctorSchedule.start_time).all()
+
+    leave_index.preload(doctor_ids)
+
+    booked_rows = db.session.query(
+        Appointment.doctor_id,
+        Appointment.appointment_date,
+        Appointment.appointment_time,
+        func.count(Appointment.id)
+    ).filter(
+        Appointment.doctor_id.in_(doctor_ids),
+        Appointment.appointment_date >= date_from,
+        Appointment.appointment_date <= date_to,
+        Appointment.status.in_(BOOKED_STATUSES)
+    ).group_by(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time
+    ).all()
+
+    schedules_by_day = {}
+    for schedule in schedules:
+        schedules_by_day.setdefault((schedule.doctor_id, schedule.day_of_week), []).append(schedule)
+
+    booked_slots = {
+        (doctor_id, appt_date, to_minutes(appt_time)): count
+        for doctor_id, appt_date, appt_time, count in booked_rows
+    }
+
+    def jobs():
+        current_date = date_from
+        while current_date <= date_to:
+            day_of_week = get_day_of_week(current_date)
+            for doctor_id in doctor_ids:
+                for schedule in schedules_by_day.get((doctor_id, day_of_week), ()):
+                    yield doctor_id, current_date, schedule
+            current_date += timedelta(days=1)
+
+    def on_leave(doctor_id, slot_date, start_minute, end_minute):
+        return leave_index.is_on_leave(doctor_id, slot_date, MINUTE_TIMES[start_minute], MINUTE_TIMES[end_minute])
+
+    emitted = emit_available(jobs(), get_buffer_minutes(), booked_slots, on_leave)
+
+    availability = {doctor_id: {} for doctor_id in doctor_ids}
+    for (doctor_id, slot_date), day_slots in emitted.items():
+        if day_slots:
+            availability[doctor_id][slot_date] = day_slots
+    return availability
+
+# =============================================
+# TÌM SLOT TRỐNG SỚM NHẤT (K-WAY MERGE)
+# =============================================
+
+def _iter_doctor_slots(doctor_id, schedules_by_dow, start_date, end_date, step, booked_for_day, not_before):
+    """
+    Luồng slot còn trống của một bác sĩ theo thứ tự thời gian.
+    Chỉ đọc số lịch đã đặt của một ngày khi luồng thật sự đi tới ngày đó.
+    """
+    current_date = start_date
+    while current_date <= end_date:
+        day_schedules = schedules_by_dow.get(get_day_of_week(current_date))
+        if day_schedules:
+            capacities = {}
+            for schedule in day_schedules:
+                for m in schedule_grid(schedule, step):
+                    capacities[m] = max(capacities.get(m, 0), schedule.max_patients)
+
+            for m in sorted(capacities):
+                slot_start = datetime.combine(current_date, MINUTE_TIMES[m])
+                if slot_start < not_before:
+                    continue
+                if leave_index.is_on_leave(doctor_id, current_date, MINUTE_TIMES[m], MINUTE_TIMES[m + step]):
+                    continue
+                current_bookings = booked_for_day(current_date).get((doctor_id, m), 0)
+                if current_bookings < capacities[m]:
+                    yield slot_start, doctor_id, {
+                        'doctor_id': doctor_id,
+                        'date': current_date.strftime('%Y-%m-%d'),
+                        'start_time': MINUTE_LABELS[m],
+                        'end_time': MINUTE_LABELS[m + step],
+                        'capacity': capacities[m] - current_bookings
+                    }
+        current_date += timedelta(days=1)
+
+def find_next_available(doctor_ids, limit, start_date, horizon_days):
+    """
+    Trả về tối đa `limit` slot trống sớm nhất của nhóm bác sĩ, bằng cách trộn
+    (heapq.merge) các luồng slot theo từng bác sĩ và dừng ngay khi đủ kết quả.
+    Mỗi ngày chỉ tốn một truy vấn đếm lịch hẹn (cho tất cả bác sĩ) khi luồng đi tới ngày đó.
+    """
+    if not doctor_ids or limit <= 0:
+        return []
+
+    schedules = DoctorSchedule.query.filter(
+        DoctorSchedule.doctor_id.in_(doctor_ids),
+        DoctorSchedule.is_active == True
+    ).all()
+
+    schedules_by_doctor = {}
+    for schedule in schedules:
+        schedules_by_doctor.setdefault(schedule.doctor_id, {}).setdefault(schedule.day_of_week, []).append(schedule)
+
+    scheduled_doctor_ids = list(schedules_by_doctor)
+    if not scheduled_doctor_ids:
+        return []
+    leave_index.preload(scheduled_doctor_ids)
+
+    booked_cache = {}
+
+    def booked_for_day(slot_date):
+        if slot_date not in booked_cache:
+            rows = db.session.query(
+                Appointment.doctor_id,
+                Appointment.appointment_time,
+                func.count(Appointment.id)
+            ).filter(
+                Appointment.doctor_id.in_(scheduled_doctor_ids),
+                Appointment.appointment_date == slot_date,
+                Appointment.status.in_(BOOKED_STATUSES)
+            ).group_by(Appointment.doctor_id, Appointment.appointment_time).all()
+            booked_cache[slot_date] = {
+                (doctor_id, to_minutes(appt_time)): count for doctor_id, appt_time, count in rows
+            }
+        return booked_cache[slot_date]
+
+    step = get_buffer_minutes()
+    end_date = start_date + timedelta(days=horizon_days - 1)
+    not_before = datetime.utcnow()
+
+    streams = [
+        _iter_doctor_slots(doctor_id, schedules_by_doctor[doctor_id], start_date, end_date,
+                           step, booked_for_day, not_before)
+        for doctor_id in scheduled_doctor_ids
+    ]
+
+    results = []
+    for _, _, slot in heapq.merge(*streams, key=lambda item: (item[0], item[1])):
+        results.append(slot)
+        if len(results) >= limit:
+            break
+    return results
+
+# =============================================
+# HẾT HẠN GIỮ CHỖ (HOLD SWEEPER)
+# =============================================
+
+# Một câu lệnh duy nhất: hủy lịch hẹn hết hạn, đánh dấu payment thất bại
+# và trả lại chỗ cho doctor_slots theo từng nhóm (doctor, ngày, giờ)
+EXPIRE_HOLDS_SQL = text("""
+    WITH expired AS (
+        UPDATE appointments
+        SET status = 'cancelled',
+            cancellation_reason = :reason,
+            cancelled_at = :now,
+            hold_expires_at = NULL,
+            updated_at = :now
+        WHERE status = 'pending' AND hold_expires_at < :now
+        RETURNING id, doctor_id, appointment_date, appointment_time
+    ),
+    failed_payments AS (
+        UPDATE payments
+        SET payment_status = 'failed', updated_at = :now
+        WHERE appointment_id IN (SELECT id FROM expired)
+          AND payment_status IN ('pending', 'processing')
+    ),
+    released AS (
+        SELECT doctor_id, appointment_date, appointment_time, COUNT(*) AS released_count
+        FROM expired
+        GROUP BY doctor_id, appointment_date, appointment_time
+    ),
+    slot_updates AS (
+        UPDATE doctor_slots s
+        SET booked_count = GREATEST(s.booked_count - r.released_count, 0), updated_at = :now
+        FROM released r
+        WHERE s.doctor_id = r.doctor_id
+          AND s.slot_date = r.appointment_date
+          AND s.start_time = r.appointment_time
+    )
+    SELECT doctor_id, appointment_date, SUM(released_count) FROM released
+    GROUP BY doctor_id, appointment_date
+""")
+
+HOLD_EXPIRED_REASON = 'Hết thời gian giữ chỗ do chưa thanh toán'
+
+def expire_holds():
+    """Hủy toàn bộ lịch hẹn pending đã hết hạn giữ chỗ. Trả về số lịch bị hủy. Không commit."""
+    rows = db.session.execute(EXPIRE_HOLDS_SQL, {
+        'now': datetime.utcnow(),
+        'reason': HOLD_EXPIRED_REASON
+    }).all()
+    for doctor_id, slot_date, _ in rows:
+        mark_day_changed(doctor_id, slot_date)
+    mark_rollup_dirty('appointments', {slot_date for _, slot_date, _ in rows})
+    return sum(int(count) for _, _, count in rows)
+
+def settle_paid_appointment(payment, transaction_id):
+    """
+    Ghi nhận thanh toán thành công (callback/IPN của MoMo, VNPay) và xác nhận lịch hẹn. Không commit.
+    Callback đến muộn sau khi expire_holds đã hủy lịch: giữ lại chỗ bằng reserve_slot rồi xác nhận lại.
+    Không giữ lại được (slot đã đầy, bác sĩ nghỉ) hoặc lịch đã bị hủy vì lý do khác:
+    payment chuyển sang 'refund_pending' thay vì 'completed' để xử lý hoàn tiền.
+    Trả về (payment đã completed hay chưa, appointment).
+    """
+    appointment = None
+    if payment.appointment_id:
+        # Khóa dòng lịch hẹn: hold sweeper chạy cùng lúc sẽ chờ rồi bỏ qua lịch đã confirmed
+        appointment = Appointment.query.filter_by(id=payment.appointment_id).with_for_update().first()
+
+    # Callback và IPN của cùng giao dịch: lần sau không xử lý lại
+    if payment.payment_status in ('completed', 'refund_pending'):
+        return payment.payment_status == 'completed', appointment
+
+    payment.payment_date = datetime.utcnow()
+    payment.transaction_id = transaction_id
+
+    if appointment is None or appointment.status in ('confirmed', 'checked_in', 'completed'):
+        payment.payment_status = 'completed'
+        return True, appointment
+
+    if appointment.status == 'pending':
+        appointment.status = 'confirmed'
+        appointment.hold_expires_at = None
+        payment.payment_status = 'completed'
+        return True, appointment
+
+    if (appointment.status == 'cancelled' and appointment.cancellation_reason == HOLD_EXPIRED_REASON
+            and not is_doctor_on_leave(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)
+            and reserve_slot(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time)):
+        appointment.status = 'confirmed'
+        appointment.cancellation_reason = None
+        appointment.cancelled_at = None
+        appointment.hold_expires_at = None
+        payment.payment_status = 'completed'
+        print(f"[PAYMENT] Re-confirmed expired appointment {appointment.appointment_code} after late payment")
+        return True, appointment
+
+    payment.payment_status = 'refund_pending'
+    payment.refund_reason = f'Lịch hẹn {appointment.appointment_code} đã bị hủy ({appointment.cancellation_reason or appointment.status}) trước khi nhận thanh toán'
+    print(f"[PAYMENT] Payment {payment.payment_code} needs refund: appointment "
+          f"{appointment.appointment_code} is {appointment.status}")
+    return False, appointment
+
+_sweeper_lock = threading.Lock()
+_sweeper_started = False
+
+def start_hold_sweeper(app):
+    """Chạy tiến trình nền định kỳ gọi expire_holds (mỗi process chỉ chạy một lần)"""
+    global _sweeper_started
+    with _sweeper_lock:
+        if _sweeper_started:
+            return
+        _sweeper_started = True
+
+    interval = app.config.get('HOLD_SWEEPER_INTERVAL_SECONDS', 60)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    expired_count = expire_holds()
+                    db.session.commit()
+                    if expired_count:
+                        print(f"[HOLD SWEEPER] Released {expired_count} expired holds")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[HOLD SWEEPER] Error: {e}")
+                finally:
+                    db.session.remove()
+
+    threading.Thread(target=run, name='hold-sweeper', daemon=True).start()
@@ -0,0 +1,169 @@
+import threading
+from datetime import date, timedelta
+from functools import wraps
+from flask import current_app, request, make_response
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from models import db, Doctor, Department, Review
+from cache import MISSING, CacheStats, LRUCacheBackend, create_backend
+
+# =============================================
+# CACHE KẾT QUẢ THỐNG KÊ (TTL THEO KỲ SỐ LIỆU)
+# =============================================
+# Key = (endpoint, query string). Mỗi entry lưu kèm "stamp" = phiên bản của các nhóm dữ liệu
+# mà endpoint phụ thuộc ('appointments', 'revenue', 'patients', 'doctors', 'reviews');
+# tăng phiên bản = xóa cả nhóm.
+# TTL theo kỳ của số liệu:
+# - Kỳ đã đóng (kết thúc trước hôm nay): STATS_CACHE_CLOSED_TTL_SECONDS (coi như vĩnh viễn)
+# - Chỉ hôm nay: STATS_CACHE_TODAY_TTL_SECONDS
+# - Kỳ đang mở (tháng/năm hiện tại, không giới hạn ngày): STATS_CACHE_CURRENT_TTL_SECONDS
+# Phiên bản được tăng sau commit khi lịch hẹn đổi trạng thái / payment hoàn tất (qua rollups),
+# khi bác sĩ / chuyên khoa ('doctors') hoặc đánh giá ('reviews') được thêm, sửa, xóa (event của
+# mapper bên dưới), và sau mỗi lần refresh_rollups ghi lại số liệu của các ngày đó.
+# Tên bác sĩ (bảng users) không có nhóm riêng: đổi tên hiển thị sau tối đa TTL.
+
+SESSION_KEY = 'stats_cache_dirty'
+
+class StatsCache:
+
+    def __init__(self, backend=None):
+        self.backend = backend or LRUCacheBackend()
+        self.closed_ttl = 86400
+        self.today_ttl = 30
+        self.current_ttl = 300
+        self.stats = CacheStats()
+        self._endpoint_stats = {}
+        self._lock = threading.Lock()
+
+    def configure(self, backend, closed_ttl, today_ttl, current_ttl):
+        self.backend = backend
+        self.closed_ttl = closed_ttl
+        self.today_ttl = today_ttl
+        self.current_ttl = current_ttl
+        self.stats.reset()
+        with self._lock:
+            self._endpoint_stats.clear()
+
+    def ttl_for(self, period, today=None):
+        """period = (ngày bắt đầu, ngày kết thúc - không tính) hoặc None nếu không giới hạn"""
+        today = today or date.today()
+        if period is None:
+            return self.current_ttl
+        start, end = period
+        if end <= today:
+            return self.closed_ttl
+        if start >= today and end <= today + timedelta(days=1):
+            return self.today_ttl
+        return self.current_ttl
+
+    def _record(self, endpoint, hit):
+        self.stats.record(hit)
+        with self._lock:
+            stats = self._endpoint_stats.get(endpoint)
+            if stats is None:
+                stats = self._endpoint_stats[endpoint] = CacheStats()
+        stats.record(hit)
+
+    def get_or_load(self, endpoint, params, groups, period, loader):
+        """loader() trả về (body, status); chỉ response 200 được lưu"""
+        key = ('stats', endpoint, params)
+        stamp = tuple(self.backend.get_counters([('gen', group) for group in groups]))
+
+        entry = self.backend.get(key)
+        if entry is not MISSING and entry[0] == stamp:
+            self._record(endpoint, hit=True)
+            return entry[1], 200
+
+        self._record(endpoint, hit=False)
+        body, status = loader()
+        if status == 200:
+            self.backend.set(key, (stamp, body), ttl=self.ttl_for(period))
+        return body, status
+
+    def invalidate(self, groups):
+        for group in groups:
+            self.backend.incr(('gen', group))
+        self.stats.record_invalidation(len(groups))
+
+    def as_dict(self):
+        with self._lock:
+            endpoints = {name: stats.as_dict() for name, stats in self._endpoint_stats.items()}
+        return dict(self.stats.as_dict(), entries=len(self.backend), endpoints=endpoints)
+
+stats_cache = StatsCache()
+
+def init_stats_cache(app):
+    """Chọn backend theo cấu hình (STATS_CACHE_URL trống = LRU trong process)"""
+    backend = create_backend(
+        app.config.get('STATS_CACHE_URL'),
+        maxsize=app.config.get('STATS_CACHE_SIZE', 512),
+        prefix='stats'
+    )
+    stats_cache.configure(
+        backend,
+        closed_ttl=app.config.get('STATS_CACHE_CLOSED_TTL_SECONDS', 86400),
+        today_ttl=app.config.get('STATS_CACHE_TODAY_TTL_SECONDS', 30),
+        current_ttl=app.config.get('STATS_CACHE_CURRENT_TTL_SECONDS', 300)
+    )
+
+def cached_stats(groups, period=None):
+    """
+    Decorator cho endpoint thống kê (đặt sau các decorator phân quyền).
+    period(args) trả về kỳ số liệu (start, end) để chọn TTL, None = kỳ đang mở.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            params = tuple(sorted(request.args.items(multi=True)))
+            try:
+                data_period = period(request.args) if period else None
+            except (ValueError, TypeError):
+                data_period = None
+
+            def load():
+                response = make_response(fn(*args, **kwargs))
+                return response.get_data(), response.status_code
+
+            body, status = stats_cache.get_or_load(request.endpoint, params, groups, data_period, load)
+            return current_app.response_class(body, status=status, mimetype='application/json')
+        return wrapper
+    return decorator
+
+# =============================================
+# ĐÁNH DẤU THAY ĐỔI TRONG TRANSACTION
+# =============================================
+
+def mark_stats_changed(groups, session=None):
+    """Nhóm số liệu thay đổi; cache được xóa sau khi transaction commit"""
+    session = session or db.session
+    session.info.setdefault(SESSION_KEY, set()).update(groups)
+
+def _on_change(group):
+    def listener(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            mark_stats_changed({group}, session)
+    return listener
+
+for _name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Doctor, _name, _on_change('doctors'))
+    event.listen(Department, _name, _on_change('doctors'))
+    event.listen(Review, _name, _on_change('reviews'))
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_invalidations(session):
+    groups = session.info.pop(SESSION_KEY, None)
+    if not groups:
+        return
+    try:
+        stats_cache.invalidate(sorted(groups))
+    except Exception as e:
+        # Lỗi cache không được làm hỏng request đã commit; entry cũ sẽ hết hạn theo TTL
+        print(f"[STATS CACHE] Invalidation error: {e}")
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_invalidations(session, previous_transaction):
+    # SAVEPOINT bị rollback: transaction ngoài vẫn có thể commit
+    if previous_transaction.parent is not None:
+        return
+    session.info.pop(SESSION_KEY, None)
@@ -0,0 +1,27 @@
+import os
+import pytest
+
+# Cần Postgres đã chạy migration (flask db upgrade): chỉ chạy khi DATABASE_URL được đặt rõ ràng
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+pytestmark = pytest.mark.skipif(
+    not DATABASE_URL.startswith('postgresql'),
+    reason='DATABASE_URL does not point to a PostgreSQL database'
+)
+
+@pytest.fixture
+def app():
+    from run import create_app
+    return create_app()
+
+def test_main_queries_use_expected_indexes(app):
+    """Giống flask check-query-plans: mọi truy vấn trong PLAN_CHECKS phải dùng một index mong đợi"""
+    from query_plans import check_query_plans
+
+    with app.app_context():
+        results = check_query_plans()
+
+    failures = [f"{name}: uses {', '.join(used) or 'no index'} (expected one of: {', '.join(expected)})"
+                for name, ok, used, expected in results if not ok]
+    assert results
+    assert not failures, "\n".join(failures)
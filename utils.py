@@ -1,19 +1,48 @@
-import random
-import string
 import pytz
 from datetime import datetime
 from functools import wraps
-from flask import jsonify
-from flask_jwt_extended import get_jwt_identity
-from models import db, ActivityLog, SystemSetting, Patient, User, Doctor
+from flask import jsonify, current_app, g, has_request_context
+from flask_jwt_extended import get_jwt_identity, get_jwt
+from sqlalchemy.exc import IntegrityError
+from models import db, Patient, User, Doctor
+from audit import record_activity
+from codes import next_code
+from settings_registry import settings_registry
+from cache import LRUCacheBackend, MISSING, create_backend
 
 # --- CÁC HẰNG SỐ ---
 VIETNAM_TIMEZONE = pytz.timezone('Asia/Ho_Chi_Minh')
 
-def generate_code(prefix='AP', length=8):
-    """Tạo mã code ngẫu nhiên cho Appointment, Patient, Payment..."""
-    chars = string.ascii_uppercase + string.digits
-    return prefix + ''.join(random.choice(chars) for _ in range(length))
+def generate_code(prefix='AP'):
+    """Tạo mã code (tăng dần theo thời gian, không trùng) cho Appointment, Patient, Payment..."""
+    return next_code(prefix)
+
+CODE_INSERT_ATTEMPTS = 3
+
+def flush_with_unique_code(obj, field, prefix):
+    """
+    Thêm obj (chưa có trong session) và flush trong SAVEPOINT; nếu mã ở cột unique `field`
+    bị trùng (IntegrityError nhắc tới cột đó) thì sinh mã mới và thử lại. Không commit.
+    """
+    for attempt in range(CODE_INSERT_ATTEMPTS):
+        try:
+            # begin_nested() flush các thay đổi đang chờ trước khi mở SAVEPOINT,
+            # nên obj phải được add bên trong để INSERT của nó nằm trong SAVEPOINT
+            with db.session.begin_nested():
+                db.session.add(obj)
+                db.session.flush([obj])
+            return
+        except IntegrityError as e:
+            if field not in str(e.orig) or attempt == CODE_INSERT_ATTEMPTS - 1:
+                raise
+            print(f"[CODES] Duplicate {field} {getattr(obj, field)}, retrying with a new code")
+            setattr(obj, field, next_code(prefix))
+
+def _query_patient_id(user_id):
+    return db.session.query(Patient.id).filter(Patient.user_id == user_id).scalar()
+
+def _query_doctor_id(user_id):
+    return db.session.query(Doctor.id).filter(Doctor.user_id == user_id).scalar()
 
 def get_patient_id_from_user(user_id):
     """Lấy patient_id từ user_id (Dành cho role 'patient')"""
@@ -21,8 +50,10 @@ def get_patient_id_from_user(user_id):
         uid = int(user_id)
     except Exception:
         uid = user_id
-    patient = Patient.query.filter_by(user_id=uid).first()
-    return patient.id if patient else None
+    identity = current_identity()
+    if identity is not None and identity.user_id == uid:
+        return identity.patient_id
+    return _query_patient_id(uid)
 
 def get_doctor_id_from_user(user_id):
     """Lấy doctor_id từ user_id (Dành cho role 'doctor')"""
@@ -30,31 +61,21 @@ def get_doctor_id_from_user(user_id):
         uid = int(user_id)
     except Exception:
         uid = user_id
-    doctor = Doctor.query.filter_by(user_id=uid).first()
-    return doctor.id if doctor else None
+    identity = current_identity()
+    if identity is not None and identity.user_id == uid:
+        return identity.doctor_id
+    return _query_doctor_id(uid)
 
 def get_system_setting(key, default=None):
-    """Lấy giá trị từ bảng SystemSettings"""
-    setting = SystemSetting.query.filter_by(key=key).first()
-    if setting:
-        return setting.value
-    return default
+    """Lấy giá trị (đã ép kiểu theo data_type) từ registry cài đặt, không truy vấn DB"""
+    return settings_registry.get(key, default)
 
 def log_activity(user_id, action, entity_type=None, entity_id=None, description=''):
-    """Ghi lại hoạt động của người dùng"""
-    try:
-        log = ActivityLog(
-            user_id=user_id, 
-            action=action, 
-            entity_type=entity_type, 
-            entity_id=entity_id, 
-            description=description,
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception as e:
-        print(f"ERROR LOGGING ACTIVITY: {e}")
-        db.session.rollback()
+    """
+    Ghi lại hoạt động của người dùng.
+    Bản ghi được đưa vào audit_writer (ghi theo lô ở thread nền), không commit session của request.
+    """
+    record_activity(user_id, action, entity_type, entity_id, description)
 
 def utc_to_vn_time(utc_datetime):
     """Chuyển đổi datetime từ UTC sang múi giờ Việt Nam"""
@@ -62,62 +83,173 @@ def utc_to_vn_time(utc_datetime):
         utc_datetime = pytz.utc.localize(utc_datetime)
     return utc_datetime.astimezone(VIETNAM_TIMEZONE)
 
+# =============================================
+# JWT CLAIMS & TRẠNG THÁI TÀI KHOẢN
+# =============================================
+# Các decorator phân quyền đọc claims đã ký trong token (patient_id, doctor_id) nên không cần
+# truy vấn User cho mỗi request. Trạng thái tài khoản (is_active, role) được đối chiếu qua
+# một cache ngắn hạn (AUTH_STATUS_CACHE_SECONDS, 0 = tắt kiểm tra, khi đó role lấy từ claim):
+# mỗi entry lưu kèm phiên bản của user trong backend (AUTH_STATUS_CACHE_URL = redis://...
+# để chia sẻ giữa các worker), invalidate_user_status tăng phiên bản nên việc khóa tài khoản
+# hoặc đổi role có hiệu lực ngay ở mọi worker thay vì chờ token hết hạn.
+
+_user_status_cache = LRUCacheBackend(maxsize=10000)
+
+def init_user_status_cache(app):
+    """Chọn backend theo cấu hình (AUTH_STATUS_CACHE_URL trống = LRU trong process)"""
+    global _user_status_cache
+    _user_status_cache = create_backend(
+        app.config.get('AUTH_STATUS_CACHE_URL'),
+        maxsize=app.config.get('AUTH_STATUS_CACHE_SIZE', 10000),
+        prefix='auth'
+    )
+
+def build_identity_claims(user):
+    """Claims bổ sung khi tạo access token"""
+    claims = {'role': user.role}
+    if user.role == 'patient':
+        claims['patient_id'] = _query_patient_id(user.id)
+    elif user.role == 'doctor':
+        claims['doctor_id'] = _query_doctor_id(user.id)
+    return claims
+
+def get_user_status(user_id):
+    """
+    (is_active, role) hiện tại của tài khoản, dùng cache ngắn hạn để tránh truy vấn mỗi request.
+    None nếu tắt kiểm tra (AUTH_STATUS_CACHE_SECONDS = 0).
+    """
+    ttl = current_app.config.get('AUTH_STATUS_CACHE_SECONDS', 60)
+    if not ttl:
+        return None
+
+    # Phiên bản đọc trước khi truy vấn DB: thay đổi commit sau đó làm entry vừa ghi hết hiệu lực
+    version = _user_status_cache.get_counters([('gen', 'user', user_id)])[0]
+    entry = _user_status_cache.get(('user', user_id))
+    if entry is not MISSING and entry[0] == version:
+        return entry[1]
+
+    row = db.session.query(User.is_active, User.role).filter(User.id == user_id).first()
+    status = (bool(row.is_active), row.role) if row else (False, None)
+    _user_status_cache.set(('user', user_id), (version, status), ttl=ttl)
+    return status
+
+def is_user_active(user_id):
+    """Kiểm tra tài khoản còn hoạt động"""
+    status = get_user_status(user_id)
+    return status is None or status[0]
+
+def invalidate_user_status(user_id):
+    """Bỏ trạng thái đã cache ở mọi worker (gọi sau khi commit khóa/mở khóa tài khoản hoặc đổi role)"""
+    _user_status_cache.incr(('gen', 'user', int(user_id)))
+
+# =============================================
+# DANH TÍNH CỦA REQUEST HIỆN TẠI (flask.g)
+# =============================================
+
+class RequestIdentity:
+    """
+    Danh tính người dùng của request hiện tại (g.identity).
+    role/patient_id/doctor_id lấy từ claims của token; token cũ thiếu claim
+    thì truy vấn DB một lần và giữ lại cho đến hết request.
+    Role trong claim được thay bằng role hiện tại của tài khoản khi bật kiểm tra trạng thái.
+    """
+
+    def __init__(self, user_id, claims):
+        self.user_id = user_id
+        self._role = claims.get('role', MISSING)
+        self._patient_id = claims.get('patient_id', MISSING)
+        self._doctor_id = claims.get('doctor_id', MISSING)
+        self._status = MISSING
+
+    @property
+    def status(self):
+        """(is_active, role) từ get_user_status, đọc một lần cho mỗi request"""
+        if self._status is MISSING:
+            self._status = get_user_status(self.user_id)
+            if self._status is not None and self._status[1] != self._role:
+                # Role trong DB khác claim (đã đổi role sau khi cấp token): bỏ các claim không còn đúng
+                self._role = self._status[1]
+                self._patient_id = MISSING
+                self._doctor_id = MISSING
+        return self._status
+
+    @property
+    def role(self):
+        if self._role is MISSING:
+            self._role = db.session.query(User.role).filter(User.id == self.user_id).scalar()
+        return self._role
+
+    @property
+    def patient_id(self):
+        self.status
+        if self._patient_id is MISSING:
+            self._patient_id = _query_patient_id(self.user_id) if self.role == 'patient' else None
+        return self._patient_id
+
+    @property
+    def doctor_id(self):
+        self.status
+        if self._doctor_id is MISSING:
+            self._doctor_id = _query_doctor_id(self.user_id) if self.role == 'doctor' else None
+        return self._doctor_id
+
+def current_identity():
+    """Danh tính của request hiện tại, None nếu request không có JWT đã xác thực"""
+    identity = g.get('identity') if has_request_context() else None
+    if identity is not None:
+        return identity
+    try:
+        user_id = get_jwt_identity()
+    except RuntimeError:
+        return None
+    if user_id is None:
+        return None
+    g.identity = RequestIdentity(int(user_id), get_jwt())
+    return g.identity
+
+def get_current_role():
+    """
+    Role của người dùng hiện tại: theo trạng thái tài khoản đã cache (None nếu tài khoản bị khóa);
+    tắt kiểm tra trạng thái thì lấy từ claims, token cũ thiếu claim thì đọc từ DB
+    """
+    identity = current_identity()
+    if identity is None:
+        return None
+    status = identity.status
+    if status is not None and not status[0]:
+        return None
+    return identity.role
+
 # =============================================
 # ROLE-BASED DECORATORS
 # =============================================
 
+def roles_required(roles, message):
+    """Decorator yêu cầu role nằm trong roles (dùng sau @jwt_required)"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            status = current_identity().status
+            if status is not None and not status[0]:
+                return jsonify({"msg": "Account is inactive. Please log in again"}), 401
+            if get_current_role() not in roles:
+                return jsonify({"msg": message}), 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
 def admin_required(fn):
     """Decorator yêu cầu role admin"""
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or user.role != 'admin':
-            return jsonify({"msg": "Admin access required"}), 403
-        
-        return fn(*args, **kwargs)
-    
-    return wrapper
+    return roles_required(('admin',), "Admin access required")(fn)
 
 def doctor_required(fn):
     """Decorator yêu cầu role doctor"""
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or user.role != 'doctor':
-            return jsonify({"msg": "Doctor access required"}), 403
-        
-        return fn(*args, **kwargs)
-    
-    return wrapper
+    return roles_required(('doctor',), "Doctor access required")(fn)
 
 def patient_required(fn):
     """Decorator yêu cầu role patient"""
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or user.role != 'patient':
-            return jsonify({"msg": "Patient access required"}), 403
-        
-        return fn(*args, **kwargs)
-    
-    return wrapper
+    return roles_required(('patient',), "Patient access required")(fn)
 
 def staff_or_admin_required(fn):
     """Decorator yêu cầu role staff hoặc admin"""
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or user.role not in ['admin', 'staff']:
-            return jsonify({"msg": "Staff or Admin access required"}), 403
-        
-        return fn(*args, **kwargs)
-    
-    return wrapper
\ No newline at end of file
+    return roles_required(('admin', 'staff'), "Staff or Admin access required")(fn)